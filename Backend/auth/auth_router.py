@@ -1,28 +1,43 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Request
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
 from datetime import timedelta
+from typing import Optional
 from bson import ObjectId
 import logging
 
 from db.mongo import users_collection
 from models.user_model import UserCreate, UserLogin, UserOut, TokenResponse
-from utils.jwt_handler import create_access_token, decode_token, JWT_EXP_MIN
+from utils.jwt_handler import create_access_token, decode_token, JWT_EXP_MIN, JWT_EMBED_PROFILE
+from utils.password_hasher import password_hasher, PasswordHasherBusy
+from utils.user_cache import user_cache
+from utils.metrics import stage_timer
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+async def get_password_hash(password: str) -> str:
+    return await password_hasher.hash(password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.verify(plain_password, hashed_password)
+
+def _hasher_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server busy, please retry",
+        headers={"Retry-After": "1"},
+    )
 
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserOut:
+    # Fast path: token already verified and user already resolved
+    cached_user = user_cache.get(token)
+    if cached_user is not None:
+        return cached_user
+
     try:
         payload = decode_token(token)
         if payload is None:
@@ -40,8 +55,15 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserOut:
                 headers={"WWW-Authenticate": "Bearer"},
             )
             
+        # Signed profile claims (JWT_EMBED_PROFILE): no database lookup needed
+        if JWT_EMBED_PROFILE and payload.get("name") and payload.get("email"):
+            current_user = UserOut(id=user_id, name=payload["name"], email=payload["email"])
+            user_cache.put(token, user_id, current_user, payload.get("exp"))
+            return current_user
+
         try:
-            user = await users_collection.find_one({"_id": ObjectId(user_id)})
+            with stage_timer("auth", "db"):
+                user = await users_collection.find_one({"_id": ObjectId(user_id)})
         except Exception as e:
             logger.error(f"Error querying user from database: {str(e)}")
             raise HTTPException(
@@ -56,7 +78,9 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserOut:
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
-        return UserOut(id=str(user["_id"]), name=user["name"], email=user["email"])
+        current_user = UserOut(id=str(user["_id"]), name=user["name"], email=user["email"])
+        user_cache.put(token, user_id, current_user, payload.get("exp"))
+        return current_user
     except HTTPException:
         raise
     except Exception as e:
@@ -66,18 +90,35 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserOut:
             detail="Internal server error"
         )
 
+async def get_client_key(request: Request, token: Optional[str] = Depends(optional_oauth2_scheme)) -> str:
+    """
+    Identifies the caller for rate limiting on endpoints where auth is optional:
+    the JWT subject when a valid token is sent, the client IP otherwise.
+    No database lookup is performed.
+    """
+    if token:
+        payload = decode_token(token)
+        if payload and payload.get("sub"):
+            return f"user:{payload['sub']}"
+    host = request.client.host if request.client else "unknown"
+    return f"ip:{host}"
+
 @router.post("/register", response_model=UserOut, status_code=status.HTTP_201_CREATED)
 async def register(user: UserCreate):
     # Check if user already exists
-    existing_user = await users_collection.find_one({"email": user.email})
+    with stage_timer("auth", "db"):
+        existing_user = await users_collection.find_one({"email": user.email})
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
-    # Hash password and save
-    hashed_password = get_password_hash(user.password)
+    # Hash password (off the event loop) and save
+    try:
+        hashed_password = await get_password_hash(user.password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
     new_user = {
         "name": user.name,
         "email": user.email,
@@ -97,7 +138,8 @@ async def register(user: UserCreate):
 async def login(user_credentials: UserLogin):
     try:
         # Find user in database
-        user = await users_collection.find_one({"email": user_credentials.email})
+        with stage_timer("auth", "db"):
+            user = await users_collection.find_one({"email": user_credentials.email})
         if not user:
             logger.warning(f"Login attempt with non-existent email: {user_credentials.email}")
             raise HTTPException(
@@ -105,19 +147,33 @@ async def login(user_credentials: UserLogin):
                 detail="Invalid credentials"
             )
         
-        # Verify password
-        if not verify_password(user_credentials.password, user["password"]):
+        # Verify password (off the event loop)
+        try:
+            valid, new_hash = await password_hasher.verify_and_update(
+                user_credentials.password, user["password"]
+            )
+        except PasswordHasherBusy:
+            raise _hasher_busy()
+        if not valid:
             logger.warning(f"Invalid password attempt for email: {user_credentials.email}")
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid credentials"
             )
+
+        # Stored hash uses another bcrypt cost: replace it transparently
+        if new_hash:
+            await users_collection.update_one({"_id": user["_id"]}, {"$set": {"password": new_hash}})
+            user_cache.invalidate_user(str(user["_id"]))
         
         # Create access token
         try:
             access_token_expires = timedelta(minutes=JWT_EXP_MIN)
+            claims = {"sub": str(user["_id"])}
+            if JWT_EMBED_PROFILE:
+                claims.update(name=user["name"], email=user["email"])
             access_token = create_access_token(
-                data={"sub": str(user["_id"])},
+                data=claims,
                 expires_delta=access_token_expires
             )
         except Exception as e:
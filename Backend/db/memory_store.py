@@ -0,0 +1,319 @@
+"""
+In-process stand-in for the MongoDB collections, for local runs and load tests.
+
+Enabled with MONGO_URI=memory:// (see db/mongo.py). It implements the subset
+of the Motor API used by this backend (find_one, find, insert_one/many,
+update_one with $set/$inc/$push/$setOnInsert and upsert, delete_one/many,
+distinct, count_documents, bulk_write, create_collection) with plain equality and comparison filters.
+Data lives in the process and is lost on restart; MONGO_SEED_FILE can point
+to a JSON file ({"collection": [documents...]}) loaded at startup.
+"""
+import copy
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+
+logger = logging.getLogger(__name__)
+
+
+class InsertOneResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class InsertManyResult:
+    def __init__(self, inserted_ids):
+        self.inserted_ids = inserted_ids
+
+
+class UpdateResult:
+    def __init__(self, matched_count: int, modified_count: int, upserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+
+
+class DeleteResult:
+    def __init__(self, deleted_count: int):
+        self.deleted_count = deleted_count
+
+
+def _get(doc: dict, path: str):
+    value: Any = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+_OPERATORS = {
+    "$eq": lambda v, arg: v == arg,
+    "$ne": lambda v, arg: v != arg,
+    "$gt": lambda v, arg: v is not None and v > arg,
+    "$gte": lambda v, arg: v is not None and v >= arg,
+    "$lt": lambda v, arg: v is not None and v < arg,
+    "$lte": lambda v, arg: v is not None and v <= arg,
+    "$in": lambda v, arg: v in arg,
+    "$nin": lambda v, arg: v not in arg,
+    "$exists": lambda v, arg: (v is not None) == bool(arg),
+}
+
+
+def _matches(doc: dict, query: Optional[dict]) -> bool:
+    for key, condition in (query or {}).items():
+        value = _get(doc, key)
+        if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+            for op, arg in condition.items():
+                if op not in _OPERATORS:
+                    raise NotImplementedError(f"Operator {op} is not supported by the memory store")
+                if not _OPERATORS[op](value, arg):
+                    return False
+        elif isinstance(value, list) and not isinstance(condition, list):
+            if condition not in value:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _set(doc: dict, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _apply_update(doc: dict, update: dict, inserting: bool = False):
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == "$set":
+                _set(doc, path, copy.deepcopy(value))
+            elif op == "$setOnInsert":
+                if inserting:
+                    _set(doc, path, copy.deepcopy(value))
+            elif op == "$inc":
+                _set(doc, path, (_get(doc, path) or 0) + value)
+            elif op == "$push":
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                current = _get(doc, path)
+                if current is None:
+                    current = []
+                    _set(doc, path, current)
+                current.extend(copy.deepcopy(items))
+                if isinstance(value, dict) and "$slice" in value and value["$slice"] < 0:
+                    del current[:value["$slice"]]
+            elif op == "$unset":
+                parent = _get(doc, path.rpartition(".")[0]) if "." in path else doc
+                if isinstance(parent, dict):
+                    parent.pop(path.rpartition(".")[2], None)
+            else:
+                raise NotImplementedError(f"Update operator {op} is not supported by the memory store")
+
+
+def _project(doc: dict, projection: Optional[dict]) -> dict:
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    included = [k for k, v in projection.items() if v and k != "_id"]
+    if included:
+        result = {k: doc[k] for k in included if k in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    for key, value in projection.items():
+        if not value:
+            doc.pop(key, None)
+    return doc
+
+
+class _BulkOperations:
+    """Collects the operations passed to bulk_write (the `bulkobj` side of PyMongo's `_add_to_bulk`)."""
+
+    def __init__(self):
+        self.ops: List[tuple] = []
+
+    def add_insert(self, document: dict):
+        self.ops.append(("insert", (document,)))
+
+    def add_update(self, selector: dict, update: dict, multi: bool, upsert: bool, **options):
+        self.ops.append(("update", (selector, update, multi, bool(upsert))))
+
+    def add_replace(self, selector: dict, replacement: dict, upsert: bool, **options):
+        raise NotImplementedError("ReplaceOne is not supported by the memory store")
+
+    def add_delete(self, selector: dict, limit: int, **options):
+        self.ops.append(("delete", (selector, limit)))
+
+
+class MemoryCursor:
+    def __init__(self, docs: List[dict], projection: Optional[dict] = None):
+        self._docs = docs
+        self._projection = projection
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction: int = 1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self._docs.sort(key=lambda d: (_get(d, field) is not None, _get(d, field)), reverse=order < 0)
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def _results(self) -> List[dict]:
+        docs = self._docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return [_project(d, self._projection) for d in docs]
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        results = self._results()
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        self._iter = iter(self._results())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class MemoryCollection:
+    def __init__(self, name: str):
+        self.name = name
+        self._docs: List[dict] = []
+
+    def _find(self, query: Optional[dict]) -> List[dict]:
+        return [d for d in self._docs if _matches(d, query)]
+
+    async def find_one(self, query: Optional[dict] = None, projection: Optional[dict] = None) -> Optional[dict]:
+        for doc in self._docs:
+            if _matches(doc, query):
+                return _project(doc, projection)
+        return None
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None) -> MemoryCursor:
+        return MemoryCursor(self._find(query), projection)
+
+    async def insert_one(self, document: dict) -> InsertOneResult:
+        doc = copy.deepcopy(document)
+        doc.setdefault("_id", ObjectId())
+        self._docs.append(doc)
+        # Like PyMongo, the caller's document receives the generated _id
+        document.setdefault("_id", doc["_id"])
+        return InsertOneResult(doc["_id"])
+
+    async def insert_many(self, documents: List[dict], ordered: bool = True) -> InsertManyResult:
+        ids = [(await self.insert_one(doc)).inserted_id for doc in documents]
+        return InsertManyResult(ids)
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        for doc in self._docs:
+            if _matches(doc, query):
+                _apply_update(doc, update)
+                return UpdateResult(1, 1)
+        if not upsert:
+            return UpdateResult(0, 0)
+        doc = {k: copy.deepcopy(v) for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+        _apply_update(doc, update, inserting=True)
+        result = await self.insert_one(doc)
+        return UpdateResult(0, 0, result.inserted_id)
+
+    async def update_many(self, query: dict, update: dict) -> UpdateResult:
+        docs = self._find(query)
+        for doc in docs:
+            _apply_update(doc, update)
+        return UpdateResult(len(docs), len(docs))
+
+    async def bulk_write(self, requests: list, ordered: bool = True) -> UpdateResult:
+        # PyMongo operations (InsertOne, UpdateOne, UpdateMany, DeleteOne...) describe
+        # themselves through their bulk contract, replayed here on the memory collection
+        bulk = _BulkOperations()
+        for request in requests:
+            request._add_to_bulk(bulk)
+        matched = 0
+        for op, args in bulk.ops:
+            if op == "insert":
+                await self.insert_one(*args)
+            elif op == "update":
+                selector, update, multi, upsert = args
+                if multi:
+                    result = await self.update_many(selector, update)
+                else:
+                    result = await self.update_one(selector, update, upsert=upsert)
+                matched += result.matched_count
+            else:
+                selector, limit = args
+                await (self.delete_one(selector) if limit == 1 else self.delete_many(selector))
+        return UpdateResult(matched, matched, None)
+
+    async def delete_one(self, query: dict) -> DeleteResult:
+        for i, doc in enumerate(self._docs):
+            if _matches(doc, query):
+                del self._docs[i]
+                return DeleteResult(1)
+        return DeleteResult(0)
+
+    async def delete_many(self, query: dict) -> DeleteResult:
+        kept = [d for d in self._docs if not _matches(d, query)]
+        deleted = len(self._docs) - len(kept)
+        self._docs = kept
+        return DeleteResult(deleted)
+
+    async def distinct(self, key: str, query: Optional[dict] = None) -> list:
+        values = []
+        for doc in self._find(query):
+            value = _get(doc, key)
+            for item in value if isinstance(value, list) else [value]:
+                if item is not None and item not in values:
+                    values.append(item)
+        return values
+
+    async def count_documents(self, query: Optional[dict] = None) -> int:
+        return len(self._find(query))
+
+    async def create_index(self, keys, **kwargs) -> str:
+        # Indexes are not needed for in-memory scans
+        return str(keys)
+
+
+class MemoryDatabase:
+    def __init__(self, name: str):
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name)
+        return self._collections[name]
+
+    async def list_collection_names(self) -> List[str]:
+        return list(self._collections)
+
+    async def create_collection(self, name: str, **options) -> MemoryCollection:
+        # Options (time series, validators...) have no effect in memory
+        return self[name]
+
+    def load_seed(self, path: str):
+        """Loads {"collection": [documents...]} from a JSON file."""
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        for name, documents in data.items():
+            collection = self[name]
+            for document in documents:
+                doc = dict(document)
+                doc["_id"] = ObjectId(doc["_id"]) if "_id" in doc else ObjectId()
+                collection._docs.append(doc)
+            logger.info("Memory store: %d documents loaded into '%s'", len(documents), name)
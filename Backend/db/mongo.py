@@ -1,12 +1,17 @@
 import os
+import logging
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 # Load environment variables
 load_dotenv()
 
 MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME")
+# Optional JSON seed ({"collection": [documents...]}) for MONGO_URI=memory://
+MONGO_SEED_FILE = os.getenv("MONGO_SEED_FILE")
 
 if not MONGO_URI:
     raise ValueError("MONGO_URI is not set in .env file")
@@ -14,9 +19,24 @@ if not MONGO_URI:
 if not DB_NAME:
     raise ValueError("DB_NAME is not set in .env file")
 
-client = AsyncIOMotorClient(MONGO_URI)
-db = client[DB_NAME]
+if MONGO_URI.startswith("memory://"):
+    # In-process stand-in (local runs, load tests): no MongoDB server needed
+    from db.memory_store import MemoryDatabase
+    client = None
+    db = MemoryDatabase(DB_NAME)
+    if MONGO_SEED_FILE:
+        db.load_seed(MONGO_SEED_FILE)
+else:
+    client = AsyncIOMotorClient(MONGO_URI)
+    db = client[DB_NAME]
 users_collection = db["users"]
 emotion_content_collection = db["emotion_content"]
+conversations_collection = db["conversations"]
+# Time series des prédictions (voir services/history_service.py)
+emotion_events_collection = db["emotion_events"]
+# Agrégats journaliers par utilisateur (voir services/timeline_service.py)
+emotion_daily_collection = db["emotion_daily"]
+# Version déployée du modèle d'émotion (voir services/model_deployment.py)
+model_deployments_collection = db["model_deployments"]
 
-print(f"Connected to MongoDB at {MONGO_URI}, Database: {DB_NAME}")
+logger.info("Connected to MongoDB at %s, Database: %s", MONGO_URI, DB_NAME)
@@ -0,0 +1,161 @@
+"""
+Local stand-in for the OpenRouter and Hugging Face inference APIs.
+
+    python -m loadtest.fake_upstream --port 8090 --latency-ms 800 --jitter-ms 300 \
+        --error-rate 0.02 --loading-rate 0.05
+
+Then start the backend with:
+
+    OPENROUTER_API_URL=http://127.0.0.1:8090/api/v1/chat/completions
+    HF_API_URL=http://127.0.0.1:8090/models/fake
+
+Endpoints:
+    POST /api/v1/chat/completions   OpenAI/OpenRouter format, "stream": true supported (SSE), 503 while "loading"
+    POST /models/{model}            Hugging Face format, 503 {"error", "estimated_time"} while "loading"
+    GET  /stats                     requests served, by outcome
+    PUT  /config                    change latency / error rates while a test is running
+"""
+import argparse
+import asyncio
+import json
+import random
+from collections import Counter
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+REPLIES = [
+    "Je suis là pour toi. Prends une grande inspiration, puis expire lentement. Veux-tu me dire ce qui te pèse ?",
+    "Ce que tu ressens est légitime. Tu peux répéter doucement « SubhanAllah » en respirant calmement.",
+    "Merci de partager cela avec moi. Accorde-toi un moment de calme, tu n'es pas seul face à cela.",
+]
+
+EXPLANATIONS = [
+    "Cette invocation rappelle que la paix intérieure est à portée de main. Elle aide à apaiser le cœur et à retrouver confiance.",
+    "Réciter cette invocation permet de confier ses soucis et de relâcher la tension. Elle invite à la patience et à la sérénité.",
+]
+
+
+class UpstreamConfig:
+    def __init__(self, args):
+        self.latency_ms = args.latency_ms
+        self.jitter_ms = args.jitter_ms
+        self.token_delay_ms = args.token_delay_ms
+        self.error_rate = args.error_rate
+        self.loading_rate = args.loading_rate
+        self.loading_estimated_time = args.loading_estimated_time
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+config: UpstreamConfig = None
+served = Counter()
+app = FastAPI(title="Fake LLM upstream")
+
+
+async def _simulate_latency():
+    delay = max(0.0, random.gauss(config.latency_ms, config.jitter_ms)) / 1000
+    await asyncio.sleep(delay)
+
+
+def _failure():
+    """Returns an error response for the configured fraction of calls, None otherwise."""
+    if random.random() < config.error_rate:
+        served["error"] += 1
+        return JSONResponse({"error": {"message": "Internal upstream error"}}, status_code=500)
+    return None
+
+
+def _loading(model: str):
+    """Returns a 503 "model loading" response for the configured fraction of calls, None otherwise."""
+    if random.random() < config.loading_rate:
+        served["loading"] += 1
+        return JSONResponse(
+            {"error": f"Model {model} is currently loading", "estimated_time": config.loading_estimated_time},
+            status_code=503,
+        )
+    return None
+
+
+@app.post("/api/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    loading = _loading(body.get("model", "fake"))
+    if loading is not None:
+        return loading
+    await _simulate_latency()
+    error = _failure()
+    if error is not None:
+        return error
+
+    prompt = body.get("messages", [{}])[-1].get("content", "")
+    reply = random.choice(EXPLANATIONS if "Explication:" in prompt else REPLIES)
+
+    if not body.get("stream"):
+        served["chat"] += 1
+        return {
+            "id": "fake-completion",
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+        }
+
+    async def events():
+        yield ": OPENROUTER PROCESSING\n\n"
+        for word in reply.split(" "):
+            await asyncio.sleep(config.token_delay_ms / 1000)
+            chunk = {"choices": [{"index": 0, "delta": {"content": word + " "}}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+        served["chat_stream"] += 1
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/models/{model:path}")
+async def hf_inference(model: str, request: Request):
+    body = await request.json()
+    loading = _loading(model)
+    if loading is not None:
+        return loading
+    await _simulate_latency()
+    error = _failure()
+    if error is not None:
+        return error
+    served["hf"] += 1
+    prompt = body.get("inputs", "")
+    return [{"generated_text": prompt + " " + random.choice(EXPLANATIONS)}]
+
+
+@app.get("/stats")
+async def stats():
+    return {"served": dict(served), "config": config.as_dict()}
+
+
+@app.put("/config")
+async def update_config(values: dict):
+    for key, value in values.items():
+        if hasattr(config, key):
+            setattr(config, key, float(value))
+    return config.as_dict()
+
+
+def main():
+    global config
+    parser = argparse.ArgumentParser(description="Fake OpenRouter / Hugging Face server for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=800, help="mean latency before the first byte")
+    parser.add_argument("--jitter-ms", type=float, default=200, help="standard deviation of the latency")
+    parser.add_argument("--token-delay-ms", type=float, default=30, help="delay between streamed tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with a 500")
+    parser.add_argument("--loading-rate", type=float, default=0.0, help="fraction of OpenRouter and HF calls answered with 503 'loading'")
+    parser.add_argument("--loading-estimated-time", type=float, default=2.0, help="estimated_time sent with the 503")
+    args = parser.parse_args()
+    config = UpstreamConfig(args)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Replays captured production traffic (utils/capture.py) against a backend.
+
+    python -m loadtest.replay captures/ --base-url http://127.0.0.1:8000 --speed 1
+    python -m loadtest.replay captures/ --speed 10          # 10x faster than captured
+    python -m loadtest.replay captures/ --speed 0           # as fast as possible
+    python -m loadtest.replay captures/*.jsonl.gz --output replay.json --baseline previous.json
+
+Each captured user gets a generated account. Users who were already
+registered (or logged in) before the capture started are registered / logged
+in during a setup phase that is not timed. Their requests are then re-issued
+in order, at the captured offsets divided by --speed, with requests of
+different users running concurrently (at most --concurrency in flight).
+Images are regenerated at the captured dimensions (or sent as captured with
+CAPTURE_IMAGES=true), chat turns reuse the masked texts and are chained to the
+conversations created during the replay.
+
+Run the target with the stubbed upstreams and the in-memory database, as for
+loadtest.run (see README, "Load Testing"), so the replay never reaches real
+LLM APIs. The report has the same format as loadtest.run, and --baseline /
+--max-regression compare p95 latencies the same way.
+"""
+import argparse
+import asyncio
+import base64
+import glob
+import gzip
+import json
+import os
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+from loadtest.run import Recorder, compare, make_image, print_report
+
+PASSWORD = "replay-password"
+
+
+def load_records(paths: List[str]) -> List[dict]:
+    """Reads capture files (or directories of them), sorted by arrival time."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.jsonl.gz"))))
+        else:
+            files.append(path)
+    records = []
+    for file in files:
+        with gzip.open(file, "rt", encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+class Session:
+    """Replay state of one captured user: generated account, token and conversations."""
+
+    def __init__(self, user: Optional[str], run_id: str):
+        self.user = user
+        self.email = f"replay-{run_id}-{(user or uuid.uuid4().hex)[-16:]}@example.com"
+        self.token: Optional[str] = None
+        self.conversations: Dict[str, str] = {}
+
+    def headers(self, record: dict) -> dict:
+        headers = {}
+        if record.get("auth") and self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if record.get("budget_ms"):
+            headers["X-Request-Budget-Ms"] = record["budget_ms"]
+        return headers
+
+
+class Replayer:
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, concurrency: int):
+        self.client = client
+        self.recorder = recorder
+        self._slots = asyncio.Semaphore(concurrency)
+        self._images: Dict[tuple, bytes] = {}
+
+    async def register(self, session: Session) -> httpx.Response:
+        return await self.client.post(
+            "/auth/register", json={"name": "Replay User", "email": session.email, "password": PASSWORD}
+        )
+
+    async def login(self, session: Session, password: str = PASSWORD) -> httpx.Response:
+        response = await self.client.post("/auth/login", json={"email": session.email, "password": password})
+        if response.status_code == 200:
+            session.token = response.json()["access_token"]
+        return response
+
+    async def setup(self, session: Session, records: List[dict]):
+        """Creates the accounts and tokens the captured traffic assumed to exist."""
+        paths = [r["path"] for r in records]
+        if "/auth/register" not in paths:
+            await self.register(session)
+        first_login = paths.index("/auth/login") if "/auth/login" in paths else len(records)
+        if any(r.get("auth") for r in records[:first_login]):
+            await self.login(session)
+
+    def _image(self, record: dict) -> tuple:
+        image = record.get("body", {}).get("image") or {}
+        fmt = (image.get("format") or "JPEG").upper()
+        content_type = "image/png" if fmt == "PNG" else "image/jpeg"
+        if image.get("data"):
+            return base64.b64decode(image["data"]), content_type
+        size = (image.get("width") or 224, image.get("height") or 224)
+        key = (size, fmt)
+        if key not in self._images:
+            self._images[key] = make_image(None, size, "PNG" if fmt == "PNG" else "JPEG")
+        return self._images[key], content_type
+
+    async def _send(self, session: Session, record: dict) -> Optional[httpx.Response]:
+        path = record["path"]
+        url = path + (f"?{record['query']}" if record.get("query") else "")
+        headers = session.headers(record)
+
+        if path == "/auth/register":
+            return await self.register(session)
+        if path == "/auth/login":
+            # Failed logins are replayed as failed logins
+            return await self.login(session, PASSWORD if record.get("status") == 200 else "wrong-password")
+        if path.startswith("/emotion/"):
+            data, content_type = self._image(record)
+            return await self.client.post(url, headers=headers, files={"image": ("face", data, content_type)})
+        if path.startswith("/api/chat/"):
+            body = record.get("body", {})
+            payload = {"message": body.get("message") or "x", "history": body.get("history") or []}
+            conversation = session.conversations.get(body.get("conversation"))
+            if conversation:
+                payload["conversation_id"] = conversation
+            if path.endswith("/stream"):
+                async with self.client.stream("POST", url, json=payload, headers=headers) as response:
+                    async for _ in response.aiter_raw():
+                        pass
+            else:
+                response = await self.client.post(url, json=payload, headers=headers)
+            created = response.headers.get("x-conversation-id")
+            if not created and response.status_code == 200 and not path.endswith("/stream"):
+                created = response.json().get("conversation_id")
+            if created and body.get("response_conversation"):
+                session.conversations[body["response_conversation"]] = created
+            return response
+        return await self.client.request(record["method"], url, headers=headers)
+
+    async def replay(self, session: Session, records: List[dict], origin: float, started: float, speed: float):
+        for record in records:
+            if speed > 0:
+                delay = started + (record["ts"] - origin) / speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            endpoint = f"{record['method']} {record['path']}"
+            async with self._slots:
+                request_started = time.perf_counter()
+                try:
+                    response = await self._send(session, record)
+                    status = str(response.status_code)
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                self.recorder.record(endpoint, time.perf_counter() - request_started, status)
+
+
+async def run(args) -> dict:
+    records = load_records(args.captures)
+    if not records:
+        raise SystemExit("No captured requests found")
+    run_id = uuid.uuid4().hex[:8]
+
+    by_user: Dict[Optional[str], List[dict]] = defaultdict(list)
+    anonymous = []
+    for record in records:
+        if record.get("user"):
+            by_user[record["user"]].append(record)
+        else:
+            anonymous.append(record)
+    sessions = [(Session(user, run_id), user_records) for user, user_records in by_user.items()]
+    # Unauthenticated requests are independent of each other
+    sessions += [(Session(None, run_id), [record]) for record in anonymous]
+
+    span = records[-1]["ts"] - records[0]["ts"]
+    print(f"{len(records)} requests from {len(by_user)} users over {span:.1f} s, speed {args.speed or 'max'}")
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        recorder = Recorder()
+        replayer = Replayer(client, recorder, args.concurrency)
+        setup_slots = asyncio.Semaphore(args.concurrency)
+
+        async def setup(session, user_records):
+            async with setup_slots:
+                await replayer.setup(session, user_records)
+
+        await asyncio.gather(*(setup(s, r) for s, r in sessions if s.user))
+
+        # The setup phase is not part of the measured run
+        started = recorder.started = time.perf_counter()
+        await asyncio.gather(*(
+            replayer.replay(session, user_records, records[0]["ts"], started, args.speed)
+            for session, user_records in sessions
+        ))
+    recorder.finished = time.perf_counter()
+    return recorder.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured traffic against the Emotion Adkar backend")
+    parser.add_argument("captures", nargs="+", help="capture files (.jsonl.gz) or directories")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression factor (0 = as fast as possible)")
+    parser.add_argument("--concurrency", type=int, default=100, help="max requests in flight")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--baseline", help="JSON report of a previous run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed p95 increase vs baseline")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nNo p95 regression beyond the allowed threshold.")
+
+
+if __name__ == "__main__":
+    main()
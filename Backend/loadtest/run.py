@@ -0,0 +1,247 @@
+"""
+Load-test runner: scripted user journeys against a running backend.
+
+Each virtual user registers, logs in, then loops until the end of the test:
+GET /me, POST /emotion/predict with a face image, then a few chat turns in
+one conversation (POST /api/chat/ or /api/chat/stream with --stream).
+
+    python -m loadtest.run --base-url http://127.0.0.1:8000 --users 20 --duration 60
+    python -m loadtest.run ... --output report.json
+    python -m loadtest.run ... --baseline report.json --max-regression 0.2
+
+The report lists throughput, error counts and latency percentiles per
+endpoint. With --baseline, the run fails (exit code 1) when an endpoint's p95
+is more than --max-regression slower than in the baseline report.
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from PIL import Image, ImageDraw
+
+CHAT_MESSAGES = [
+    "Je me sens triste",
+    "salam",
+    "je suis stressé",
+    "J'ai du mal à dormir ces temps-ci, j'ai beaucoup de pensées.",
+    "Merci, ça m'aide un peu. Tu as un conseil pour ce soir ?",
+    "Comment rester calme quand je suis en colère ?",
+]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def record(self, endpoint: str, seconds: float, status: str):
+        self.latencies[endpoint].append(seconds)
+        self.statuses[endpoint][status] += 1
+
+    def report(self) -> dict:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            statuses = dict(self.statuses[endpoint])
+            errors = sum(n for status, n in statuses.items() if not status.startswith("2"))
+            endpoints[endpoint] = {
+                "requests": len(values),
+                "errors": errors,
+                "rps": round(len(values) / elapsed, 2),
+                "p50_ms": _percentile(values, 50),
+                "p90_ms": _percentile(values, 90),
+                "p95_ms": _percentile(values, 95),
+                "p99_ms": _percentile(values, 99),
+                "max_ms": round(values[-1] * 1000, 1),
+                "statuses": statuses,
+            }
+        return {"duration_s": round(elapsed, 1), "endpoints": endpoints}
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    # Nearest-rank percentile
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return round(sorted_values[index] * 1000, 1)
+
+
+def make_image(path: Optional[str], size: Tuple[int, int] = (224, 224), image_format: str = "JPEG") -> bytes:
+    """Returns the image to upload: the given file, or a generated face-like image of `size`."""
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+    width, height = size
+    image = Image.new("RGB", (width, height), (200, 170, 150))
+    draw = ImageDraw.Draw(image)
+
+    def box(x0, y0, x1, y1):
+        # Coordinates drawn for 224x224, scaled to the requested size
+        return (x0 * width // 224, y0 * height // 224, x1 * width // 224, y1 * height // 224)
+
+    draw.ellipse(box(40, 20, 184, 200), fill=(225, 190, 165))
+    draw.ellipse(box(75, 80, 95, 95), fill=(40, 30, 30))
+    draw.ellipse(box(130, 80, 150, 95), fill=(40, 30, 30))
+    draw.arc(box(80, 120, 145, 165), 200, 340, fill=(120, 40, 40), width=max(1, 4 * width // 224))
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, quality=85)
+    return buffer.getvalue()
+
+
+async def timed(recorder: Recorder, endpoint: str, call) -> Optional[httpx.Response]:
+    started = time.perf_counter()
+    try:
+        response = await call()
+    except httpx.HTTPError as e:
+        recorder.record(endpoint, time.perf_counter() - started, type(e).__name__)
+        return None
+    recorder.record(endpoint, time.perf_counter() - started, str(response.status_code))
+    return response
+
+
+async def chat_stream(client: httpx.AsyncClient, recorder: Recorder, headers: dict, body: dict) -> Optional[str]:
+    started = time.perf_counter()
+    first_token = None
+    conversation_id = None
+    try:
+        async with client.stream("POST", "/api/chat/stream", json=body, headers=headers) as response:
+            status = str(response.status_code)
+            conversation_id = response.headers.get("x-conversation-id")
+            async for line in response.aiter_lines():
+                if first_token is None and line.startswith("data:"):
+                    first_token = time.perf_counter()
+                    recorder.record("chat_stream first token", first_token - started, status)
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    recorder.record("POST /api/chat/stream", time.perf_counter() - started, status)
+    return conversation_id
+
+
+async def journey(client: httpx.AsyncClient, recorder: Recorder, args, image: bytes, deadline: float):
+    email = f"loadtest-{uuid.uuid4().hex[:12]}@example.com"
+    password = "loadtest-password"
+
+    await timed(recorder, "POST /auth/register", lambda: client.post(
+        "/auth/register", json={"name": "Load Test", "email": email, "password": password}
+    ))
+    response = await timed(recorder, "POST /auth/login", lambda: client.post(
+        "/auth/login", json={"email": email, "password": password}
+    ))
+    if response is None or response.status_code != 200:
+        return
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    while time.perf_counter() < deadline:
+        await timed(recorder, "GET /me", lambda: client.get("/me", headers=headers))
+
+        await timed(recorder, "POST /emotion/predict", lambda: client.post(
+            "/emotion/predict", headers=headers, files={"image": ("face.jpg", image, "image/jpeg")}
+        ))
+
+        conversation_id = None
+        for _ in range(args.chat_turns):
+            if time.perf_counter() >= deadline:
+                break
+            await asyncio.sleep(random.uniform(0, args.think_time))
+            body = {"message": random.choice(CHAT_MESSAGES)}
+            if conversation_id:
+                body["conversation_id"] = conversation_id
+            if args.stream:
+                conversation_id = await chat_stream(client, recorder, headers, body) or conversation_id
+            else:
+                response = await timed(recorder, "POST /api/chat/", lambda: client.post(
+                    "/api/chat/", json=body, headers=headers
+                ))
+                if response is not None and response.status_code == 200:
+                    conversation_id = response.json().get("conversation_id")
+
+        await asyncio.sleep(random.uniform(0, args.think_time))
+
+
+async def run(args) -> dict:
+    image = make_image(args.image)
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+    limits = httpx.Limits(max_connections=args.users * 2)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        tasks = []
+        for i in range(args.users):
+            tasks.append(asyncio.create_task(journey(client, recorder, args, image, deadline)))
+            # Spread the user arrivals over the ramp-up period
+            if args.ramp_up:
+                await asyncio.sleep(args.ramp_up / args.users)
+        await asyncio.gather(*tasks)
+    recorder.finished = time.perf_counter()
+    return recorder.report()
+
+
+def print_report(report: dict):
+    print(f"\nDuration: {report['duration_s']} s")
+    header = f"{'endpoint':28s} {'reqs':>6s} {'err':>5s} {'rps':>7s} {'p50':>8s} {'p90':>8s} {'p95':>8s} {'p99':>8s} {'max':>8s}"
+    print(header)
+    print("-" * len(header))
+    for endpoint, s in report["endpoints"].items():
+        print(
+            f"{endpoint:28s} {s['requests']:6d} {s['errors']:5d} {s['rps']:7.2f} "
+            f"{s['p50_ms']:8.1f} {s['p90_ms']:8.1f} {s['p95_ms']:8.1f} {s['p99_ms']:8.1f} {s['max_ms']:8.1f}"
+        )
+    print("(latencies in ms)")
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> List[str]:
+    """Returns the endpoints whose p95 regressed beyond the allowed ratio."""
+    regressions = []
+    for endpoint, stats in report["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(endpoint)
+        if not base or not base["p95_ms"]:
+            continue
+        ratio = stats["p95_ms"] / base["p95_ms"] - 1
+        if ratio > max_regression:
+            regressions.append(f"{endpoint}: p95 {base['p95_ms']} -> {stats['p95_ms']} ms (+{ratio:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Emotion Adkar backend")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=60, help="test duration in seconds")
+    parser.add_argument("--ramp-up", type=float, default=5, help="seconds over which users start")
+    parser.add_argument("--chat-turns", type=int, default=3, help="chat messages per journey iteration")
+    parser.add_argument("--think-time", type=float, default=1.0, help="max random pause between steps (s)")
+    parser.add_argument("--stream", action="store_true", help="use /api/chat/stream instead of /api/chat/")
+    parser.add_argument("--image", help="image to upload (default: generated JPEG)")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--baseline", help="JSON report of a previous run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed p95 increase vs baseline")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nNo p95 regression beyond the allowed threshold.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Loads loadtest/seed_data.json into a local MongoDB (replacing the seeded collections).
+
+    MONGO_URI=mongodb://localhost:27017 DB_NAME=emotion_adkar_loadtest python -m loadtest.seed
+
+Not needed with MONGO_URI=memory://: set MONGO_SEED_FILE=loadtest/seed_data.json instead.
+"""
+import argparse
+import asyncio
+import json
+import os
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+load_dotenv()
+
+SEED_FILE = os.path.join(os.path.dirname(__file__), "seed_data.json")
+
+
+async def seed(uri: str, db_name: str, path: str):
+    client = AsyncIOMotorClient(uri)
+    db = client[db_name]
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    for name, documents in data.items():
+        await db[name].delete_many({})
+        if documents:
+            await db[name].insert_many(documents)
+        print(f"{db_name}.{name}: {len(documents)} documents")
+    client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a local MongoDB for load tests")
+    parser.add_argument("--file", default=SEED_FILE)
+    parser.add_argument("--force", action="store_true", help="allow a non-local MONGO_URI")
+    args = parser.parse_args()
+
+    uri = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+    db_name = os.getenv("DB_NAME", "emotion_adkar_loadtest")
+    if not any(host in uri for host in ("localhost", "127.0.0.1")) and not args.force:
+        raise SystemExit(f"Refusing to overwrite collections on {uri} (use --force)")
+    asyncio.run(seed(uri, db_name, args.file))
+
+
+if __name__ == "__main__":
+    main()
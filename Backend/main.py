@@ -1,20 +1,73 @@
+import logging
+
+# Configure logging before importing the app modules (they log at import time)
+from utils.logging_config import setup_logging, shutdown_logging, dropped_records
+setup_logging()
+
+import anyio
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from auth.auth_router import router as auth_router, get_current_user
 from models.user_model import UserOut
+from services.admission_control import llm_admission
+from services.history_service import history_writer, ensure_events_collection
+from services.timeline_service import ensure_rollup_indexes
+from services.content_catalog import content_catalog
+from services.content_suggestions import content_suggestions, CHAT_SUGGESTIONS_ENABLED
+from services.model_deployment import model_deployment
+from utils.password_hasher import password_hasher
+from utils.executors import executors
+from utils.cache import cache_stats, close_cache
+from utils.user_cache import user_cache
+from utils.metrics import registry, register_collector
+from utils.profiling import RequestTimingMiddleware
+from utils.capture import TrafficCaptureMiddleware, capture_writer, CAPTURE_ENABLED
+from utils.encoding import CompressionMiddleware
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Emotion Adkar Backend")
 
 @app.on_event("startup")
 async def startup_event():
-    print("\n" + "="*50)
-    print("[START] Serveur en cours de demarrage...")
-    print("[LOAD] Chargement des modeles ML (cela peut prendre quelques secondes)...")
+    logger.info("[START] Serveur en cours de demarrage...")
+    logger.info("[LOAD] Chargement des modeles ML (cela peut prendre quelques secondes)...")
     # Importer le modèle ici déclenchera le chargement s'il ne l'est pas déjà
     from ml.emotion_model import MODEL_NAME
-    print(f"[OK] Modele ML '{MODEL_NAME}' charge avec succes!")
-    print("[READY] Le serveur est maintenant pret a recevoir des requetes.")
-    print("="*50 + "\n")
+    logger.info("[OK] Modele ML '%s' charge avec succes!", MODEL_NAME)
+    # Version déployée à chaud depuis (si elle diffère), puis suivi des déploiements
+    try:
+        await model_deployment.sync()
+    except Exception as e:
+        logger.warning("[WARN] Deploiement du modele non synchronise: %s", e)
+    model_deployment.start()
+    await ensure_events_collection()
+    await ensure_rollup_indexes()
+    # Charger le catalogue de contenu avant la première prédiction
+    await content_catalog.get()
+    if CHAT_SUGGESTIONS_ENABLED:
+        # Index des suggestions du chat construit avant la première requête
+        # (mappé s'il existe déjà sur le disque)
+        try:
+            await content_suggestions.refresh(wait=True)
+        except Exception as e:
+            logger.warning("[WARN] Index des suggestions non construit: %s", e)
+    history_writer.start()
+    if CAPTURE_ENABLED:
+        capture_writer.start()
+    logger.info("[READY] Le serveur est maintenant pret a recevoir des requetes.")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Write the buffered emotion history before exiting
+    await history_writer.stop()
+    await model_deployment.stop()
+    capture_writer.stop()
+    executors.shutdown()
+    await close_cache()
+    # Last: flush the log records still waiting in the queue
+    shutdown_logging()
 
 # Enable CORS
 origins = ["*"]  # Allow all origins for Flutter app
@@ -25,8 +78,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Profile-Id"],
 )
 
+# Server-Timing header on every response, sampling profiler on demand
+app.add_middleware(RequestTimingMiddleware)
+
+# Anonymised traffic capture for loadtest.replay (CAPTURE_ENABLED)
+app.add_middleware(TrafficCaptureMiddleware)
+
+# brotli / gzip above COMPRESSION_MIN_BYTES; outermost so the capture sees plain bodies
+app.add_middleware(CompressionMiddleware)
+
 # Include Auth Router
 app.include_router(auth_router)
 
@@ -35,9 +98,52 @@ from routes.emotion_routes import router as emotion_router
 app.include_router(emotion_router)
 
 # Include Chat Router
-from routes.chat import router as chat_router
+from routes.chat import router as chat_router, llm_service as chat_llm_service
 app.include_router(chat_router)
 
+# Include History Router (mood timeline)
+from routes.history import router as history_router
+app.include_router(history_router)
+
+# Include Admin Router (profiling switch, requires ADMIN_TOKEN)
+from routes.admin import router as admin_router, require_admin
+app.include_router(admin_router)
+
+
+@app.get("/stats", dependencies=[Depends(require_admin)])
+async def stats():
+    """Statistiques internes (caches) pour le suivi des performances."""
+    return {
+        "chat_response_cache": chat_llm_service.response_cache.stats(),
+        "llm_admission": llm_admission.stats(),
+        "password_hasher": password_hasher.stats(),
+        "executors": executors.stats(),
+        "user_cache": user_cache.stats(),
+        "content_catalog": content_catalog.stats(),
+        "content_index": content_suggestions.stats(),
+        "model_registry": model_deployment.stats(),
+        "shared_caches": cache_stats(),
+        "emotion_history": history_writer.stats(),
+        "traffic_capture": capture_writer.stats(),
+        "logging": {"dropped_records": dropped_records()},
+    }
+
+def _runtime_metrics():
+    # Default anyio thread pool (sync endpoints and dependencies, file uploads); model inference,
+    # LLM explanations and bcrypt run in the dedicated pools of utils.executors
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    yield "thread_pool_busy", "gauge", "Busy worker threads, by pool", [({"pool": "anyio_default"}, limiter.borrowed_tokens)]
+    yield "thread_pool_size", "gauge", "Worker thread capacity, by pool", [({"pool": "anyio_default"}, limiter.total_tokens)]
+    yield "thread_pool_waiting", "gauge", "Tasks waiting for a worker thread, by pool", [({"pool": "anyio_default"}, limiter.statistics().tasks_waiting)]
+    yield "log_records_dropped_total", "counter", "Log records dropped because the log queue was full", [({}, dropped_records())]
+
+register_collector(_runtime_metrics)
+
+
+@app.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def metrics():
+    """Métriques au format Prometheus (latences par étape, caches, files d'attente)."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.get("/")
 async def root():
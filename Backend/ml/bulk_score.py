@@ -0,0 +1,442 @@
+"""
+Offline bulk scoring of image directories and archives with the emotion model.
+
+    python -m ml.bulk_score photos/ --output scores.csv
+    python -m ml.bulk_score export.tar.gz --output scores.parquet --format parquet --multi-face
+    python -m ml.bulk_score photos/ --output scores.csv --resume        # continue an interrupted job
+    python -m ml.bulk_score photos/ --output eval.csv --model org/candidate@3c5b1e2 --model-version v2
+
+Back-office jobs (re-labelling stored images, evaluating a candidate model,
+back-filling the history of migrated users) run here instead of one HTTP
+request per image. Three stages overlap and share the cores:
+
+- images are listed in a stable order (sorted directory walk, archive order);
+  archive members are read sequentially by the main process;
+- a pool of --decoders processes decodes and preprocesses them (and detects
+  the faces with --multi-face), --prefetch chunks ahead of the model;
+- the main process runs batched forward passes of --batch-size crops with the
+  remaining cores as torch intra-op threads.
+
+Rows are written in input order as batches complete: one CSV file, or a
+directory of Parquet part files (pyarrow is optional). Every
+--checkpoint-every images the output is flushed and the progress saved to
+`<output>.checkpoint.json`; --resume truncates the output to the last
+checkpoint and skips the images already scored. A status line on stderr
+shows the throughput and the ETA.
+"""
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import tarfile
+import time
+import zipfile
+from collections import deque
+from itertools import islice
+from typing import Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = pq = None
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp", ".tif", ".tiff"}
+COLUMNS = ["path", "emotion", "confidence", "model_version", "faces", "error"]
+
+# (name in the source, file path or image bytes)
+Task = Tuple[str, Union[str, bytes]]
+
+
+def _is_image(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def iter_source(source: str, skip: int = 0) -> Iterator[Task]:
+    """Images of a directory (recursive) or a zip / tar archive, in a stable order. The first `skip` are not read."""
+    index = 0
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if _is_image(name):
+                    if index >= skip:
+                        path = os.path.join(root, name)
+                        yield os.path.relpath(path, source), path
+                    index += 1
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and _is_image(info.filename):
+                    if index >= skip:
+                        yield info.filename, archive.read(info)
+                    index += 1
+    elif tarfile.is_tarfile(source):
+        with tarfile.open(source, "r:*") as archive:
+            for member in archive:
+                if member.isfile() and _is_image(member.name):
+                    if index >= skip:
+                        yield member.name, archive.extractfile(member).read()
+                    index += 1
+                # tarfile otherwise keeps every member header in memory
+                archive.members = []
+    else:
+        raise ValueError(f"{source} is neither a directory nor a zip / tar archive")
+
+
+def count_source(source: str) -> Optional[int]:
+    """Number of images, None when it would take a full pass over a compressed stream (tar)."""
+    if os.path.isdir(source):
+        return sum(1 for _, _, files in os.walk(source) for name in files if _is_image(name))
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            return sum(1 for info in archive.infolist() if not info.is_dir() and _is_image(info.filename))
+    return None
+
+
+# Decoder processes
+
+_processor = None
+_detect_faces = None
+_crop_faces = None
+
+
+def _init_decoder(model_name: str, revision: Optional[str], multi_face: bool):
+    global _processor, _detect_faces, _crop_faces
+    # Ctrl-C is handled by the main process, which checkpoints then stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # One thread per decoder: the other cores run the forward passes
+    os.environ["OMP_NUM_THREADS"] = "1"
+    from transformers import AutoImageProcessor
+
+    _processor = AutoImageProcessor.from_pretrained(model_name, revision=revision)
+    if multi_face:
+        from ml.face_detector import detect_faces, crop_faces
+
+        _detect_faces, _crop_faces = detect_faces, crop_faces
+
+
+def _prepare(task: Task) -> dict:
+    """Decodes one image: model inputs of its face crops (or of the whole frame), or the error."""
+    name, data = task
+    try:
+        image = Image.open(data if isinstance(data, str) else io.BytesIO(data)).convert("RGB")
+        boxes = _detect_faces(image) if _detect_faces is not None else []
+        crops = _crop_faces(image, boxes) if boxes else [image]
+        pixels = _processor(images=crops, return_tensors="np")["pixel_values"]
+    except UnidentifiedImageError:
+        return {"path": name, "error": "not a readable image"}
+    except Exception as e:
+        return {"path": name, "error": f"{type(e).__name__}: {e}"}
+    return {"path": name, "pixels": np.asarray(pixels, dtype=np.float32), "boxes": boxes}
+
+
+def _prepare_chunk(tasks: List[Task]) -> List[dict]:
+    return [_prepare(task) for task in tasks]
+
+
+# Output
+
+class CsvWriter:
+    def __init__(self, path: str, state: Optional[dict] = None):
+        if state is None:
+            self._file = open(path, "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(COLUMNS)
+        else:
+            # Rows written after the last checkpoint are scored again
+            self._file = open(path, "r+", newline="", encoding="utf-8")
+            self._file.seek(state["offset"])
+            self._file.truncate()
+            self._writer = csv.writer(self._file)
+
+    def write(self, rows: List[dict]):
+        self._writer.writerows([row.get(column) for column in COLUMNS] for row in rows)
+
+    def commit(self) -> dict:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return {"offset": self._file.tell()}
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """One part file per checkpoint in the `path` directory."""
+
+    def __init__(self, path: str, state: Optional[dict] = None):
+        self.path = path
+        self.parts = state["parts"] if state else 0
+        self._rows: List[dict] = []
+        self._schema = pa.schema([
+            ("path", pa.string()), ("emotion", pa.string()), ("confidence", pa.float64()),
+            ("model_version", pa.string()), ("faces", pa.string()), ("error", pa.string()),
+        ])
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            # Parts of a new job, or written after the last checkpoint
+            if name.startswith("part-") and int(name[5:10]) >= self.parts:
+                os.remove(os.path.join(path, name))
+
+    def write(self, rows: List[dict]):
+        self._rows.extend(rows)
+
+    def commit(self) -> dict:
+        if self._rows:
+            part = os.path.join(self.path, f"part-{self.parts:05d}.parquet")
+            table = pa.Table.from_pylist([{c: row.get(c) for c in COLUMNS} for row in self._rows], schema=self._schema)
+            pq.write_table(table, part + ".tmp")
+            os.replace(part + ".tmp", part)
+            self.parts += 1
+            self._rows = []
+        return {"parts": self.parts}
+
+    def close(self):
+        pass
+
+
+WRITERS = {"csv": CsvWriter, "parquet": ParquetWriter}
+
+
+def checkpoint_path(output: str) -> str:
+    return output.rstrip("/\\") + ".checkpoint.json"
+
+
+def _save_checkpoint(path: str, state: dict):
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+class Progress:
+    """Throughput / ETA status line, redrawn at most every `interval` seconds."""
+
+    def __init__(self, total: Optional[int], done: int, interval: float = 0.5, stream=sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self._start_done = done
+        self._started = time.perf_counter()
+        self._shown = 0.0
+
+    def rate(self, done: int) -> float:
+        elapsed = time.perf_counter() - self._started
+        return (done - self._start_done) / elapsed if elapsed > 0 else 0.0
+
+    def update(self, done: int, errors: int, force: bool = False):
+        now = time.perf_counter()
+        if not force and now - self._shown < self.interval:
+            return
+        self._shown = now
+        rate = self.rate(done)
+        line = f"{done:,}" + (f"/{self.total:,}" if self.total else "") + f" images  {rate:,.1f} img/s  {errors:,} errors"
+        if self.total and rate > 0:
+            remaining = int((self.total - done) / rate)
+            line += f"  ETA {remaining // 3600}h{remaining // 60 % 60:02d}m{remaining % 60:02d}s"
+        self.stream.write("\r" + line.ljust(80))
+        self.stream.flush()
+
+    def close(self):
+        self.stream.write("\n")
+        self.stream.flush()
+
+
+class BulkScorer:
+    def __init__(self, args, model, dominant_emotion, torch):
+        self.args = args
+        self.model = model
+        self.dominant_emotion = dominant_emotion
+        self.torch = torch
+        self.batches = 0
+
+    def score(self, items: List[dict]) -> List[dict]:
+        """Rows of the prepared items, all their crops classified in batches of --batch-size."""
+        pixels = [item["pixels"] for item in items if "pixels" in item]
+        results: List[dict] = []
+        if pixels:
+            stacked = np.concatenate(pixels)
+            for start in range(0, len(stacked), self.args.batch_size):
+                inputs = {"pixel_values": self.torch.from_numpy(stacked[start:start + self.args.batch_size])}
+                results.extend(self.model.predict(inputs))
+                self.batches += 1
+
+        rows = []
+        position = 0
+        for item in items:
+            if "error" in item:
+                rows.append({"path": item["path"], "model_version": self.model.version, "error": item["error"]})
+                continue
+            crops = results[position:position + len(item["pixels"])]
+            position += len(crops)
+            row = {"path": item["path"], "model_version": self.model.version}
+            if not self.args.multi_face:
+                row.update(emotion=crops[0]["emotion"], confidence=crops[0]["confidence"])
+            elif not item["boxes"]:
+                # No face detected: the whole frame was classified
+                row.update(emotion=crops[0]["emotion"], confidence=crops[0]["confidence"], faces="[]")
+            else:
+                faces = [
+                    {"emotion": r["emotion"], "confidence": r["confidence"], "box": {"x": x, "y": y, "width": w, "height": h}}
+                    for (x, y, w, h), r in zip(item["boxes"], crops)
+                ]
+                row.update(self.dominant_emotion(faces), faces=json.dumps(faces))
+            rows.append(row)
+        return rows
+
+
+def run(args) -> dict:
+    cpus = os.cpu_count() or 1
+    decoders = args.decoders or max(1, cpus // 4)
+    torch_threads = args.torch_threads or max(1, cpus - decoders)
+    prefetch = args.prefetch or decoders * 4
+
+    # Loads and warms up the model in this process only (decoders load the processor)
+    from ml.emotion_model import dominant_emotion, model_registry
+    import torch
+
+    torch.set_num_threads(torch_threads)
+    active = model_registry.get(model_registry.active_version)
+    checkpoint_file = checkpoint_path(args.output)
+    job = dict(active.spec(), source=os.path.abspath(args.source), format=args.format, multi_face=args.multi_face)
+    state = None
+    if args.resume and os.path.exists(checkpoint_file):
+        with open(checkpoint_file) as f:
+            state = json.load(f)
+        mismatch = [key for key, value in job.items() if state.get(key) != value]
+        if mismatch:
+            sys.exit(f"{checkpoint_file} belongs to another job (different {', '.join(mismatch)})")
+    elif os.path.exists(args.output) and not args.overwrite:
+        sys.exit(f"{args.output} already exists: use --resume to continue the job or --overwrite to start again")
+    elif os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    done = state["done"] if state else 0
+    errors = state["errors"] if state else 0
+
+    total = None if args.no_count else count_source(args.source)
+    writer = WRITERS[args.format](args.output, state["output"] if state else None)
+    progress = Progress(total, done)
+    started = time.perf_counter()
+    scored = 0
+    print(
+        f"Scoring {args.source} with {decoders} decoder(s) and {torch_threads} torch thread(s)"
+        + (f", resuming after {done:,} images" if done else ""),
+        file=sys.stderr,
+    )
+
+    def checkpoint():
+        _save_checkpoint(checkpoint_file, dict(job, done=done, errors=errors, output=writer.commit()))
+
+    context = multiprocessing.get_context("spawn")
+    with model_registry.use() as model, context.Pool(
+        decoders, _init_decoder, (model.model_name, model.revision, args.multi_face)
+    ) as pool:
+        scorer = BulkScorer(args, model, dominant_emotion, torch)
+        tasks = iter_source(args.source, skip=done)
+        pending = deque()
+        items: List[dict] = []
+        crops = 0
+        last_checkpoint = done
+
+        def submit():
+            while len(pending) < prefetch:
+                chunk = list(islice(tasks, args.chunk_size))
+                if not chunk:
+                    return
+                pending.append(pool.apply_async(_prepare_chunk, (chunk,)))
+
+        def flush():
+            nonlocal items, crops, done, errors, scored
+            rows = scorer.score(items)
+            writer.write(rows)
+            done += len(rows)
+            scored += len(rows)
+            errors += sum(1 for row in rows if row.get("error"))
+            items, crops = [], 0
+
+        try:
+            submit()
+            while pending:
+                prepared = pending.popleft().get()
+                # Keep the decoders busy during the forward pass
+                submit()
+                items.extend(prepared)
+                crops += sum(len(item["pixels"]) for item in prepared if "pixels" in item)
+                if crops >= args.batch_size:
+                    flush()
+                    if done - last_checkpoint >= args.checkpoint_every:
+                        checkpoint()
+                        last_checkpoint = done
+                progress.update(done, errors)
+            if items:
+                flush()
+            checkpoint()
+        except KeyboardInterrupt:
+            # Rows of the complete batches are kept; the current one is scored again on --resume
+            checkpoint()
+            progress.update(done, errors, force=True)
+            progress.close()
+            writer.close()
+            sys.exit(f"Interrupted after {done:,} images: run again with --resume to continue")
+
+    progress.update(done, errors, force=True)
+    progress.close()
+    writer.close()
+    elapsed = time.perf_counter() - started
+    return {
+        "images": done,
+        "scored": scored,
+        "errors": errors,
+        "batches": scorer.batches,
+        "seconds": round(elapsed, 1),
+        "images_per_second": round(scored / elapsed, 1) if elapsed > 0 else 0.0,
+        "model_version": model.version,
+        "output": args.output,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score the emotion of every image of a directory or archive")
+    parser.add_argument("source", help="directory (searched recursively), .zip or .tar[.gz|.bz2|.xz] archive")
+    parser.add_argument("--output", required=True, help="CSV file, or directory of Parquet part files")
+    parser.add_argument("--format", choices=sorted(WRITERS), help="output format (default: from the extension)")
+    parser.add_argument("--multi-face", action="store_true", help="detect and score every face (dominant emotion)")
+    parser.add_argument("--model", help="model to evaluate, NAME[@REVISION] (default: EMOTION_MODEL_NAME)")
+    parser.add_argument("--model-version", help="version label written in the output (default: EMOTION_MODEL_VERSION)")
+    parser.add_argument("--batch-size", type=int, default=32, help="crops per forward pass")
+    parser.add_argument("--decoders", type=int, default=0, help="decode / preprocess processes (default: cores / 4)")
+    parser.add_argument("--torch-threads", type=int, default=0, help="forward pass threads (default: other cores)")
+    parser.add_argument("--chunk-size", type=int, default=8, help="images per decoder task")
+    parser.add_argument("--prefetch", type=int, default=0, help="decoder tasks in flight (default: decoders x 4)")
+    parser.add_argument("--checkpoint-every", type=int, default=1000, help="images between checkpoints")
+    parser.add_argument("--resume", action="store_true", help="continue from <output>.checkpoint.json")
+    parser.add_argument("--overwrite", action="store_true", help="replace an existing output")
+    parser.add_argument("--no-count", action="store_true", help="do not count the images first (no ETA)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        parser.error(f"{args.source} does not exist")
+    args.format = args.format or ("parquet" if args.output.rstrip("/\\").endswith(".parquet") else "csv")
+    if args.format == "parquet" and pa is None:
+        parser.error("Parquet output needs pyarrow (pip install pyarrow)")
+    # Read by ml.emotion_model when it is imported
+    if args.model:
+        name, _, revision = args.model.partition("@")
+        os.environ["EMOTION_MODEL_NAME"] = name
+        os.environ["EMOTION_MODEL_REVISION"] = revision
+    if args.model_version:
+        os.environ["EMOTION_MODEL_VERSION"] = args.model_version
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Embedding index of the douaa / ayah catalog, for instant chat suggestions.
+
+    index = VectorIndex(CONTENT_INDEX_DIR, load_embedder())
+    index.update({"<id>": "text to embed", ...}, version)
+    index.search("je me sens triste", k=3)   # [("<id>", 0.62), ...]
+
+Vectors are L2-normalised float32 rows of one contiguous matrix, saved as
+`<key>.npy` (row ids and text hashes in `<key>.json`) and memory-mapped, so
+every worker of the node shares the same pages. Search is a single
+matrix-vector product and an argpartition: a few milliseconds for thousands
+of entries, dominated by embedding the query.
+
+`update` is incremental: rows of unchanged texts are copied from the current
+index (or from the latest file built with the same model), only new or edited
+texts are embedded. Files are written under a temporary name and renamed, so
+readers never see a partial matrix and a worker that finds the file already
+built by another one just maps it.
+
+The embedder is a small CPU sentence-transformers model
+(CONTENT_EMBEDDING_MODEL, multilingual so French messages match Arabic
+texts). sentence-transformers is optional: without it, or if the model cannot
+be loaded, a hashed character n-gram embedder is used (lexical matching only).
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from utils.text_utils import normalize_text
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # optional dependency
+    SentenceTransformer = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CONTENT_INDEX_DIR = os.getenv("CONTENT_INDEX_DIR", "content_index")
+CONTENT_EMBEDDING_MODEL = os.getenv(
+    "CONTENT_EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+)
+CONTENT_EMBEDDING_BATCH = int(os.getenv("CONTENT_EMBEDDING_BATCH", "64"))
+# Dimension of the fallback hashing embedder
+CONTENT_HASH_DIM = int(os.getenv("CONTENT_HASH_DIM", "1024"))
+# Index files kept per model (the current one and the previous ones)
+CONTENT_INDEX_KEEP = int(os.getenv("CONTENT_INDEX_KEEP", "2"))
+
+
+class SentenceEmbedder:
+    def __init__(self, model_name: str):
+        self.name = model_name
+        self._model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self._model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        vectors = self._model.encode(
+            texts, batch_size=CONTENT_EMBEDDING_BATCH, normalize_embeddings=True, convert_to_numpy=True
+        )
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+class HashingEmbedder:
+    """Character 3-gram counts hashed into `dim` buckets (accents and harakat removed)."""
+
+    def __init__(self, dim: int = CONTENT_HASH_DIM):
+        self.name = f"hashing-{dim}"
+        self.dim = dim
+
+    def _grams(self, text: str) -> List[str]:
+        grams = []
+        for word in normalize_text(text).split():
+            padded = f" {word} "
+            grams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return grams
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for gram in self._grams(text):
+                bucket = int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=4).digest(), "little")
+                vectors[row, bucket % self.dim] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+def load_embedder(model_name: str = CONTENT_EMBEDDING_MODEL):
+    if SentenceTransformer is not None:
+        try:
+            embedder = SentenceEmbedder(model_name)
+            logger.info("Content embedder loaded: %s (%d dims)", model_name, embedder.dim)
+            return embedder
+        except Exception as e:
+            logger.warning("Cannot load embedding model %s, using hashed n-grams: %s", model_name, e)
+    else:
+        logger.warning("sentence-transformers not installed: content suggestions use hashed n-grams")
+    return HashingEmbedder()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class IndexSnapshot:
+    """Rows of one index version: ids, text hashes and the (memory-mapped) matrix."""
+
+    def __init__(self, key: str, version: str, ids: List[str], hashes: List[str], matrix: np.ndarray):
+        self.key = key
+        self.version = version
+        self.ids = ids
+        self.hashes = hashes
+        self.matrix = matrix
+
+    def rows_by_hash(self) -> Dict[str, int]:
+        return {h: row for row, h in enumerate(self.hashes)}
+
+
+class VectorIndex:
+    def __init__(self, directory: str, embedder):
+        self.directory = directory
+        self.embedder = embedder
+        self._snapshot: Optional[IndexSnapshot] = None
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.builds = 0
+        self.loads = 0
+        self.embedded = 0
+        self.reused = 0
+        self.searches = 0
+        self._search_total = 0.0
+
+    @property
+    def version(self) -> Optional[str]:
+        snapshot = self._snapshot
+        return snapshot.version if snapshot else None
+
+    def _key(self, version: str) -> str:
+        return hashlib.sha1(f"{self.embedder.name}|{version}".encode("utf-8")).hexdigest()[:16]
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        return os.path.join(self.directory, f"{key}.npy"), os.path.join(self.directory, f"{key}.json")
+
+    def _open(self, key: str) -> Optional[IndexSnapshot]:
+        matrix_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            matrix = np.load(matrix_path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        if meta.get("model") != self.embedder.name or matrix.shape != (len(meta["ids"]), self.embedder.dim):
+            return None
+        return IndexSnapshot(key, meta["version"], meta["ids"], meta["hashes"], matrix)
+
+    def _latest_on_disk(self) -> Optional[IndexSnapshot]:
+        """Most recent index of this model, reused for an incremental build after a restart."""
+        metas = sorted(glob.glob(os.path.join(self.directory, "*.json")), key=os.path.getmtime, reverse=True)
+        for meta_path in metas:
+            snapshot = self._open(os.path.basename(meta_path)[:-len(".json")])
+            if snapshot is not None:
+                return snapshot
+        return None
+
+    def update(self, texts: Dict[str, str], version: str) -> dict:
+        """
+        Makes `texts` ({id: text to embed}) the searchable content for `version`,
+        embedding only the texts not already indexed. Blocking (CPU bound).
+        """
+        with self._lock:
+            key = self._key(version)
+            if self._snapshot is not None and self._snapshot.key == key:
+                return {"embedded": 0, "reused": len(self._snapshot.ids)}
+
+            existing = self._open(key)
+            if existing is not None:
+                # Already built (by another worker, or before a restart)
+                self._snapshot = existing
+                self.loads += 1
+                logger.info("Content index %s mapped: %d entries", key, len(existing.ids))
+                return {"embedded": 0, "reused": len(existing.ids)}
+
+            previous = self._snapshot or self._latest_on_disk()
+            previous_rows = previous.rows_by_hash() if previous else {}
+            ids = list(texts)
+            hashes = [text_hash(texts[content_id]) for content_id in ids]
+            matrix = np.empty((len(ids), self.embedder.dim), dtype=np.float32)
+
+            missing = [row for row, h in enumerate(hashes) if h not in previous_rows]
+            for row, h in enumerate(hashes):
+                if h in previous_rows:
+                    matrix[row] = previous.matrix[previous_rows[h]]
+            if missing:
+                matrix[missing] = self.embedder.encode([texts[ids[row]] for row in missing])
+
+            self._write(key, version, ids, hashes, matrix)
+            self._snapshot = self._open(key) or IndexSnapshot(key, version, ids, hashes, matrix)
+            self.builds += 1
+            self.embedded += len(missing)
+            self.reused += len(ids) - len(missing)
+            logger.info(
+                "Content index %s built: %d entries (%d embedded, %d reused)",
+                key, len(ids), len(missing), len(ids) - len(missing),
+            )
+            self._cleanup(key)
+            return {"embedded": len(missing), "reused": len(ids) - len(missing)}
+
+    def _write(self, key: str, version: str, ids: List[str], hashes: List[str], matrix: np.ndarray):
+        os.makedirs(self.directory, exist_ok=True)
+        matrix_path, meta_path = self._paths(key)
+        suffix = f".{os.getpid()}.tmp"
+        with open(matrix_path + suffix, "wb") as f:
+            np.save(f, np.ascontiguousarray(matrix))
+        with open(meta_path + suffix, "w", encoding="utf-8") as f:
+            json.dump({"model": self.embedder.name, "version": version, "ids": ids, "hashes": hashes}, f)
+        # Matrix first: a meta file always points to a complete matrix
+        os.replace(matrix_path + suffix, matrix_path)
+        os.replace(meta_path + suffix, meta_path)
+
+    def _cleanup(self, current: str):
+        metas = sorted(glob.glob(os.path.join(self.directory, "*.json")), key=os.path.getmtime, reverse=True)
+        for meta_path in metas[CONTENT_INDEX_KEEP:]:
+            key = os.path.basename(meta_path)[:-len(".json")]
+            if key == current:
+                continue
+            for path in self._paths(key):
+                try:
+                    # Workers still mapping the file keep their pages until they switch
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def search(self, query: str, k: int, ids: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Top-k (id, cosine similarity) for the query, best first. `ids`
+        restricts the search to these entries.
+        """
+        snapshot = self._snapshot
+        if snapshot is None or not snapshot.ids or k <= 0:
+            return []
+        started = time.perf_counter()
+        vector = self.embedder.encode([query])[0]
+        scores = snapshot.matrix @ vector
+        if ids is not None:
+            allowed = set(ids)
+            mask = np.fromiter((content_id in allowed for content_id in snapshot.ids), dtype=bool, count=len(snapshot.ids))
+            scores = np.where(mask, scores, -np.inf)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        results = [(snapshot.ids[row], float(scores[row])) for row in top if np.isfinite(scores[row])]
+        self.searches += 1
+        self._search_total += time.perf_counter() - started
+        return results
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "model": self.embedder.name,
+            "version": snapshot.version if snapshot else None,
+            "entries": len(snapshot.ids) if snapshot else 0,
+            "dim": self.embedder.dim,
+            "builds": self.builds,
+            "loads": self.loads,
+            "embedded": self.embedded,
+            "reused": self.reused,
+            "searches": self.searches,
+            "avg_search_ms": round(self._search_total / self.searches * 1000, 2) if self.searches else 0.0,
+        }
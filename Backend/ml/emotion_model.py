@@ -1,37 +1,66 @@
-from transformers import AutoImageProcessor, AutoModelForImageClassification
 from PIL import Image
 import torch
-import torch.nn.functional as F
+import logging
+import os
+from typing import List
 
-# Load model and processor globally to avoid reloading on every request
-MODEL_NAME = "trpakov/vit-face-expression"
+from dotenv import load_dotenv
+
+from ml.face_detector import detect_faces, crop_faces, dominant_emotion
+from ml.model_registry import model_registry
+from utils.executors import TORCH_NUM_THREADS
+from utils.metrics import stage_timer
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
 
-print(f"Loading model: {MODEL_NAME}...")
+# Intra-op threads per forward pass; the inference pool is sized from it (utils/executors.py)
+if TORCH_NUM_THREADS > 0:
+    torch.set_num_threads(TORCH_NUM_THREADS)
+
+# Version loaded at startup; later versions are deployed without restart
+# (ml/model_registry.py, services/model_deployment.py)
+MODEL_NAME = os.getenv("EMOTION_MODEL_NAME", "trpakov/vit-face-expression")
+MODEL_REVISION = os.getenv("EMOTION_MODEL_REVISION") or None
+MODEL_VERSION = os.getenv("EMOTION_MODEL_VERSION", "v1")
+
+# Load model and processor globally to avoid reloading on every request
+logger.info("Loading model: %s...", MODEL_NAME)
 try:
-    processor = AutoImageProcessor.from_pretrained(MODEL_NAME)
-    model = AutoModelForImageClassification.from_pretrained(MODEL_NAME)
-    print("Model loaded successfully.")
+    model_registry.load(MODEL_VERSION, MODEL_NAME, MODEL_REVISION)
+    model_registry.activate(MODEL_VERSION)
+    logger.info("Model loaded successfully.")
 except Exception as e:
-    print(f"Error loading model: {e}")
+    logger.error("Error loading model: %s", e)
     raise e
 
+def _classify(images: List[Image.Image]) -> List[dict]:
+    """Classifies a batch of images in a single forward pass of the active model version."""
+    return model_registry.classify(images)
+
+
 def predict_emotion(image: Image.Image):
     """
     Predicts the emotion from a PIL Image.
-    Returns a dictionary with the predicted emotion and confidence score.
+    Returns a dictionary with the predicted emotion, confidence score and model version.
     """
-    inputs = processor(images=image, return_tensors="pt")
-    
-    with torch.no_grad():
-        outputs = model(**inputs)
-        logits = outputs.logits
-        probabilities = F.softmax(logits, dim=-1)
-        
-    # Get the highest probability
-    confidence, predicted_class_idx = torch.max(probabilities, dim=-1)
-    predicted_label = model.config.id2label[predicted_class_idx.item()]
-    
-    return {
-        "emotion": predicted_label,
-        "confidence": confidence.item()
-    }
+    return _classify([image])[0]
+
+
+def predict_faces(image: Image.Image):
+    """
+    Multi-face mode: detects the faces, then classifies all the crops in one
+    batched forward pass. Returns the dominant emotion (see dominant_emotion)
+    and the per-face results with their bounding boxes. Without any detected
+    face, the whole frame is classified and `faces` is empty.
+    """
+    with stage_timer("predict", "detect"):
+        boxes = detect_faces(image)
+    if not boxes:
+        return dict(predict_emotion(image), faces=[])
+
+    faces = []
+    for (x, y, w, h), result in zip(boxes, _classify(crop_faces(image, boxes))):
+        faces.append(dict(result, box={"x": x, "y": y, "width": w, "height": h}))
+    return dict(dominant_emotion(faces), faces=faces, model_version=faces[0]["model_version"])
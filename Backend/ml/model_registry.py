@@ -0,0 +1,363 @@
+"""
+Versioned emotion models, swapped without restarting the workers.
+
+    model_registry.load("v2", "trpakov/vit-face-expression", revision="3c5b1e2")  # load + warm up
+    model_registry.activate("v2")          # atomic switch
+    model_registry.set_shadow("v3", 5)     # 5 % of the batches also run on v3
+
+    with model_registry.use() as model:     # version pinned for this batch
+        results = model.classify(images)
+
+Several versions can be loaded side by side. `load` runs a few warm-up
+forward passes before a version can be activated, so the first requests on it
+don't pay the lazy initialisation. `activate` only swaps a reference: batches
+already running keep the version they pinned with `use()`, and the previous
+version is unloaded (its weights released) when its last batch returns.
+
+Shadow mode: a fraction of the batches is classified again by the candidate
+version on the `shadow` pool, after the response has been computed and
+without waiting for it. Label agreement and per-version batch latency are
+counted (model_shadow_images_total, model_batch_seconds) to compare the
+candidate with the active version before activating it. Shadow jobs that
+do not fit in the pool queue are dropped.
+"""
+import gc
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+import torch
+import torch.nn.functional as F
+from dotenv import load_dotenv
+from PIL import Image
+from transformers import AutoImageProcessor, AutoModelForImageClassification
+
+from utils.executors import executors, ExecutorBusy
+from utils.metrics import counter, histogram, stage_timer
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MODEL_WARMUP_RUNS = int(os.getenv("MODEL_WARMUP_RUNS", "3"))
+MODEL_WARMUP_BATCH = int(os.getenv("MODEL_WARMUP_BATCH", "4"))
+
+MODEL_BATCH_SECONDS = histogram(
+    "model_batch_seconds", "Preprocessing + forward pass duration of a batch, by model version and role",
+    ["version", "role"],
+)
+MODEL_SHADOW_IMAGES = counter(
+    "model_shadow_images_total", "Images classified by the shadow version, by agreement with the active one",
+    ["version", "result"],
+)
+
+
+class ModelRegistryError(Exception):
+    """Unknown version, or an operation that its state does not allow."""
+
+
+class ModelVersion:
+    """One loaded model: processor, weights and usage counters."""
+
+    def __init__(self, version: str, model_name: str, revision: Optional[str] = None):
+        self.version = version
+        self.model_name = model_name
+        self.revision = revision
+        # loading -> ready -> active -> draining -> retired (or failed)
+        self.state = "loading"
+        self.processor = None
+        self.model = None
+        self.in_flight = 0
+        self.loaded_at: Optional[float] = None
+        self.load_seconds = 0.0
+        self.warmup_ms = 0.0
+        # Set once the load ends (ready or failed), for concurrent loads of the same version
+        self.load_done = threading.Event()
+
+        # Metrics
+        self.batches = 0
+        self.images = 0
+        self._busy_total = 0.0
+
+    def spec(self) -> dict:
+        return {"version": self.version, "model_name": self.model_name, "revision": self.revision}
+
+    def load(self):
+        """Loads and warms up the model (blocking)."""
+        started = time.perf_counter()
+        self.processor = AutoImageProcessor.from_pretrained(self.model_name, revision=self.revision)
+        self.model = AutoModelForImageClassification.from_pretrained(self.model_name, revision=self.revision)
+        self.model.eval()
+        self.load_seconds = time.perf_counter() - started
+
+        blank = [Image.new("RGB", (224, 224))] * MODEL_WARMUP_BATCH
+        started = time.perf_counter()
+        for _ in range(MODEL_WARMUP_RUNS):
+            self.classify(blank, timed=False)
+        self.warmup_ms = (time.perf_counter() - started) / max(1, MODEL_WARMUP_RUNS) * 1000
+        self.loaded_at = time.time()
+        self.state = "ready"
+
+    def unload(self):
+        self.state = "retired"
+        self.processor = self.model = None
+        gc.collect()
+
+    def preprocess(self, images: List[Image.Image]) -> dict:
+        """Model inputs (pixel_values tensor) for a batch of images."""
+        return self.processor(images=images, return_tensors="pt")
+
+    def predict(self, inputs: dict) -> List[dict]:
+        """Forward pass on preprocessed inputs: emotion and confidence of each image."""
+        with torch.no_grad():
+            outputs = self.model(**inputs)
+            probabilities = F.softmax(outputs.logits, dim=-1)
+
+        # Get the highest probability of each image
+        confidences, predicted_class_idx = torch.max(probabilities, dim=-1)
+        return [
+            {"emotion": self.model.config.id2label[idx], "confidence": confidence, "model_version": self.version}
+            for idx, confidence in zip(predicted_class_idx.tolist(), confidences.tolist())
+        ]
+
+    def classify(self, images: List[Image.Image], timed: bool = True) -> List[dict]:
+        """
+        Classifies a batch of images in a single forward pass. `timed` records
+        the preprocess / inference stages of the current request.
+        """
+        started = time.perf_counter()
+        timer = stage_timer if timed else (lambda pipeline, stage: nullcontext())
+        with timer("predict", "preprocess"):
+            inputs = self.preprocess(images)
+        with timer("predict", "inference"):
+            results = self.predict(inputs)
+        if self.state != "loading":
+            self.batches += 1
+            self.images += len(images)
+            self._busy_total += time.perf_counter() - started
+        return results
+
+    def stats(self) -> dict:
+        return {
+            **self.spec(),
+            "state": self.state,
+            "in_flight": self.in_flight,
+            "loaded_at": self.loaded_at,
+            "load_seconds": round(self.load_seconds, 2),
+            "warmup_ms": round(self.warmup_ms, 1),
+            "batches": self.batches,
+            "images": self.images,
+            "avg_batch_ms": round(self._busy_total / self.batches * 1000, 1) if self.batches else 0.0,
+        }
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions: Dict[str, ModelVersion] = {}
+        self._active: Optional[ModelVersion] = None
+        self._shadow: Optional[ModelVersion] = None
+        self.shadow_percent = 0.0
+
+        # Metrics
+        self.swaps = 0
+        self.shadow_batches = 0
+        self.shadow_images = 0
+        self.shadow_agreements = 0
+        self.shadow_dropped = 0
+        self.shadow_errors = 0
+
+    @property
+    def active_version(self) -> Optional[str]:
+        active = self._active
+        return active.version if active else None
+
+    @property
+    def shadow_version(self) -> Optional[str]:
+        shadow = self._shadow
+        return shadow.version if shadow else None
+
+    def get(self, version: str) -> ModelVersion:
+        model = self._versions.get(version)
+        if model is None:
+            raise ModelRegistryError(f"Unknown model version '{version}'")
+        return model
+
+    def load(self, version: str, model_name: str, revision: Optional[str] = None) -> ModelVersion:
+        """
+        Loads and warms up a version next to the others (blocking). Already
+        loaded: no-op. Being loaded by another caller: waits for that load.
+        """
+        with self._lock:
+            existing = self._versions.get(version)
+            if existing is not None and existing.state not in ("retired", "failed"):
+                if (existing.model_name, existing.revision) != (model_name, revision):
+                    raise ModelRegistryError(f"Version '{version}' is already loaded from another model")
+            else:
+                existing = None
+                model = self._versions[version] = ModelVersion(version, model_name, revision)
+
+        if existing is not None:
+            existing.load_done.wait()
+            if existing.state == "failed":
+                raise ModelRegistryError(f"Version '{version}' failed to load")
+            return existing
+
+        logger.info("Loading model %s (%s@%s)...", version, model_name, revision or "latest")
+        try:
+            model.load()
+        except Exception:
+            model.state = "failed"
+            logger.exception("Model %s failed to load", version)
+            raise
+        finally:
+            model.load_done.set()
+        logger.info(
+            "Model %s ready: loaded in %.1f s, warm-up batch %.0f ms", version, model.load_seconds, model.warmup_ms
+        )
+        return model
+
+    def activate(self, version: str):
+        """Routes new batches to `version`; the previous one is unloaded once idle."""
+        with self._lock:
+            model = self.get(version)
+            if model.state not in ("ready", "active", "draining"):
+                raise ModelRegistryError(f"Version '{version}' cannot be activated ({model.state})")
+            previous, self._active = self._active, model
+            model.state = "active"
+            if self._shadow is model:
+                self._shadow, self.shadow_percent = None, 0.0
+            if previous is model:
+                return
+            self.swaps += 1
+            idle = previous is not None and self._retire(previous)
+        logger.info("Model %s active (previous: %s)", version, previous.version if previous else None)
+        if idle:
+            self._unload(previous)
+
+    def set_shadow(self, version: Optional[str], percent: float):
+        """Mirrors `percent` % of the batches to `version` (None or 0 disables shadow mode)."""
+        with self._lock:
+            model = self.get(version) if version and percent > 0 else None
+            if model is not None:
+                if model is self._active:
+                    raise ModelRegistryError(f"Version '{version}' is the active one")
+                if model.state not in ("ready", "draining"):
+                    raise ModelRegistryError(f"Version '{version}' cannot shadow ({model.state})")
+                model.state = "ready"
+            previous, self._shadow = self._shadow, model
+            self.shadow_percent = percent if model is not None else 0.0
+            idle = previous is not None and previous is not model and self._retire(previous)
+        if idle:
+            self._unload(previous)
+
+    def unload(self, version: str):
+        """Releases a version that is neither active nor shadow."""
+        with self._lock:
+            model = self.get(version)
+            if model is self._active or model is self._shadow:
+                raise ModelRegistryError(f"Version '{version}' is in use")
+            idle = self._retire(model)
+        if idle:
+            self._unload(model)
+
+    def _retire(self, model: ModelVersion) -> bool:
+        """Marks the version draining; True when it is already idle (caller unloads it). Lock held."""
+        if model.state in ("retired", "failed"):
+            return False
+        model.state = "draining"
+        return model.in_flight == 0
+
+    def _unload(self, model: ModelVersion):
+        with self._lock:
+            if model.state != "draining" or model.in_flight:
+                return
+            if self._versions.get(model.version) is model:
+                del self._versions[model.version]
+        model.unload()
+        logger.info("Model %s unloaded", model.version)
+
+    def _release(self, model: ModelVersion):
+        with self._lock:
+            model.in_flight -= 1
+            idle = model.state == "draining" and model.in_flight == 0
+        if idle:
+            self._unload(model)
+
+    @contextmanager
+    def _pinned(self, model: ModelVersion):
+        try:
+            yield model
+        finally:
+            self._release(model)
+
+    def use(self):
+        """Pins the active version for one batch (it stays loaded until the batch returns)."""
+        with self._lock:
+            model = self._active
+            if model is None:
+                raise ModelRegistryError("No active model version")
+            model.in_flight += 1
+        return self._pinned(model)
+
+    def classify(self, images: List[Image.Image]) -> List[dict]:
+        """Classifies with the active version, and mirrors the batch to the shadow version if sampled."""
+        started = time.perf_counter()
+        with self.use() as model:
+            results = model.classify(images)
+        MODEL_BATCH_SECONDS.observe(time.perf_counter() - started, version=model.version, role="active")
+        self._mirror(images, results)
+        return results
+
+    def _mirror(self, images: List[Image.Image], results: List[dict]):
+        with self._lock:
+            shadow = self._shadow
+            if shadow is None or random.random() * 100 >= self.shadow_percent:
+                return
+            shadow.in_flight += 1
+        try:
+            executors["shadow"].submit(self._shadow_job, shadow, images, results)
+        except ExecutorBusy:
+            self.shadow_dropped += 1
+            self._release(shadow)
+
+    def _shadow_job(self, shadow: ModelVersion, images: List[Image.Image], results: List[dict]):
+        started = time.perf_counter()
+        try:
+            shadow_results = shadow.classify(images, timed=False)
+        except Exception as e:
+            self.shadow_errors += 1
+            logger.warning("Shadow model %s failed: %s", shadow.version, e)
+            return
+        finally:
+            self._release(shadow)
+        MODEL_BATCH_SECONDS.observe(time.perf_counter() - started, version=shadow.version, role="shadow")
+        agreements = sum(a["emotion"] == b["emotion"] for a, b in zip(results, shadow_results))
+        MODEL_SHADOW_IMAGES.inc(agreements, version=shadow.version, result="agree")
+        MODEL_SHADOW_IMAGES.inc(len(results) - agreements, version=shadow.version, result="disagree")
+        self.shadow_batches += 1
+        self.shadow_images += len(results)
+        self.shadow_agreements += agreements
+
+    def stats(self) -> dict:
+        with self._lock:
+            versions = list(self._versions.values())
+        return {
+            "active": self.active_version,
+            "shadow": self.shadow_version,
+            "shadow_percent": self.shadow_percent,
+            "swaps": self.swaps,
+            "shadow_batches": self.shadow_batches,
+            "shadow_images": self.shadow_images,
+            "shadow_agreement": round(self.shadow_agreements / self.shadow_images, 4) if self.shadow_images else None,
+            "shadow_dropped": self.shadow_dropped,
+            "shadow_errors": self.shadow_errors,
+            "versions": {model.version: model.stats() for model in versions},
+        }
+
+
+model_registry = ModelRegistry()
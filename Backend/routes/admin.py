@@ -0,0 +1,111 @@
+import hmac
+import logging
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from ml.model_registry import ModelRegistryError
+from schemas.admin_schema import ModelDeploy, ModelShadowUpdate, ProfilingUpdate
+from services.model_deployment import model_deployment
+from utils.profiling import ADMIN_TOKEN, profiling_settings
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+async def require_admin(
+    x_admin_token: Optional[str] = Header(None), authorization: Optional[str] = Header(None),
+):
+    """
+    Protège les routes d'administration et de suivi (/stats, /metrics) par le
+    jeton ADMIN_TOKEN: en-tête X-Admin-Token, ou `Authorization: Bearer <jeton>`
+    (configuration `authorization` d'un scrape Prometheus).
+    """
+    if not ADMIN_TOKEN:
+        # Pas de jeton configuré: administration désactivée
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    token = x_admin_token
+    if token is None and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[len("bearer "):]
+    if not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin token")
+
+
+@router.get("/profiling", dependencies=[Depends(require_admin)])
+async def get_profiling():
+    """Paramètres actuels du profileur par échantillonnage."""
+    return profiling_settings.as_dict()
+
+
+@router.put("/profiling", dependencies=[Depends(require_admin)])
+async def update_profiling(update: ProfilingUpdate):
+    """
+    Active/désactive le profilage sans redéployer.
+
+    Request body:
+    {
+        "sample_rate": 0.01,
+        "interval_ms": 5
+    }
+    """
+    if update.sample_rate is not None:
+        profiling_settings.sample_rate = update.sample_rate
+    if update.interval_ms is not None:
+        profiling_settings.interval_ms = update.interval_ms
+    logger.info("Profiling settings updated: %s", profiling_settings.as_dict())
+    return profiling_settings.as_dict()
+
+
+@router.get("/models", dependencies=[Depends(require_admin)])
+async def get_models():
+    """Versions du modèle chargées sur ce worker, version active, mode shadow et accord des labels."""
+    return model_deployment.stats()
+
+
+@router.post("/models/deploy", dependencies=[Depends(require_admin)])
+async def deploy_model(deploy: ModelDeploy):
+    """
+    Charge, préchauffe puis active une version du modèle, sans redémarrage.
+    Les requêtes en cours finissent sur l'ancienne version, libérée ensuite;
+    les autres workers suivent dans les MODEL_DEPLOYMENT_POLL_SECONDS.
+
+    Request body:
+    {
+        "version": "v2",
+        "model_name": "trpakov/vit-face-expression",
+        "revision": "main"
+    }
+    """
+    try:
+        await model_deployment.deploy(deploy.version, deploy.model_name, deploy.revision)
+    except ModelRegistryError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except Exception as e:
+        # Traceback already logged by the registry
+        logger.warning("Model deployment failed: %s", e)
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Model could not be loaded: {e}")
+    return model_deployment.stats()
+
+
+@router.put("/models/shadow", dependencies=[Depends(require_admin)])
+async def update_model_shadow(update: ModelShadowUpdate):
+    """
+    Envoie une part des lots à une version candidate, hors du chemin critique,
+    pour comparer latence et labels avec la version active.
+
+    Request body:
+    {
+        "version": "v3",
+        "model_name": "org/new-face-model",
+        "percent": 5
+    }
+    """
+    if update.percent > 0 and not (update.version and update.model_name):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="version and model_name are required")
+    try:
+        await model_deployment.set_shadow(update.version, update.model_name, update.revision, update.percent)
+    except ModelRegistryError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except Exception as e:
+        logger.warning("Shadow model update failed: %s", e)
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Model could not be loaded: {e}")
+    return model_deployment.stats()
@@ -1,6 +1,18 @@
-from fastapi import APIRouter, HTTPException
+import json
+import logging
+import math
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from auth.auth_router import get_client_key
 from schemas.chat_schema import ChatRequest, ChatResponse
-from services.llm_service import LLMService
+from services.llm_service import LLMService, OVERLOADED_MESSAGE, FALLBACK_MESSAGES, StreamInterrupted
+from services.admission_control import llm_admission, AdmissionRejected
+from services.conversation_service import conversation_store, ConversationNotFound
+from services.content_suggestions import content_suggestions
+from utils.encoding import encoded_response
+from utils.metrics import stage_timer
+
+logger = logging.getLogger(__name__)
 
 # Initialiser le router
 router = APIRouter(prefix="/api/chat", tags=["chat"])
@@ -9,43 +21,189 @@ router = APIRouter(prefix="/api/chat", tags=["chat"])
 llm_service = LLMService()
 
 
+async def _load_conversation(request: ChatRequest, client_key: str) -> dict:
+    """
+    Charge la conversation demandée si elle appartient à l'utilisateur
+    authentifié, ou en crée une nouvelle (initialisée avec `history`). Un
+    appelant anonyme travaille sur `history` sans rien persister.
+    """
+    owner = client_key if client_key.startswith("user:") else None
+    try:
+        return await conversation_store.get_or_create(request.conversation_id, request.history, owner)
+    except ConversationNotFound:
+        raise HTTPException(status_code=404, detail="Conversation introuvable")
+
+
 @router.post("/", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request, client_key: str = Depends(get_client_key)):
     """
     Endpoint POST pour envoyer un message au LLM et recevoir une réponse.
 
+    L'historique est conservé côté serveur: le premier appel (sans
+    conversation_id) crée une conversation, les appels suivants n'envoient
+    que le nouveau message et le conversation_id retourné. Un appelant
+    anonyme n'a pas de conversation stockée: il renvoie `history` à chaque
+    appel et reçoit `conversation_id: null`.
+
     Request body:
     {
         "message": "Je me sens triste",
-        "history": [
-            {"role": "user", "content": "Bonjour"},
-            {"role": "assistant", "content": "Bonjour! Comment vas-tu aujourd'hui?"}
-        ]
+        "conversation_id": "665f1c2e9b1e8a3d4c2b1a00"
     }
 
     Response:
     {
         "response": "Je suis là pour toi. Veux-tu en parler?",
-        "role": "assistant"
+        "role": "assistant",
+        "conversation_id": "665f1c2e9b1e8a3d4c2b1a00",
+        "source": "llm",
+        "suggestions": [{"id": "...", "type": "douaa", "emotion": "sad", "text": "...", "score": 0.61}]
     }
+
+    `suggestions` liste les douaas / versets du catalogue proches du message.
+    Une demande simple de contenu ("un douaa pour la tristesse") est servie
+    directement depuis le catalogue, sans appel au LLM (`source: "index"`).
     """
     try:
         # Valider que le message n'est pas vide
         if not request.message or not request.message.strip():
             raise HTTPException(status_code=400, detail="Le message ne peut pas être vide")
 
-        # Appeler le service LLM avec le message et l'historique
-        response = await llm_service.chat(request.message, request.history)
+        with stage_timer("chat", "conversation"):
+            conversation = await _load_conversation(request, client_key)
+            summary, recent = conversation_store.build_context(
+                conversation, request.message, llm_service.system_prompt
+            )
 
-        # Retourner la réponse
-        return ChatResponse(response=response, role="assistant")
+        suggestions = await content_suggestions.suggest(request.message)
+        response = content_suggestions.direct_answer(request.message, suggestions)
+        source = "index" if response else "llm"
+
+        # Appeler le service LLM avec le message et le contexte fenêtré
+        try:
+            if response is None:
+                with stage_timer("chat", "llm"):
+                    response = await llm_service.chat(request.message, recent, summary, client_key)
+        except AdmissionRejected as e:
+            if e.reason == "rate_limited":
+                raise HTTPException(
+                    status_code=429,
+                    detail="Trop de messages, réessaye dans un instant.",
+                    headers={"Retry-After": str(math.ceil(e.retry_after or 1))},
+                )
+            # Surcharge: réponse statique immédiate, non enregistrée dans la conversation
+            return encoded_response(http_request, ChatResponse(
+                response=OVERLOADED_MESSAGE, role="assistant", conversation_id=conversation["id"],
+                source="static", suggestions=suggestions,
+            ).model_dump())
+
+        if response in FALLBACK_MESSAGES:
+            # Erreur du LLM: la réponse de repli n'est pas enregistrée
+            source = "static"
+        else:
+            with stage_timer("chat", "persist"):
+                await conversation_store.append(conversation, request.message, response)
+
+        # Retourner la réponse (JSON ou msgpack selon l'en-tête Accept)
+        return encoded_response(http_request, ChatResponse(
+            response=response, role="assistant", conversation_id=conversation["id"],
+            source=source, suggestions=suggestions,
+        ).model_dump())
 
     except HTTPException as e:
         # Re-lancer les HTTP exceptions
         raise e
     except Exception as e:
         # Log et retourner une erreur générique
-        print(f"Error in chat endpoint: {e}")
+        logger.exception("Error in chat endpoint: %s", e)
         raise HTTPException(
             status_code=500, detail="Une erreur est survenue lors du traitement."
         )
+
+
+@router.post("/stream")
+async def chat_stream(request: ChatRequest, client_key: str = Depends(get_client_key)):
+    """
+    Variante streaming de /api/chat/ (Server-Sent Events).
+
+    Même corps de requête que /api/chat/. Chaque token nettoyé est envoyé dès
+    sa réception:
+
+        data: {"token": "Je suis "}
+
+    puis un événement final contenant la réponse complète:
+
+        event: done
+        data: {"response": "Je suis là pour toi.", "role": "assistant", "conversation_id": "...",
+               "source": "llm", "suggestions": [...]}
+
+    Si le LLM échoue après les premiers tokens, le flux se termine par un
+    événement d'erreur et la réponse partielle n'est pas enregistrée:
+
+        event: error
+        data: {"detail": "...", "response": "Je suis ", "conversation_id": "..."}
+
+    Une réponse tirée du catalogue (`source: "index"`) est envoyée en un seul token.
+    Comme pour /api/chat/, un utilisateur qui dépasse sa limite reçoit une 429
+    avec Retry-After (vérifiée avant d'ouvrir le flux).
+    """
+    # Valider que le message n'est pas vide
+    if not request.message or not request.message.strip():
+        raise HTTPException(status_code=400, detail="Le message ne peut pas être vide")
+
+    with stage_timer("chat_stream", "conversation"):
+        conversation = await _load_conversation(request, client_key)
+        summary, recent = conversation_store.build_context(
+            conversation, request.message, llm_service.system_prompt
+        )
+    suggestions = await content_suggestions.suggest(request.message)
+    direct = content_suggestions.direct_answer(request.message, suggestions)
+    cached = None if direct is not None else await llm_service.cached_response(request.message, recent, summary)
+    if direct is None and cached is None:
+        try:
+            llm_admission.check_rate(client_key)
+        except AdmissionRejected as e:
+            raise HTTPException(
+                status_code=429,
+                detail="Trop de messages, réessaye dans un instant.",
+                headers={"Retry-After": str(math.ceil(e.retry_after or 1))},
+            )
+
+    async def tokens():
+        if direct is not None or cached is not None:
+            yield direct if direct is not None else cached
+            return
+        async for token in llm_service.chat_stream(request.message, recent, summary, client_key, rate_checked=True):
+            yield token
+
+    async def event_stream():
+        parts = []
+        try:
+            async for token in tokens():
+                parts.append(token)
+                yield f"data: {json.dumps({'token': token}, ensure_ascii=False)}\n\n"
+        except StreamInterrupted:
+            error = {
+                "detail": "La réponse a été interrompue, réessaye s'il te plaît.",
+                "response": "".join(parts), "conversation_id": conversation["id"],
+            }
+            yield f"event: error\ndata: {json.dumps(error, ensure_ascii=False)}\n\n"
+            return
+
+        response = "".join(parts)
+        fallback = direct is None and response in FALLBACK_MESSAGES
+        if not fallback:
+            await conversation_store.append(conversation, request.message, response)
+
+        source = "index" if direct is not None else ("static" if fallback else "llm")
+        done = {
+            "response": response, "role": "assistant", "conversation_id": conversation["id"],
+            "source": source, "suggestions": suggestions,
+        }
+        yield f"event: done\ndata: {json.dumps(done, ensure_ascii=False)}\n\n"
+
+    # Désactiver la mise en tampon des proxys pour recevoir les tokens immédiatement
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if conversation["id"] is not None:
+        headers["X-Conversation-Id"] = conversation["id"]
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=headers)
@@ -1,12 +1,33 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, status
+from typing import Optional
+from fastapi import APIRouter, UploadFile, File, HTTPException, status, Depends, Header, Request, Response
+from auth.auth_router import get_client_key
+from services.content_catalog import content_catalog, CONTENT_CATALOG_MAX_AGE
 from services.emotion_service import analyze_emotion
+from utils.deadline import Deadline, predict_deadline
+from utils.encoding import choose_encoding, encoded_response, wants_msgpack, JSON_MEDIA, MSGPACK_MEDIA
+from utils.executors import ExecutorBusy
 
 router = APIRouter(prefix="/emotion", tags=["emotion"])
 
 @router.post("/predict")
-async def predict_emotion_endpoint(image: UploadFile = File(...)):
+async def predict_emotion_endpoint(
+    request: Request,
+    image: UploadFile = File(...),
+    include_content: bool = True,
+    multi_face: bool = False,
+    client_key: str = Depends(get_client_key),
+    deadline: Deadline = Depends(predict_deadline),
+):
     """
     Upload an image file to detect emotion.
+    With include_content=false, the douaa and ayah texts are left out: the
+    client resolves douaa_id / ayah_id from its copy of GET /emotion/content.
+    With multi_face=true, all the faces of the photo are detected and classified:
+    `faces` lists their emotion and bounding box, and emotion / confidence are
+    those of the dominant emotion of the group.
+    The X-Request-Budget-Ms header sets the time budget (default PREDICT_BUDGET_MS):
+    optional stages that cannot fit are skipped and listed in shed_stages.
+    Send Accept: application/msgpack for a msgpack body instead of JSON.
     """
     # Validate file type
     if image.content_type not in ["image/jpeg", "image/png", "image/jpg"]:
@@ -19,17 +40,77 @@ async def predict_emotion_endpoint(image: UploadFile = File(...)):
         # Read file bytes
         file_bytes = await image.read()
         
-        # Analyze emotion
-        result = await analyze_emotion(file_bytes)
+        # Analyze emotion (authenticated users: recorded in their emotion history)
+        user_id = client_key[len("user:"):] if client_key.startswith("user:") else None
+        result = await analyze_emotion(file_bytes, client_key, user_id, deadline, multi_face)
         
         # Add text direction metadata for proper rendering
         result["text_direction"] = "rtl"  # Right-to-left for Arabic text
         result["text_encoding"] = "utf-8"
+
+        if not include_content:
+            for key in ("douaa", "ayah_text", "ayah_reference"):
+                result.pop(key, None)
         
-        return result
+        return encoded_response(request, result)
         
+    except ExecutorBusy:
+        # Inference pool full: ask the client to retry rather than queueing without bound
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, please retry",
+            headers={"Retry-After": "1"},
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error processing image: {str(e)}"
         )
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match comparé à l'ETag de la représentation sélectionnée uniquement."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Comparaison faible (RFC 9110): on ignore le préfixe W/
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in candidates
+
+
+@router.get("/content")
+async def content_catalog_endpoint(
+    request: Request,
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Catalogue complet des douaas et versets (pour le préchargement côté client).
+
+    Réponse pré-sérialisée (JSON, ou msgpack avec Accept: application/msgpack;
+    compressée brotli / gzip si acceptée), avec ETag fort et Cache-Control:
+    renvoyer l'ETag dans If-None-Match donne un 304 sans corps tant que le
+    catalogue n'a pas changé.
+
+    {
+        "version": "...",
+        "items": {"<id>": {"emotion": "sad", "type": "douaa", "text": "..."}, ...},
+        "by_emotion": {"sad": {"douaa": ["<id>", ...], "quran": [...]}, ...}
+    }
+    """
+    catalog = await content_catalog.get()
+    fmt = "msgpack" if wants_msgpack(request.headers.get("accept", "")) else "json"
+    encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+    body, etag = catalog.variant(fmt, encoding)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={CONTENT_CATALOG_MAX_AGE}",
+        "Vary": "Accept, Accept-Encoding",
+    }
+
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=MSGPACK_MEDIA if fmt == "msgpack" else JSON_MEDIA, headers=headers)
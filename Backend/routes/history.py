@@ -0,0 +1,33 @@
+from datetime import date
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from auth.auth_router import get_current_user
+from models.user_model import UserOut
+from schemas.history_schema import TimelineResponse
+from services.timeline_service import get_timeline, TIMELINE_MAX_LIMIT
+
+router = APIRouter(prefix="/me/emotions", tags=["history"])
+
+
+@router.get("/timeline", response_model=TimelineResponse)
+async def emotion_timeline(
+    limit: int = Query(30, ge=1, le=TIMELINE_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    current_user: UserOut = Depends(get_current_user),
+):
+    """
+    Frise des émotions de l'utilisateur connecté, un élément par jour
+    (du plus récent au plus ancien), servie depuis les agrégats journaliers.
+
+    GET /me/emotions/timeline?limit=7
+    GET /me/emotions/timeline?limit=7&cursor=2024-05-28
+    GET /me/emotions/timeline?start=2024-05-01&end=2024-05-31
+    """
+    if cursor is not None:
+        try:
+            date.fromisoformat(cursor)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return await get_timeline(current_user.id, limit, cursor, start, end)
@@ -0,0 +1,31 @@
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Optional
+
+# Schéma pour modifier le profilage à chaud (PUT /admin/profiling)
+class ProfilingUpdate(BaseModel):
+    # Fraction des requêtes profilées (0 = désactivé)
+    sample_rate: Optional[float] = Field(None, ge=0.0, le=1.0)
+    # Intervalle d'échantillonnage des piles d'appels
+    interval_ms: Optional[float] = Field(None, ge=1.0, le=1000.0)
+
+
+# Schéma pour déployer une version du modèle d'émotion (POST /admin/models/deploy)
+class ModelDeploy(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    # Identifiant libre de la version ("v2", "2024-06-vit")
+    version: str = Field(..., min_length=1, max_length=64)
+    # Modèle Hugging Face (ou chemin local) et révision (commit, tag ou branche)
+    model_name: str = Field(..., min_length=1)
+    revision: Optional[str] = None
+
+
+# Schéma pour le mode shadow (PUT /admin/models/shadow)
+class ModelShadowUpdate(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    version: Optional[str] = Field(None, min_length=1, max_length=64)
+    model_name: Optional[str] = None
+    revision: Optional[str] = None
+    # Pourcentage des lots envoyés à la version candidate (0 = désactivé)
+    percent: float = Field(0.0, ge=0.0, le=100.0)
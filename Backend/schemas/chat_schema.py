@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Literal
+from typing import List, Literal, Optional
 
 # Schéma pour un message dans l'historique
 class Message(BaseModel):
@@ -10,10 +10,29 @@ class Message(BaseModel):
 # Schéma pour la requête de chat
 class ChatRequest(BaseModel):
     message: str
+    # Conversation stockée côté serveur: le client n'envoie que le nouveau message
+    conversation_id: Optional[str] = None
+    # Ancien mode (historique complet renvoyé par le client), utilisé pour
+    # initialiser une nouvelle conversation quand conversation_id est absent
     history: List[Message] = []
 
 
+# Douaa / verset du catalogue proche du message (services/content_suggestions.py)
+class ContentSuggestion(BaseModel):
+    id: str
+    type: Literal["douaa", "quran"]
+    emotion: str
+    text: str
+    score: float
+    ayah_text: Optional[str] = None
+    ayah_reference: Optional[str] = None
+
+
 # Schéma pour la réponse de chat
 class ChatResponse(BaseModel):
     response: str
     role: str = "assistant"
+    conversation_id: Optional[str] = None
+    # "llm", "index" (réponse tirée du catalogue, sans LLM) ou "static" (surcharge)
+    source: str = "llm"
+    suggestions: List[ContentSuggestion] = []
@@ -0,0 +1,22 @@
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+
+# Statistiques d'une émotion sur une journée
+class DayEmotion(BaseModel):
+    count: int
+    mean_confidence: Optional[float] = None
+
+
+# Une journée de la frise des émotions
+class TimelineDay(BaseModel):
+    day: str  # YYYY-MM-DD
+    total: int
+    dominant: Optional[str] = None
+    emotions: Dict[str, DayEmotion] = {}
+
+
+# Page de la frise (du plus récent au plus ancien)
+class TimelineResponse(BaseModel):
+    days: List[TimelineDay]
+    # À renvoyer dans `cursor` pour la page suivante (None: plus de données)
+    next_cursor: Optional[str] = None
@@ -0,0 +1,227 @@
+"""
+Contrôle d'admission partagé pour tous les appels LLM sortants
+(chat DhikrAI et explications d'émotion).
+
+- plafond global d'appels simultanés (LLM_MAX_CONCURRENCY)
+- limite par utilisateur en token bucket, clé = sujet du JWT (ou IP si anonyme)
+- file d'attente bornée avec priorités (LLM_PRIORITY_ORDER)
+- rejet immédiat quand la file est pleine: l'appelant sert alors un repli statique
+"""
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from utils.metrics import register_collector, stats_collector
+
+load_dotenv()
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "10"))
+LLM_USER_RATE_PER_MINUTE = float(os.getenv("LLM_USER_RATE_PER_MINUTE", "20"))
+LLM_USER_BURST = float(os.getenv("LLM_USER_BURST", "5"))
+# Ordre de priorité des workloads, du plus prioritaire au moins prioritaire
+LLM_PRIORITY_ORDER = [p.strip() for p in os.getenv("LLM_PRIORITY_ORDER", "explanation,chat").split(",") if p.strip()]
+
+# Nombre max de buckets conservés avant de purger ceux qui sont pleins (inactifs)
+_MAX_BUCKETS = 10000
+
+
+def priority_of(workload: str) -> int:
+    """Priorité numérique d'un workload (plus petit = servi en premier)."""
+    try:
+        return LLM_PRIORITY_ORDER.index(workload)
+    except ValueError:
+        return len(LLM_PRIORITY_ORDER)
+
+
+class AdmissionRejected(Exception):
+    """Appel LLM refusé: 'rate_limited', 'queue_full' ou 'queue_timeout'."""
+
+    def __init__(self, reason: str, retry_after: Optional[float] = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_consume(self) -> Optional[float]:
+        """Consomme un jeton. Retourne None si accepté, sinon le délai avant le prochain jeton."""
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return None
+        return (1 - self.tokens) / self.rate if self.rate > 0 else None
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_queue: int = LLM_MAX_QUEUE,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT,
+        user_rate_per_minute: float = LLM_USER_RATE_PER_MINUTE,
+        user_burst: float = LLM_USER_BURST,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.user_rate = user_rate_per_minute / 60.0
+        self.user_burst = user_burst
+
+        self._active = 0
+        self._queue = []  # heap de (priorité, séquence, future, workload)
+        self._seq = itertools.count()
+        self._buckets: Dict[str, TokenBucket] = {}
+
+        # Métriques
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"rate_limited": 0, "queue_full": 0, "queue_timeout": 0}
+        self.max_queue_depth_seen = 0
+        self._wait_total = 0.0
+        self._waited = 0
+
+    def check_rate(self, client_key: Optional[str]):
+        """Consomme un jeton du client ou lève AdmissionRejected("rate_limited")."""
+        if not client_key or self.user_rate <= 0:
+            return
+        bucket = self._buckets.get(client_key)
+        if bucket is None:
+            if len(self._buckets) >= _MAX_BUCKETS:
+                self._buckets = {k: b for k, b in self._buckets.items() if not b.is_full()}
+            bucket = self._buckets[client_key] = TokenBucket(self.user_rate, self.user_burst)
+        retry_after = bucket.try_consume()
+        if retry_after is not None:
+            self.rejected["rate_limited"] += 1
+            raise AdmissionRejected("rate_limited", retry_after)
+
+    async def acquire(self, client_key: Optional[str] = None, workload: str = "chat", check_rate: bool = True):
+        """
+        Attend une place pour un appel LLM ou lève AdmissionRejected.
+        `check_rate=False` quand l'appelant a déjà consommé le jeton (check_rate).
+        """
+        if check_rate:
+            self.check_rate(client_key)
+
+        # Les places libérées sont transmises aux waiters: s'il en reste, personne n'attend
+        if self._active < self.max_concurrency:
+            self._active += 1
+            self.admitted += 1
+            return
+
+        if len(self._queue) >= self.max_queue:
+            # Purger les waiters abandonnés (timeout/annulation) avant de refuser
+            self._queue = [entry for entry in self._queue if not entry[2].done()]
+            heapq.heapify(self._queue)
+        if len(self._queue) >= self.max_queue:
+            self.rejected["queue_full"] += 1
+            raise AdmissionRejected("queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority_of(workload), next(self._seq), future, workload))
+        self.max_queue_depth_seen = max(self.max_queue_depth_seen, len(self._queue))
+        started = time.monotonic()
+
+        try:
+            # La place est transmise directement par release() au waiter servi
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # Place attribuée juste au moment du timeout: on la garde
+                pass
+            else:
+                future.cancel()
+                self.rejected["queue_timeout"] += 1
+                raise AdmissionRejected("queue_timeout")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+            raise
+
+        self._wait_total += time.monotonic() - started
+        self._waited += 1
+        self.admitted += 1
+
+    def release(self):
+        """Libère une place et la transmet au waiter le plus prioritaire."""
+        while self._queue:
+            _, _, future, _ = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(True)
+                return
+        self._active -= 1
+
+    def release_when_done(self, future: concurrent.futures.Future):
+        """
+        Libère la place quand `future` (travail lancé dans un thread) se termine.
+        Un appelant qui abandonne l'attente (timeout, annulation) ne libère donc
+        pas la place tant que l'appel HTTP du thread est encore en cours.
+        """
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.release))
+
+    @asynccontextmanager
+    async def slot(self, client_key: Optional[str] = None, workload: str = "chat", check_rate: bool = True):
+        await self.acquire(client_key, workload, check_rate)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, future, _ in self._queue if not future.done())
+
+    def stats(self) -> dict:
+        queued_by_workload: Dict[str, int] = {}
+        for _, _, future, workload in self._queue:
+            if not future.done():
+                queued_by_workload[workload] = queued_by_workload.get(workload, 0) + 1
+        return {
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": sum(queued_by_workload.values()),
+            "queue_depth_by_workload": queued_by_workload,
+            "max_queue": self.max_queue,
+            "max_queue_depth_seen": self.max_queue_depth_seen,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "avg_queue_wait_ms": round(self._wait_total / self._waited * 1000, 1) if self._waited else 0.0,
+            "tracked_clients": len(self._buckets),
+        }
+
+
+# Contrôleur partagé par tous les appels LLM sortants
+llm_admission = AdmissionController()
+register_collector(stats_collector(
+    "llm_admission",
+    llm_admission.stats,
+    counters=["admitted", "rejected"],
+    dict_labels={"rejected": "reason", "queue_depth_by_workload": "workload"},
+))
@@ -0,0 +1,169 @@
+"""
+Catalogue complet des douaas et versets, chargé depuis MongoDB et mis en cache.
+
+Le catalogue est lu en une requête, puis gardé en mémoire avec sa forme
+sérialisée (JSON, et à la demande msgpack et versions gzip / brotli, chacune
+encodée une seule fois par version) et un ETag fort calculé sur le contenu. Il
+est relu au plus toutes les CONTENT_CATALOG_TTL_SECONDS; la version (ETag) ne
+change que si le contenu a changé. Les documents bruts passent par le cache
+partagé (utils/cache.py): un seul worker interroge MongoDB par période, les
+autres relisent sa copie.
+
+Il sert à la fois:
+- à GET /emotion/content (réponse pré-sérialisée, 304 si l'ETag correspond)
+- au choix du douaa/verset d'une prédiction, sans requête MongoDB
+
+Identifiant d'un contenu: "<_id du document>:<index dans content>".
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from db.mongo import emotion_content_collection
+from utils.cache import TieredCache
+from utils.encoding import compress, dumps_msgpack
+from utils.metrics import stage_timer, cache_collector, register_collector, stats_collector
+from utils.text_utils import parse_ayah
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+CONTENT_CATALOG_TTL = float(os.getenv("CONTENT_CATALOG_TTL_SECONDS", "300"))
+CONTENT_CATALOG_MAX_AGE = int(os.getenv("CONTENT_CATALOG_MAX_AGE_SECONDS", "3600"))
+
+# Pas de L1: le snapshot en mémoire en tient lieu
+catalog_documents_cache = TieredCache("content_catalog", CONTENT_CATALOG_TTL, l1_size=0)
+
+
+async def _load_documents() -> List[dict]:
+    with stage_timer("content", "catalog_db"):
+        documents = await emotion_content_collection.find({}, {"emotion": 1, "type": 1, "content": 1}).to_list(None)
+    # Forme JSON pour le cache partagé
+    return [dict(doc, _id=str(doc["_id"])) for doc in documents]
+
+
+class CatalogSnapshot:
+    """Une version figée du catalogue et de ses représentations HTTP."""
+
+    def __init__(self, documents: List[dict]):
+        self.items: Dict[str, dict] = {}
+        # emotion -> type ("douaa" / "quran") -> [ids]
+        self.by_emotion: Dict[str, Dict[str, List[str]]] = {}
+
+        for doc in sorted(documents, key=lambda d: str(d["_id"])):
+            emotion = str(doc.get("emotion", "")).lower()
+            content_type = doc.get("type")
+            for index, text in enumerate(doc.get("content") or []):
+                content_id = f"{doc['_id']}:{index}"
+                item = {"emotion": emotion, "type": content_type, "text": text}
+                if content_type == "quran":
+                    parsed = parse_ayah(text)
+                    item.update(ayah_text=parsed["text"], ayah_reference=parsed["reference"])
+                self.items[content_id] = item
+                self.by_emotion.setdefault(emotion, {}).setdefault(content_type, []).append(content_id)
+
+        body = {"items": self.items, "by_emotion": self.by_emotion}
+        payload = json.dumps(body, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf-8")
+        self.version = hashlib.sha256(payload).hexdigest()[:32]
+        self.json = json.dumps(
+            dict(body, version=self.version), ensure_ascii=False, separators=(",", ":"), sort_keys=True
+        ).encode("utf-8")
+        self.gzip = gzip.compress(self.json, compresslevel=9)
+        self.etag = f'"{self.version}"'
+        # Entité différente (content-coding): ETag distinct
+        self.gzip_etag = f'"{self.version}-gzip"'
+        self._variants: Dict[Tuple[str, Optional[str]], Tuple[bytes, str]] = {
+            ("json", None): (self.json, self.etag),
+            ("json", "gzip"): (self.gzip, self.gzip_etag),
+        }
+
+    def variant(self, fmt: str, encoding: Optional[str]) -> Tuple[bytes, str]:
+        """(corps, ETag) pour le format ("json" / "msgpack") et l'encodage demandés, encodé une seule fois."""
+        key = (fmt, encoding)
+        if key not in self._variants:
+            body = self.json if fmt == "json" else dumps_msgpack(json.loads(self.json))
+            if encoding:
+                body = compress(body, encoding, static=True)
+            suffix = "-".join(part for part in (fmt if fmt != "json" else None, encoding) if part)
+            self._variants[key] = (body, f'"{self.version}-{suffix}"')
+        return self._variants[key]
+
+    def ids_for(self, emotion: str, content_type: str) -> List[str]:
+        return self.by_emotion.get(emotion, {}).get(content_type, [])
+
+
+class ContentCatalog:
+    def __init__(self, ttl: float = CONTENT_CATALOG_TTL):
+        self.ttl = ttl
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self.reloads = 0
+        self.version_changes = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self) -> CatalogSnapshot:
+        """Catalogue courant (rechargé si plus vieux que le TTL)."""
+        if self._snapshot is not None and time.monotonic() - self._loaded_at < self.ttl:
+            self.hits += 1
+            return self._snapshot
+        async with self._lock:
+            # Un seul rechargement même si plusieurs requêtes arrivent en même temps
+            if self._snapshot is None or time.monotonic() - self._loaded_at >= self.ttl:
+                self.misses += 1
+                try:
+                    await self._reload()
+                except Exception as e:
+                    if self._snapshot is None:
+                        raise
+                    # Base indisponible: on continue avec la version en cache
+                    logger.warning("Rechargement du catalogue impossible, version en cache conservee: %s", e)
+                    self._loaded_at = time.monotonic()
+            return self._snapshot
+
+    async def _reload(self):
+        documents = await catalog_documents_cache.get_or_compute("documents", _load_documents)
+        snapshot = CatalogSnapshot(documents)
+        self.reloads += 1
+        if self._snapshot is None or snapshot.version != self._snapshot.version:
+            self.version_changes += 1
+            logger.info(
+                "Catalogue de contenu charge: version %s, %d elements, %d octets (%d gzip)",
+                snapshot.version, len(snapshot.items), len(snapshot.json), len(snapshot.gzip),
+            )
+            self._snapshot = snapshot
+        self._loaded_at = time.monotonic()
+
+    async def invalidate(self):
+        """Force un rechargement depuis MongoDB à la prochaine lecture (après modification du contenu)."""
+        await catalog_documents_cache.delete("documents")
+        self._loaded_at = 0.0
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version if snapshot else None,
+            "items": len(snapshot.items) if snapshot else 0,
+            "json_bytes": len(snapshot.json) if snapshot else 0,
+            "gzip_bytes": len(snapshot.gzip) if snapshot else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "version_changes": self.version_changes,
+        }
+
+
+content_catalog = ContentCatalog()
+register_collector(stats_collector(
+    "content_catalog", content_catalog.stats, counters=["hits", "misses", "reloads", "version_changes"],
+))
+register_collector(cache_collector("content_catalog", content_catalog.stats))
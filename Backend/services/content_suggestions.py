@@ -0,0 +1,178 @@
+"""
+Suggestions de douaas / versets pour DhikrAI, par recherche vectorielle locale.
+
+Chaque élément du catalogue (services/content_catalog.py) est indexé avec son
+émotion en français et son type (ml/content_index.py). Pour un message de
+chat, les CHAT_SUGGESTIONS_K éléments les plus proches sont joints à la
+réponse, en quelques millisecondes et sans appel au LLM.
+
+Une demande simple de contenu ("un douaa contre la tristesse", "un verset sur
+la patience") dont la meilleure suggestion dépasse CHAT_DIRECT_ANSWER_MIN_SCORE
+reçoit directement ce contenu comme réponse, sans appel au LLM.
+
+Le premier index est construit au démarrage du serveur (`refresh(wait=True)`).
+Il suit ensuite la version du catalogue: quand le contenu change, il est
+reconstruit en arrière-plan (seuls les textes nouveaux ou modifiés sont
+recalculés) et l'ancienne version reste servie en attendant. Une requête ne
+construit jamais l'index: tant qu'il n'existe pas, elle n'a pas de suggestions.
+
+Embeddings des requêtes et constructions tournent sur le pool `embedding`,
+séparé du pool d'inférence du modèle d'émotion.
+"""
+import asyncio
+import logging
+import os
+import re
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+from ml.content_index import VectorIndex, load_embedder, CONTENT_INDEX_DIR
+from services.content_catalog import content_catalog, CatalogSnapshot
+from services.explanation_service import EMOTION_FRENCH
+from utils.executors import executors, ExecutorBusy
+from utils.metrics import stage_timer, register_collector, stats_collector
+from utils.text_utils import normalize_text
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CHAT_SUGGESTIONS_ENABLED = os.getenv("CHAT_SUGGESTIONS_ENABLED", "true").lower() == "true"
+CHAT_SUGGESTIONS_K = int(os.getenv("CHAT_SUGGESTIONS_K", "3"))
+CHAT_SUGGESTIONS_MIN_SCORE = float(os.getenv("CHAT_SUGGESTIONS_MIN_SCORE", "0.2"))
+CHAT_DIRECT_ANSWERS = os.getenv("CHAT_DIRECT_ANSWERS", "true").lower() == "true"
+CHAT_DIRECT_ANSWER_MIN_SCORE = float(os.getenv("CHAT_DIRECT_ANSWER_MIN_SCORE", "0.35"))
+CHAT_DIRECT_ANSWER_MAX_CHARS = int(os.getenv("CHAT_DIRECT_ANSWER_MAX_CHARS", "120"))
+
+TYPE_LABELS = {"douaa": "invocation douaa", "quran": "verset coran"}
+
+# Demandes explicites de contenu (message normalisé)
+_CONTENT_REQUEST = re.compile(r"\b(douaa?s?|doua|duaa?s?|invocations?|dhikr|adhkar|versets?|ayahs?|ayat|sourates?|coran)\b")
+_VERSE_REQUEST = re.compile(r"\b(versets?|ayahs?|ayat|sourates?|coran)\b")
+
+
+def _index_text(item: dict) -> str:
+    """Texte indexé: émotion (français et anglais), type et texte arabe."""
+    emotion = item["emotion"]
+    text = item.get("ayah_text") or item["text"]
+    return f"{EMOTION_FRENCH.get(emotion, emotion)} {emotion} {TYPE_LABELS.get(item['type'], '')} {text}"
+
+
+def _suggestion(catalog: CatalogSnapshot, content_id: str, score: float) -> dict:
+    item = catalog.items[content_id]
+    suggestion = {
+        "id": content_id,
+        "type": item["type"],
+        "emotion": item["emotion"],
+        "text": item["text"],
+        "score": round(score, 4),
+    }
+    if item["type"] == "quran":
+        suggestion.update(ayah_text=item.get("ayah_text"), ayah_reference=item.get("ayah_reference"))
+    return suggestion
+
+
+class ContentSuggestions:
+    def __init__(self, directory: str = CONTENT_INDEX_DIR):
+        self.directory = directory
+        self._index: Optional[VectorIndex] = None
+        self._lock = asyncio.Lock()
+        self._refresh: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.direct_answers = 0
+        self.unavailable = 0
+
+    def _update(self, texts: dict, version: str):
+        # Le modèle d'embedding est chargé au premier index (thread du pool `embedding`)
+        if self._index is None:
+            self._index = VectorIndex(self.directory, load_embedder())
+        self._index.update(texts, version)
+
+    async def _build(self, catalog: CatalogSnapshot):
+        texts = {content_id: _index_text(item) for content_id, item in catalog.items.items()}
+        await executors["embedding"].run(self._update, texts, catalog.version)
+
+    async def _background_build(self, catalog: CatalogSnapshot):
+        try:
+            await self._build(catalog)
+        except Exception as e:
+            logger.warning("Reconstruction de l'index de contenu impossible: %s", e)
+
+    @property
+    def ready(self) -> bool:
+        return self._index is not None and self._index.version is not None
+
+    async def refresh(self, wait: bool = False) -> CatalogSnapshot:
+        """
+        Catalogue courant; lance la reconstruction de l'index en arrière-plan
+        s'il n'est pas à jour. `wait` (démarrage du serveur) attend la construction.
+        """
+        catalog = await content_catalog.get()
+        if self.ready and self._index.version == catalog.version:
+            return catalog
+        if wait:
+            async with self._lock:
+                if not self.ready or self._index.version != catalog.version:
+                    await self._build(catalog)
+        elif self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.create_task(self._background_build(catalog))
+        return catalog
+
+    async def suggest(self, message: str, k: int = CHAT_SUGGESTIONS_K) -> List[dict]:
+        """Éléments du catalogue les plus proches du message (meilleur d'abord), [] si indisponible."""
+        if not CHAT_SUGGESTIONS_ENABLED or not message.strip():
+            return []
+        try:
+            with stage_timer("chat", "suggest"):
+                catalog = await self.refresh()
+                if not self.ready:
+                    # Premier index pas encore construit (échec au démarrage): il l'est en arrière-plan
+                    self.unavailable += 1
+                    return []
+                hits = await executors["embedding"].run(self._index.search, message, k)
+        except ExecutorBusy:
+            self.unavailable += 1
+            return []
+        except Exception as e:
+            logger.warning("Suggestions de contenu indisponibles: %s", e)
+            self.unavailable += 1
+            return []
+        # Index encore sur l'ancienne version: les éléments supprimés sont ignorés
+        return [
+            _suggestion(catalog, content_id, score)
+            for content_id, score in hits
+            if score >= CHAT_SUGGESTIONS_MIN_SCORE and content_id in catalog.items
+        ]
+
+    def direct_answer(self, message: str, suggestions: List[dict]) -> Optional[str]:
+        """Réponse tirée du catalogue pour une demande simple de contenu, ou None (appel au LLM)."""
+        if not CHAT_DIRECT_ANSWERS or not suggestions or len(message) > CHAT_DIRECT_ANSWER_MAX_CHARS:
+            return None
+        normalized = normalize_text(message)
+        if not _CONTENT_REQUEST.search(normalized):
+            return None
+        wanted = "quran" if _VERSE_REQUEST.search(normalized) else "douaa"
+        best = next((s for s in suggestions if s["type"] == wanted), None)
+        if best is None or best["score"] < CHAT_DIRECT_ANSWER_MIN_SCORE:
+            return None
+
+        self.direct_answers += 1
+        emotion_fr = EMOTION_FRENCH.get(best["emotion"], best["emotion"])
+        if wanted == "quran":
+            reference = f" [{best['ayah_reference']}]" if best.get("ayah_reference") else ""
+            return f"Voici un verset qui peut t'accompagner ({emotion_fr}) :\n\n{best['ayah_text'] or best['text']}{reference}"
+        return f"Voici une invocation qui peut t'accompagner ({emotion_fr}) :\n\n{best['text']}"
+
+    def stats(self) -> dict:
+        data = self._index.stats() if self._index is not None else {"entries": 0}
+        data.update(direct_answers=self.direct_answers, unavailable=self.unavailable)
+        return data
+
+
+content_suggestions = ContentSuggestions()
+register_collector(stats_collector(
+    "content_index", content_suggestions.stats,
+    counters=["builds", "loads", "embedded", "reused", "searches", "direct_answers", "unavailable"],
+))
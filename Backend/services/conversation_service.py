@@ -0,0 +1,260 @@
+"""
+Service de stockage des conversations DhikrAI côté serveur.
+
+Les conversations sont persistées dans MongoDB (collection `conversations`) avec
+un cache mémoire LRU pour les conversations actives. Le client n'envoie que le
+nouveau message et le `conversation_id`.
+
+Une conversation appartient à l'utilisateur authentifié qui l'a créée
+(`owner`, sujet du JWT): toute autre clé reçoit une 404. Un appelant anonyme
+n'a pas de conversation persistée: son contexte est reconstruit en mémoire à
+partir de l'`history` envoyé avec chaque requête.
+
+Chaque écriture incrémente `version` et est conditionnée à la version lue:
+une copie du cache devenue obsolète (tour traité par un autre worker) n'écrase
+jamais un résumé plus récent, et l'entrée du cache est alors abandonnée pour
+être relue au tour suivant.
+
+Le contexte envoyé au LLM respecte un budget de tokens:
+- les tours récents sont gardés tels quels (CHAT_RECENT_TOKENS)
+- les tours plus anciens sont repris dans une transcription tronquée (une ligne
+  de SUMMARY_LINE_CHARS caractères max par tour, les plus anciennes lignes
+  abandonnées au-delà de CHAT_SUMMARY_MAX_TOKENS), mise en cache dans la
+  conversation et prolongée incrémentalement. Ce n'est pas un résumé généré.
+- le prompt complet ne dépasse jamais CHAT_PROMPT_MAX_TOKENS
+"""
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from dotenv import load_dotenv
+
+from db.mongo import conversations_collection
+from schemas.chat_schema import Message
+from services.llm_service import SUMMARY_HEADER
+
+load_dotenv()
+
+CHAT_PROMPT_MAX_TOKENS = int(os.getenv("CHAT_PROMPT_MAX_TOKENS", "2000"))
+CHAT_RECENT_TOKENS = int(os.getenv("CHAT_RECENT_TOKENS", "1200"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "300"))
+CONVERSATION_CACHE_SIZE = int(os.getenv("CONVERSATION_CACHE_SIZE", "1000"))
+CONVERSATION_CACHE_TTL = float(os.getenv("CONVERSATION_CACHE_TTL_SECONDS", "600"))
+
+# Longueur max d'un tour dans le résumé (en caractères)
+SUMMARY_LINE_CHARS = 160
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimation rapide du nombre de tokens (~4 caractères par token)."""
+    return len(text) // 4 + 1 if text else 0
+
+
+def _summarize_turns(turns: List[dict]) -> List[str]:
+    """Une ligne de transcription par tour, coupée à SUMMARY_LINE_CHARS caractères."""
+    lines = []
+    for turn in turns:
+        who = "Utilisateur" if turn["role"] == "user" else "DhikrAI"
+        text = " ".join(turn["content"].split())
+        if len(text) > SUMMARY_LINE_CHARS:
+            text = text[:SUMMARY_LINE_CHARS].rstrip() + "…"
+        lines.append(f"- {who}: {text}")
+    return lines
+
+
+def _fit_summary(lines: List[str], max_tokens: int) -> str:
+    """Garde les lignes les plus récentes de la transcription qui tiennent dans le budget."""
+    kept = []
+    used = 0
+    for line in reversed(lines):
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(reversed(kept))
+
+
+class ConversationNotFound(Exception):
+    pass
+
+
+class ConversationStore:
+    """
+    Stockage des conversations: MongoDB + cache mémoire LRU avec TTL.
+
+    Une conversation en mémoire est un dict:
+        {"id": str, "owner": str, "version": int, "turns": [{"role", "content"}], "summary": str, "summarized": int}
+    où `summarized` est le nombre de tours déjà repris dans `summary`.
+    `get`/`create` retournent une copie de travail: le cache n'est mis à jour
+    qu'une fois l'écriture réussie dans `append`. Une conversation anonyme a
+    `id` None et n'est jamais persistée.
+    """
+
+    def __init__(self, max_size: int = CONVERSATION_CACHE_SIZE, ttl: float = CONVERSATION_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._cache: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+
+    @staticmethod
+    def _copy(conversation: dict) -> dict:
+        return dict(conversation, turns=list(conversation["turns"]))
+
+    def _remember(self, conversation: dict):
+        self._cache[conversation["id"]] = (time.monotonic(), conversation)
+        self._cache.move_to_end(conversation["id"])
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    async def create(self, history: Optional[List[Message]] = None, owner: Optional[str] = None) -> dict:
+        turns = [{"role": m.role, "content": m.content} for m in (history or [])]
+        now = datetime.utcnow()
+        result = await conversations_collection.insert_one({
+            "owner": owner,
+            "version": 0,
+            "turns": turns,
+            "summary": "",
+            "summarized": 0,
+            "created_at": now,
+            "updated_at": now,
+        })
+        conversation = {
+            "id": str(result.inserted_id), "owner": owner, "version": 0, "turns": turns, "summary": "", "summarized": 0,
+        }
+        self._remember(conversation)
+        return self._copy(conversation)
+
+    @staticmethod
+    def transient(history: Optional[List[Message]] = None) -> dict:
+        """Conversation anonyme construite depuis `history`, sans accès à la base."""
+        turns = [{"role": m.role, "content": m.content} for m in (history or [])]
+        return {"id": None, "owner": None, "version": 0, "turns": turns, "summary": "", "summarized": 0}
+
+    async def get(self, conversation_id: str, owner: str) -> dict:
+        """Conversation de `owner`; ConversationNotFound si elle n'existe pas ou appartient à un autre."""
+        try:
+            object_id = ObjectId(conversation_id)
+        except InvalidId:
+            raise ConversationNotFound(conversation_id)
+
+        cached = self._cache.get(conversation_id)
+        if cached and time.monotonic() - cached[0] < self.ttl and cached[1]["owner"] == owner:
+            # Pas de relecture: une copie obsolète est détectée par l'écriture conditionnelle
+            self._cache.move_to_end(conversation_id)
+            return self._copy(cached[1])
+
+        doc = await conversations_collection.find_one({"_id": object_id})
+        if doc is None or doc.get("owner") is None or doc["owner"] != owner:
+            self._cache.pop(conversation_id, None)
+            raise ConversationNotFound(conversation_id)
+
+        conversation = {
+            "id": conversation_id,
+            "owner": owner,
+            "version": doc.get("version", 0),
+            "turns": doc.get("turns", []),
+            "summary": doc.get("summary", ""),
+            "summarized": doc.get("summarized", 0),
+        }
+        self._remember(conversation)
+        return self._copy(conversation)
+
+    async def get_or_create(
+        self, conversation_id: Optional[str], history: Optional[List[Message]] = None, owner: Optional[str] = None
+    ) -> dict:
+        """
+        Reprend la conversation de `owner` ou en crée une nouvelle. Un appelant
+        anonyme (owner None) reçoit une conversation transitoire bâtie sur `history`.
+        """
+        if owner is None:
+            return self.transient(history)
+        if conversation_id:
+            return await self.get(conversation_id, owner)
+        return await self.create(history, owner)
+
+    def build_context(self, conversation: dict, user_message: str, system_prompt: str) -> Tuple[Optional[str], List[Message]]:
+        """
+        Sélectionne le contexte à envoyer au LLM pour `user_message`.
+
+        Les tours sortis de la fenêtre récente sont ajoutés à la transcription
+        tronquée de `conversation` (une seule fois par tour). Retourne
+        (transcription ou None, tours récents).
+        """
+        turns = conversation["turns"]
+        start = conversation["summarized"]
+
+        # Fenêtre récente: on remonte depuis la fin tant que le budget le permet
+        budget = min(
+            CHAT_RECENT_TOKENS,
+            CHAT_PROMPT_MAX_TOKENS - estimate_tokens(system_prompt) - estimate_tokens(user_message),
+        )
+        keep_from = len(turns)
+        used = 0
+        while keep_from > start:
+            cost = estimate_tokens(turns[keep_from - 1]["content"])
+            if used + cost > budget:
+                break
+            used += cost
+            keep_from -= 1
+
+        # Reprendre les tours sortis de la fenêtre dans la transcription tronquée
+        if keep_from > start:
+            lines = conversation["summary"].splitlines() if conversation["summary"] else []
+            lines.extend(_summarize_turns(turns[start:keep_from]))
+            conversation["summary"] = _fit_summary(lines, CHAT_SUMMARY_MAX_TOKENS)
+            conversation["summarized"] = keep_from
+
+        # Plafond dur: le résumé est tronqué s'il ne tient plus
+        summary = conversation["summary"]
+        remaining = CHAT_PROMPT_MAX_TOKENS - estimate_tokens(system_prompt) - estimate_tokens(user_message) - used
+        if summary and estimate_tokens(summary) + estimate_tokens(SUMMARY_HEADER) > remaining:
+            summary = _fit_summary(summary.splitlines(), max(0, remaining - estimate_tokens(SUMMARY_HEADER)))
+
+        recent = [Message(role=t["role"], content=t["content"]) for t in turns[keep_from:]]
+        return (summary or None), recent
+
+    async def append(self, conversation: dict, user_message: str, assistant_response: str):
+        """Ajoute un échange à la conversation et persiste le résumé à jour (rien pour une conversation anonyme)."""
+        if conversation["id"] is None:
+            return
+        new_turns = [
+            {"role": "user", "content": user_message},
+            {"role": "assistant", "content": assistant_response},
+        ]
+        object_id = ObjectId(conversation["id"])
+        result = await conversations_collection.update_one(
+            {"_id": object_id, "version": conversation["version"]},
+            {
+                "$push": {"turns": {"$each": new_turns}},
+                "$set": {
+                    "summary": conversation["summary"],
+                    "summarized": conversation["summarized"],
+                    "updated_at": datetime.utcnow(),
+                },
+                "$inc": {"version": 1},
+            },
+        )
+        if result.matched_count:
+            conversation["turns"].extend(new_turns)
+            conversation["version"] += 1
+            self._remember(conversation)
+            return
+
+        # Un autre worker a écrit entre-temps: les tours sont ajoutés à la suite des
+        # siens sans toucher au résumé (recalculé au prochain tour depuis la base)
+        self._cache.pop(conversation["id"], None)
+        await conversations_collection.update_one(
+            {"_id": object_id},
+            {
+                "$push": {"turns": {"$each": new_turns}},
+                "$set": {"updated_at": datetime.utcnow()},
+                "$inc": {"version": 1},
+            },
+        )
+
+
+conversation_store = ConversationStore()
@@ -1,7 +1,8 @@
 import random
-from db.mongo import db
+import logging
+from services.content_catalog import content_catalog
 
-emotion_content_collection = db["emotion_content"]
+logger = logging.getLogger(__name__)
 
 # Mapping des émotions du modèle ML vers les émotions dans la base de données
 # Toutes les clés sont en minuscules pour normaliser la casse
@@ -18,12 +19,11 @@ EMOTION_MAPPING = {
     # ou mapper vers neutral
 }
 
-# Cache pour les émotions disponibles afin d'éviter des appels DB répétitifs
-_AVAILABLE_EMOTIONS_CACHE = None
-
 async def get_emotion_content(emotion: str):
     """
     Récupère un douaa et un ayah aléatoires basés sur l'émotion détectée.
+    Le contenu vient du catalogue en mémoire (services/content_catalog.py),
+    sans requête MongoDB par prédiction.
     
     Args:
         emotion: L'émotion détectée par le modèle ML (ex: "happy", "sad", etc.)
@@ -32,67 +32,61 @@ async def get_emotion_content(emotion: str):
         dict: Un dictionnaire contenant:
             - douaa: Un douaa aléatoire pour cette émotion
             - ayah: Un verset coranique aléatoire pour cette émotion
+            - douaa_id / ayah_id: Identifiants du contenu choisi (voir GET /emotion/content)
+            - content_version: Version du catalogue
             - emotion: L'émotion mappée utilisée
     """
-    global _AVAILABLE_EMOTIONS_CACHE
-    
     # Normaliser l'émotion en minuscules pour éviter les problèmes de casse
     emotion_lower = emotion.lower().strip() if emotion else "neutral"
     
     # Mapper l'émotion du modèle vers l'émotion dans la base de données
     mapped_emotion = EMOTION_MAPPING.get(emotion_lower, "neutral")
     
-    print(f"[DEBUG] Emotion originale='{emotion}' -> normalisee='{emotion_lower}' -> mappee='{mapped_emotion}'")
+    logger.debug("Emotion originale='%s' -> normalisee='%s' -> mappee='%s'", emotion, emotion_lower, mapped_emotion)
     
     try:
-        # Récupérer les émotions disponibles une seule fois (ou périodiquement)
-        if _AVAILABLE_EMOTIONS_CACHE is None:
-            _AVAILABLE_EMOTIONS_CACHE = await emotion_content_collection.distinct("emotion")
-            print(f"[DEBUG] Emotions disponibles dans la BD (Mise en cache): {_AVAILABLE_EMOTIONS_CACHE}")
-            
-            if not _AVAILABLE_EMOTIONS_CACHE:
-                print(f"[WARN] Avertissement: La collection 'emotion_content' semble vide ou sans émotions.")
+        catalog = await content_catalog.get()
+        if not catalog.items:
+            logger.warning("La collection 'emotion_content' semble vide ou sans émotions.")
         
         # S'assurer que mapped_emotion est en minuscules pour la recherche
         search_emotion = mapped_emotion.lower()
         
-        # Récupérer un douaa aléatoire
-        douaa_doc = await emotion_content_collection.find_one(
-            {"emotion": search_emotion, "type": "douaa"}
-        )
-        
-        # Récupérer un verset coranique aléatoire
-        ayah_doc = await emotion_content_collection.find_one(
-            {"emotion": search_emotion, "type": "quran"}
-        )
-        
         douaa = None
         ayah = None
+        douaa_id = None
+        ayah_id = None
         
-        if douaa_doc and "content" in douaa_doc and len(douaa_doc["content"]) > 0:
+        douaa_ids = catalog.ids_for(search_emotion, "douaa")
+        if douaa_ids:
             # Sélectionner un douaa aléatoire
-            douaa = random.choice(douaa_doc["content"])
-            print(f"[OK] Douaa trouve pour '{mapped_emotion}'")
+            douaa_id = random.choice(douaa_ids)
+            douaa = catalog.items[douaa_id]["text"]
+            logger.debug("Douaa trouve pour '%s'", mapped_emotion)
         else:
-            print(f"[WARN] Aucun douaa trouve pour l'emotion: '{mapped_emotion}' (doc trouve: {douaa_doc is not None})")
+            logger.warning("Aucun douaa trouve pour l'emotion: '%s'", mapped_emotion)
         
-        if ayah_doc and "content" in ayah_doc and len(ayah_doc["content"]) > 0:
+        ayah_ids = catalog.ids_for(search_emotion, "quran")
+        if ayah_ids:
             # Sélectionner un verset coranique aléatoire
-            ayah = random.choice(ayah_doc["content"])
-            print(f"[OK] Ayah trouve pour '{mapped_emotion}'")
+            ayah_id = random.choice(ayah_ids)
+            ayah = catalog.items[ayah_id]["text"]
+            logger.debug("Ayah trouve pour '%s'", mapped_emotion)
         else:
-            print(f"[WARN] Aucun ayah trouve pour l'emotion: '{mapped_emotion}' (doc trouve: {ayah_doc is not None})")
+            logger.warning("Aucun ayah trouve pour l'emotion: '%s'", mapped_emotion)
         
         return {
             "douaa": douaa,
             "ayah": ayah,
+            # Identifiants "<_id du document>:<index>" du contenu choisi
+            "douaa_id": douaa_id,
+            "ayah_id": ayah_id,
+            "content_version": catalog.version,
             "emotion": mapped_emotion,
             "original_emotion": emotion
         }
     except Exception as e:
-        print(f"❌ Erreur lors de la récupération du contenu: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Erreur lors de la récupération du contenu: %s", e)
         return {
             "douaa": None,
             "ayah": None,
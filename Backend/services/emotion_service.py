@@ -1,29 +1,130 @@
 from PIL import Image
 import io
-from ml.emotion_model import predict_emotion
+from ml.emotion_model import predict_emotion, predict_faces, model_registry
 from services.emotion_content_service import get_emotion_content
-from services.explanation_service import generate_explanation, get_fallback_explanation
+from services.explanation_service import (
+    generate_explanation, get_fallback_explanation, explanation_cache_key, ENABLE_LLM, EXPLANATION_FALLBACKS,
+    EXPLANATION_PROMPT_VERSION,
+)
+from services.admission_control import llm_admission, AdmissionRejected
+from services.history_service import history_writer, build_event
 from utils.text_utils import parse_ayah
+from utils.metrics import stage_timer, counter, current_stages, cache_collector, register_collector
+from utils.deadline import Deadline, DurationEstimate, REQUEST_BUDGET_MAX_MS
+from utils.executors import executors, ExecutorBusy
+from utils.cache import TieredCache
 
 import anyio
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Optional
 
-async def analyze_emotion(file_bytes: bytes):
+logger = logging.getLogger(__name__)
+
+EXPLANATION_SOURCES = counter("explanation_source_total", "Explanations returned by /emotion/predict, by source", ["source"])
+
+# Initial guess of the LLM explanation duration, refined from observed calls
+EXPLAIN_ESTIMATE_SECONDS = float(os.getenv("EXPLAIN_ESTIMATE_SECONDS", "3"))
+explain_estimate = DurationEstimate(EXPLAIN_ESTIMATE_SECONDS)
+
+# Shared between workers (utils/cache.py); 0 disables a cache
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL_SECONDS", "3600"))
+EXPLANATION_CACHE_TTL = float(os.getenv("EXPLANATION_CACHE_TTL_SECONDS", "86400"))
+
+# Same image bytes -> same model output; keys include the active model version
+prediction_cache = TieredCache("prediction", PREDICTION_CACHE_TTL)
+register_collector(cache_collector("prediction", prediction_cache.stats))
+# LLM explanations only (static fallbacks are never stored)
+explanation_cache = TieredCache("explanation", EXPLANATION_CACHE_TTL, version=EXPLANATION_PROMPT_VERSION)
+register_collector(cache_collector("explanation", explanation_cache.stats))
+
+
+def _explain_shed_reason(deadline: Optional[Deadline]) -> Optional[str]:
+    """
+    Why the LLM explanation should be skipped for this request, or None.
+    "budget": the remaining budget is below the expected LLM duration.
+    "queue": it would also have to wait behind the queued LLM calls.
+    """
+    if deadline is None:
+        return None
+    remaining = deadline.remaining()
+    estimate = explain_estimate.value
+    if remaining < estimate:
+        return "budget"
+    if llm_admission.active >= llm_admission.max_concurrency:
+        # Every slot is busy: our turn comes after the queue drains
+        expected_wait = (llm_admission.queue_depth() + 1) / llm_admission.max_concurrency * estimate
+        if remaining < estimate + expected_wait:
+            return "queue"
+    return None
+
+
+async def _predict(file_bytes: bytes, multi_face: bool) -> dict:
+    # Convert bytes to PIL Image
+    with stage_timer("predict", "decode"):
+        image = Image.open(io.BytesIO(file_bytes)).convert("RGB")
+    # Get prediction from ML model - Offload to the inference pool
+    # (detect, preprocess and inference stages are timed inside the model module)
+    return await executors["inference"].run(predict_faces if multi_face else predict_emotion, image)
+
+
+async def _explain(emotion, douaa, confidence, client_key) -> dict:
+    """
+    LLM explanation, shared by the concurrent requests asking for the same cache key.
+    It does not use any request's deadline (each caller only bounds its own wait on
+    the shared result, cached for the next ones) but has its own, REQUEST_BUDGET_MAX_MS:
+    the io thread and the admission slot it holds are released by then at the latest.
+    """
+    deadline = Deadline(REQUEST_BUDGET_MAX_MS / 1000)
+    await llm_admission.acquire(client_key, "explanation")
+    try:
+        with stage_timer("predict", "explain"):
+            started = time.monotonic()
+            # Offload to the blocking I/O pool (HTTP call and retry sleeps)
+            future = executors["io"].submit(generate_explanation, emotion, douaa, confidence, deadline)
+            llm_admission.release_when_done(future)
+            explanation, source = await asyncio.wrap_future(future)
+            if source == "llm":
+                explain_estimate.observe(time.monotonic() - started)
+    except ExecutorBusy:
+        llm_admission.release()
+        raise
+    return {"explanation": explanation, "source": source}
+
+
+async def analyze_emotion(
+    file_bytes: bytes,
+    client_key: Optional[str] = None,
+    user_id: Optional[str] = None,
+    deadline: Optional[Deadline] = None,
+    multi_face: bool = False,
+):
     """
     Process image bytes and return emotion prediction with personalized douaa, ayah, and AI explanation.
     Returns restructured format with ayah_text, ayah_reference, and explanation_fr.
+    `client_key` identifies the caller for the shared LLM admission control.
+    When `user_id` is given, the prediction is added to the user's emotion history (write-behind).
+    With a `deadline`, optional stages (the LLM explanation) are shed when they cannot finish
+    within the remaining budget; they are listed in `shed_stages`.
+    With `multi_face`, every detected face is classified (one batched forward pass) and
+    listed in `faces`; the dominant emotion selects the content.
+    Model outputs (by image hash) and LLM explanations (by emotion, douaa and
+    confidence bucket) are cached across workers; concurrent identical requests
+    share one computation.
     """
     try:
-        # Convert bytes to PIL Image
-        # This is fast, but we could also offload if needed
-        image = Image.open(io.BytesIO(file_bytes)).convert("RGB")
-        
-        # Get prediction from ML model - Offload to thread
-        emotion_result = await anyio.to_thread.run_sync(predict_emotion, image)
+        image_hash = hashlib.sha256(file_bytes).hexdigest()
+        image_key = f"{model_registry.active_version}:{image_hash}" + (":faces" if multi_face else "")
+        emotion_result = await prediction_cache.get_or_compute(image_key, lambda: _predict(file_bytes, multi_face))
         
         # Récupérer le douaa et l'ayah basés sur l'émotion détectée
         emotion = emotion_result.get("emotion", "neutral")
         confidence = emotion_result.get("confidence")
-        content = await get_emotion_content(emotion)
+        with stage_timer("predict", "content"):
+            content = await get_emotion_content(emotion)
         
         # Parse ayah into text and reference
         ayah_full = content.get("ayah")
@@ -32,36 +133,87 @@ async def analyze_emotion(file_bytes: bytes):
         # Generate contextual explanation with LLM (based on specific Douaa)
         explanation_fr = None
         explanation_source = "static"
+        shed_stages = []
         douaa = content.get("douaa")
-        if douaa:
+        explanation_key = explanation_cache_key(emotion, douaa, confidence)
+        cached = await explanation_cache.get(explanation_key) if douaa and ENABLE_LLM else None
+        shed_reason = _explain_shed_reason(deadline) if douaa and ENABLE_LLM and not cached else None
+        if cached:
+            explanation_fr, explanation_source = cached["explanation"], cached["source"]
+        elif shed_reason:
+            logger.info("Explication LLM ignoree (%s), fallback statique", shed_reason)
+            EXPLANATION_FALLBACKS.inc(reason=f"shed_{shed_reason}")
+            explanation_fr = get_fallback_explanation(emotion, confidence)
+            shed_stages.append("explain")
+        elif douaa and not ENABLE_LLM:
+            # LLM disabled: no need to go through admission control
+            explanation_fr, explanation_source = generate_explanation(emotion, douaa, confidence)
+        elif douaa:
             try:
                 # Generate contextual explanation using the specific Douaa
-                # Offload to thread since it involves LLM inference
-                explanation_fr, explanation_source = await anyio.to_thread.run_sync(
-                    generate_explanation, emotion, douaa, confidence
-                )
+                with anyio.fail_after(deadline.remaining() if deadline else None):
+                    explained = await explanation_cache.get_or_compute(
+                        explanation_key,
+                        lambda: _explain(emotion, douaa, confidence, client_key),
+                        cacheable=lambda value: value["source"] == "llm",
+                        lookup=False,
+                    )
+                explanation_fr, explanation_source = explained["explanation"], explained["source"]
+            except TimeoutError:
+                # Budget exhausted while queued or during the call: the shared call
+                # finishes on its own (and keeps its LLM slot), its result is cached
+                logger.warning("Explication LLM hors budget, fallback statique")
+                EXPLANATION_FALLBACKS.inc(reason="deadline")
+                explanation_fr = get_fallback_explanation(emotion, confidence)
+                explanation_source = "static"
+                shed_stages.append("explain")
+            except ExecutorBusy:
+                logger.warning("Pool d'E/S bloquantes sature, fallback statique")
+                EXPLANATION_FALLBACKS.inc(reason="executor_busy")
+                explanation_fr = get_fallback_explanation(emotion, confidence)
+                explanation_source = "static"
+            except AdmissionRejected as e:
+                logger.warning("Explication LLM refusee par le controle d'admission (%s), fallback statique", e.reason)
+                EXPLANATION_FALLBACKS.inc(reason=f"admission_{e.reason}")
+                explanation_fr = get_fallback_explanation(emotion, confidence)
+                explanation_source = "static"
             except Exception as e:
-                print(f"[WARN] Erreur lors de la generation de l'explication LLM dans emotion_service: {e}")
+                logger.warning("Erreur lors de la generation de l'explication LLM dans emotion_service: %s", e)
+                EXPLANATION_FALLBACKS.inc(reason="explain_error")
                 # Fallback to dynamic explanation with confidence
                 explanation_fr = get_fallback_explanation(emotion, confidence)
                 explanation_source = "static"
         else:
             # No douaa, use dynamic fallback with confidence
+            EXPLANATION_FALLBACKS.inc(reason="no_douaa")
             explanation_fr = get_fallback_explanation(emotion, confidence)
             explanation_source = "static"
+        EXPLANATION_SOURCES.inc(source=explanation_source)
         
         # Combiner les résultats avec le nouveau format
         result = {
             "emotion": emotion_result.get("emotion"),
             "confidence": emotion_result.get("confidence"),
+            "model_version": emotion_result.get("model_version"),
             "douaa": douaa,
             "ayah_text": ayah_parsed["text"],
             "ayah_reference": ayah_parsed["reference"],
             "explanation_fr": explanation_fr,
-            "explanation_source": explanation_source
+            "explanation_source": explanation_source,
+            # Références au catalogue GET /emotion/content
+            "douaa_id": content.get("douaa_id"),
+            "ayah_id": content.get("ayah_id"),
+            "content_version": content.get("content_version"),
+            "shed_stages": shed_stages,
         }
+        if multi_face:
+            result["faces"] = emotion_result["faces"]
+
+        if user_id:
+            # Buffered: written later in batches by the history writer
+            history_writer.record(build_event(user_id, result, content, current_stages()))
         
         return result
     except Exception as e:
-        print(f"Error in analyze_emotion: {e}")
+        logger.error("Error in analyze_emotion: %s", e)
         raise e
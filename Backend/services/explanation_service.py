@@ -5,23 +5,35 @@ Les textes sacrés viennent UNIQUEMENT de MongoDB.
 Le LLM génère UNIQUEMENT une explication courte (2-3 phrases) expliquant pourquoi le douaa aide émotionnellement.
 Rôle du LLM: Accompagnateur émotionnel, PAS autorité religieuse.
 """
+import hashlib
 import os
 import re
+import logging
 from typing import Optional
 
 import requests
 from dotenv import load_dotenv
 
+from utils.deadline import Deadline
+from utils.metrics import counter
+
 # Charger les variables d'environnement depuis .env
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Raisons pour lesquelles le fallback statique remplace l'explication LLM
+EXPLANATION_FALLBACKS = counter(
+    "explanation_fallback_total", "Explanations served from the static fallback, by reason", ["reason"]
+)
+
 # Configuration API Hugging Face (gratuite mais limitée)
 ENABLE_LLM = os.getenv("ENABLE_LLM_EXPLANATION", "true").lower() == "true"
 
 # OpenRouter Configuration (RECOMMENDED)
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "").strip()
 OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "mistralai/mistral-7b-instruct:free")
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
 
 # Hugging Face Configuration (fallback)
 HF_MODEL_NAME = os.getenv("HF_MODEL_NAME", "mistralai/Mistral-7B-Instruct-v0.1")
@@ -30,17 +42,21 @@ HF_API_URL = os.getenv("HF_API_URL", f"https://api-inference.huggingface.co/mode
 HF_TOKEN = os.getenv("HF_TOKEN", "").strip()
 HF_TIMEOUT = float(os.getenv("HF_TIMEOUT_SECONDS", "25"))
 
+# Cache des explications: une entrée par tranche de confiance (en points de pourcentage).
+# 5 garde le même ton dans une tranche (seuils à 55 et 80 %).
+EXPLANATION_CACHE_CONFIDENCE_STEP = float(os.getenv("EXPLANATION_CACHE_CONFIDENCE_STEP", "5"))
+
 # Log de configuration au chargement du module
-print(f"[EXPLANATION_SERVICE] Configuration LLM:")
-print(f"  - ENABLE_LLM: {ENABLE_LLM}")
 if OPENROUTER_API_KEY:
-    print(f"  - Provider: OpenRouter ✓")
-    print(f"  - Model: {OPENROUTER_MODEL}")
+    logger.info(
+        "Configuration LLM: ENABLE_LLM=%s, provider=OpenRouter, model=%s, timeout=%ss",
+        ENABLE_LLM, OPENROUTER_MODEL, HF_TIMEOUT,
+    )
 else:
-    print(f"  - Provider: Hugging Face")
-    print(f"  - HF_MODEL_NAME: {HF_MODEL_NAME}")
-    print(f"  - HF_TOKEN: {'✓ Configuré' if HF_TOKEN else '✗ Non configuré'}")
-print(f"  - HF_TIMEOUT: {HF_TIMEOUT}s")
+    logger.info(
+        "Configuration LLM: ENABLE_LLM=%s, provider=Hugging Face, model=%s, HF_TOKEN=%s, timeout=%ss",
+        ENABLE_LLM, HF_MODEL_NAME, "configuré" if HF_TOKEN else "non configuré", HF_TIMEOUT,
+    )
 
 # Explications pré-définies en français comme fallback (améliorées pour plus de profondeur spirituelle)
 FRENCH_EXPLANATIONS = {
@@ -105,13 +121,43 @@ Instructions:
 Explication:"""
 
 
-def _call_hf_api(prompt: str, retry_on_503: bool = True) -> str:
+# Version des clés du cache d'explications: change avec le modèle ou le prompt
+EXPLANATION_PROMPT_VERSION = hashlib.sha1(
+    f"{OPENROUTER_MODEL if OPENROUTER_API_KEY else HF_MODEL_NAME}|{_build_prompt('neutral', 0.5, '')}".encode("utf-8")
+).hexdigest()[:12]
+
+
+def explanation_cache_key(emotion: str, douaa: Optional[str], confidence: Optional[float]) -> str:
+    """Clé de cache: émotion, hash du texte du douaa et tranche de confiance."""
+    conf_pct = _confidence_percent(confidence)
+    bucket = "na" if conf_pct is None else int(conf_pct // EXPLANATION_CACHE_CONFIDENCE_STEP * EXPLANATION_CACHE_CONFIDENCE_STEP)
+    douaa_hash = hashlib.sha1((douaa or "").encode("utf-8")).hexdigest()[:16]
+    return f"{emotion.lower()}:{douaa_hash}:{bucket}"
+
+
+def _attempt_timeout(deadline: Optional[Deadline]) -> float:
+    """Timeout HTTP d'une tentative: HF_TIMEOUT, réduit au budget restant de la requête."""
+    if deadline is None:
+        return HF_TIMEOUT
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise RuntimeError("Timeout: budget de la requête épuisé")
+    return min(HF_TIMEOUT, remaining)
+
+
+def _can_retry(deadline: Optional[Deadline], wait: float) -> bool:
+    """Un réessai n'a de sens que s'il reste du budget après l'attente."""
+    return deadline is None or deadline.remaining() > wait + 1
+
+
+def _call_hf_api(prompt: str, retry_on_503: bool = True, deadline: Optional[Deadline] = None) -> str:
     """
     Appelle l'API OpenRouter ou Hugging Face pour générer du texte.
     
     Args:
         prompt: Le prompt à envoyer au modèle
         retry_on_503: Si True, attendre et réessayer si le modèle est en cours de chargement (503)
+        deadline: Budget de la requête: borne les timeouts et les attentes avant réessai
     
     Returns:
         str: Le texte généré par le modèle
@@ -120,13 +166,13 @@ def _call_hf_api(prompt: str, retry_on_503: bool = True) -> str:
     
     # Try OpenRouter first if configured
     if OPENROUTER_API_KEY:
-        return _call_openrouter_api(prompt, retry_on_503)
+        return _call_openrouter_api(prompt, retry_on_503, deadline)
     
     # Fallback to Hugging Face
-    return _call_hf_api_direct(prompt, retry_on_503)
+    return _call_hf_api_direct(prompt, retry_on_503, deadline)
 
 
-def _call_openrouter_api(prompt: str, retry_on_503: bool = True) -> str:
+def _call_openrouter_api(prompt: str, retry_on_503: bool = True, deadline: Optional[Deadline] = None) -> str:
     """Appelle l'API OpenRouter."""
     import time
     
@@ -148,17 +194,18 @@ def _call_openrouter_api(prompt: str, retry_on_503: bool = True) -> str:
     
     for attempt in range(max_retries + 1):
         try:
-            print(f"[DEBUG] Appel OpenRouter API (tentative {attempt + 1}/{max_retries + 1})...")
+            logger.debug("Appel OpenRouter API (tentative %d/%d)...", attempt + 1, max_retries + 1)
+            timeout = _attempt_timeout(deadline)
             resp = requests.post(
                 OPENROUTER_API_URL,
                 headers=headers,
                 json=payload,
-                timeout=HF_TIMEOUT,
+                timeout=timeout,
             )
             
             if resp.status_code == 503:
-                if retry_on_503 and attempt < max_retries:
-                    print(f"[INFO] Service indisponible. Attente de {retry_delay}s...")
+                if retry_on_503 and attempt < max_retries and _can_retry(deadline, retry_delay):
+                    logger.info("Service indisponible. Attente de %ss...", retry_delay)
                     time.sleep(retry_delay)
                     continue
                 else:
@@ -172,7 +219,7 @@ def _call_openrouter_api(prompt: str, retry_on_503: bool = True) -> str:
             break
             
         except requests.exceptions.Timeout:
-            raise RuntimeError(f"Timeout OpenRouter (>{HF_TIMEOUT}s)")
+            raise RuntimeError(f"Timeout OpenRouter (>{timeout:.1f}s)")
         except requests.exceptions.RequestException as e:
             raise RuntimeError(f"Erreur réseau OpenRouter: {str(e)}")
     
@@ -189,7 +236,7 @@ def _call_openrouter_api(prompt: str, retry_on_503: bool = True) -> str:
     return text
 
 
-def _call_hf_api_direct(prompt: str, retry_on_503: bool = True) -> str:
+def _call_hf_api_direct(prompt: str, retry_on_503: bool = True, deadline: Optional[Deadline] = None) -> str:
     """Appelle l'API Hugging Face directement."""
     import time
     
@@ -208,12 +255,13 @@ def _call_hf_api_direct(prompt: str, retry_on_503: bool = True) -> str:
     
     for attempt in range(max_retries + 1):
         try:
-            print(f"[DEBUG] Appel API Hugging Face (tentative {attempt + 1}/{max_retries + 1})...")
+            logger.debug("Appel API Hugging Face (tentative %d/%d)...", attempt + 1, max_retries + 1)
+            timeout = _attempt_timeout(deadline)
             resp = requests.post(
                 HF_API_URL,
                 headers=headers,
                 json=payload,
-                timeout=HF_TIMEOUT,
+                timeout=timeout,
             )
             
             # Gérer les erreurs spécifiques de l'API Hugging Face
@@ -227,9 +275,9 @@ def _call_hf_api_direct(prompt: str, retry_on_503: bool = True) -> str:
                     error_msg = "Model is loading"
                     estimated_time = None
                 
-                if retry_on_503 and attempt < max_retries:
-                    wait_time = estimated_time if estimated_time else retry_delay
-                    print(f"[INFO] Modèle en cours de chargement. Attente de {wait_time}s avant réessai...")
+                wait_time = estimated_time if estimated_time else retry_delay
+                if retry_on_503 and attempt < max_retries and _can_retry(deadline, wait_time):
+                    logger.info("Modèle en cours de chargement. Attente de %ss avant réessai...", wait_time)
                     time.sleep(wait_time)
                     continue
                 else:
@@ -248,7 +296,7 @@ def _call_hf_api_direct(prompt: str, retry_on_503: bool = True) -> str:
             break
             
         except requests.exceptions.Timeout:
-            raise RuntimeError(f"Timeout lors de l'appel à l'API Hugging Face (>{HF_TIMEOUT}s)")
+            raise RuntimeError(f"Timeout lors de l'appel à l'API Hugging Face (>{timeout:.1f}s)")
         except requests.exceptions.RequestException as e:
             raise RuntimeError(f"Erreur réseau lors de l'appel à l'API Hugging Face: {str(e)}")
 
@@ -381,7 +429,9 @@ def get_fallback_explanation(emotion: str, confidence: Optional[float] = None) -
     return _dynamic_fallback(emotion, confidence)
 
 
-def generate_explanation(emotion: str, douaa: str, confidence: Optional[float] = None) -> tuple[str, str]:
+def generate_explanation(
+    emotion: str, douaa: str, confidence: Optional[float] = None, deadline: Optional[Deadline] = None
+) -> tuple[str, str]:
     """
     Génère une explication courte en français expliquant pourquoi le Douaa aide avec l'émotion.
     
@@ -395,56 +445,66 @@ def generate_explanation(emotion: str, douaa: str, confidence: Optional[float] =
         emotion: L'émotion détectée (ex: "happy", "sad", "angry")
         douaa: Le douaa sélectionné depuis la base de données (pour contexte uniquement)
         confidence: Score de confiance du modèle d'émotion (0-100 ou 0-1)
+        deadline: Budget de l'appel (timeouts et réessais raccourcis en conséquence)
     
     Returns:
         tuple[str, str]: (explication en français, source) où source est "llm" ou "static"
     """
     if not ENABLE_LLM:
-        print(f"[INFO] LLM désactivé (ENABLE_LLM_EXPLANATION=false). Utilisation du fallback statique.")
+        logger.debug("LLM désactivé (ENABLE_LLM_EXPLANATION=false). Utilisation du fallback statique.")
+        EXPLANATION_FALLBACKS.inc(reason="llm_disabled")
         explanation = _dynamic_fallback(emotion, confidence)
         return explanation, "static"
 
-    print(f"[INFO] Tentative de génération LLM pour émotion: {emotion}, confiance: {confidence}")
+    logger.debug("Tentative de génération LLM pour émotion: %s, confiance: %s", emotion, confidence)
     
     try:
         prompt = _build_prompt(emotion, confidence, douaa)
-        print(f"[DEBUG] Prompt construit: {prompt[:100]}...")
+        logger.debug("Prompt construit: %.100s...", prompt)
         
-        raw_text = _call_hf_api(prompt)
-        print(f"[DEBUG] Réponse brute LLM: '{raw_text[:150]}...'")
+        raw_text = _call_hf_api(prompt, deadline=deadline)
+        logger.debug("Réponse brute LLM: '%.150s...'", raw_text)
         
         explanation = _normalize_text(raw_text)
-        print(f"[DEBUG] Explication normalisée: '{explanation[:150]}...'")
+        logger.debug("Explication normalisée: '%.150s...'", explanation)
 
         is_invalid, reasons = _is_invalid(explanation)
         if is_invalid:
-            print(f"[WARN] Réponse LLM rejetée ({', '.join(reasons)}). Utilisation du fallback dynamique.")
-            print(f"   Réponse LLM complète: '{explanation}'")
+            logger.warning("Réponse LLM rejetée (%s). Utilisation du fallback dynamique.", ", ".join(reasons))
+            logger.debug("Réponse LLM complète: '%s'", explanation)
+            for reason in reasons:
+                EXPLANATION_FALLBACKS.inc(reason=reason)
             explanation = _dynamic_fallback(emotion, confidence)
             return explanation, "static"
 
-        print(f"[OK] Explication LLM générée avec succès: '{explanation[:80]}...'")
+        logger.debug("Explication LLM générée avec succès: '%.80s...'", explanation)
         return explanation, "llm"
 
     except RuntimeError as e:
         error_msg = str(e)
-        print(f"[WARN] Erreur API Hugging Face: {error_msg}")
         if "401" in error_msg or "authentification" in error_msg.lower():
-            print(f"[ERROR] ⚠️  Problème d'authentification! Vérifiez que HF_TOKEN est correct dans .env")
-            print(f"[INFO] 💡 Alternative: Utilisez OpenRouter pour une API plus fiable")
+            logger.error("Problème d'authentification LLM (vérifiez HF_TOKEN / OPENROUTER_API_KEY dans .env): %s", error_msg)
+            EXPLANATION_FALLBACKS.inc(reason="api_auth")
         elif "503" in error_msg or "chargement" in error_msg.lower():
-            print(f"[INFO] Le modèle est en cours de chargement. Réessayez dans quelques secondes.")
+            logger.info("Le modèle est en cours de chargement: %s", error_msg)
+            EXPLANATION_FALLBACKS.inc(reason="api_unavailable")
         elif "410" in error_msg or "deprecated" in error_msg.lower():
-            print(f"[ERROR] ⚠️  L'endpoint Hugging Face a changé. Vérifiez HF_API_URL dans .env")
-            print(f"[INFO] 💡 Alternative: Utilisez https://router.huggingface.co ou OpenRouter")
+            logger.error("L'endpoint Hugging Face a changé, vérifiez HF_API_URL dans .env: %s", error_msg)
+            EXPLANATION_FALLBACKS.inc(reason="api_deprecated")
+        elif "timeout" in error_msg.lower():
+            logger.warning("Erreur LLM: %s", error_msg)
+            EXPLANATION_FALLBACKS.inc(reason="api_timeout")
         else:
-            print(f"[WARN] Erreur LLM: {error_msg}")
+            logger.warning("Erreur LLM: %s", error_msg)
+            EXPLANATION_FALLBACKS.inc(reason="api_error")
         explanation = _dynamic_fallback(emotion, confidence)
         return explanation, "static"
     except Exception as e:
-        print(f"[WARN] Erreur inattendue lors de la génération de l'explication LLM: {type(e).__name__}: {e}")
-        import traceback
-        print(f"[DEBUG] Traceback complet:\n{traceback.format_exc()}")
+        logger.warning(
+            "Erreur inattendue lors de la génération de l'explication LLM: %s: %s",
+            type(e).__name__, e, exc_info=logger.isEnabledFor(logging.DEBUG),
+        )
+        EXPLANATION_FALLBACKS.inc(reason="unexpected_error")
         explanation = _dynamic_fallback(emotion, confidence)
         return explanation, "static"
 
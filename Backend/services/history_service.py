@@ -0,0 +1,268 @@
+"""
+Historique des prédictions d'émotion, écrit en différé (write-behind).
+
+`analyze_emotion` n'écrit rien en base: il dépose l'événement dans un tampon
+mémoire et répond tout de suite. Une tâche de fond vide le tampon avec un seul
+`insert_many` dès que HISTORY_FLUSH_SIZE événements sont en attente, ou au plus
+tard toutes les HISTORY_FLUSH_INTERVAL_SECONDS.
+
+- tampon borné (HISTORY_BUFFER_MAX): quand il est plein, l'événement est
+  abandonné (et compté) sans faire attendre la requête
+- en cas d'échec d'écriture, seuls les événements non écrits sont remis en
+  tête du tampon et réessayés après un délai exponentiel
+  (HISTORY_RETRY_BASE_SECONDS, doublé à chaque échec jusqu'à
+  HISTORY_RETRY_MAX_SECONDS): pendant une panne de MongoDB, ni les nouveaux
+  événements ni le minuteur ne relancent d'écriture
+  - `BulkWriteError` (lot partiellement écrit): les `writeErrors` désignent
+    les événements à réessayer; une clé dupliquée (11000) signifie que
+    l'événement est déjà en base
+  - autre erreur (réseau...): l'issue est inconnue, les `_id` du lot sont
+    relus avant le prochain essai pour ne pas écrire deux fois un événement
+    (une collection time series n'impose pas l'unicité de `_id`)
+- `stop()` (arrêt du serveur) écrit tout ce qui reste
+- `after_write` met à jour les agrégats journaliers
+  (services/timeline_service.py), une seule fois par événement écrit
+
+Les événements vont dans la collection `emotion_events`, créée en time series
+(timeField `ts`, metaField `meta` = {"user_id"}) quand le serveur le permet.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional
+
+from dotenv import load_dotenv
+from pymongo.errors import BulkWriteError
+
+from db.mongo import db, emotion_events_collection
+from services.timeline_service import apply_rollups
+from utils.metrics import register_collector, stats_collector
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "true").lower() == "true"
+HISTORY_FLUSH_SIZE = int(os.getenv("HISTORY_FLUSH_SIZE", "100"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL_SECONDS", "2"))
+HISTORY_BUFFER_MAX = int(os.getenv("HISTORY_BUFFER_MAX", "5000"))
+HISTORY_RETRY_BASE = float(os.getenv("HISTORY_RETRY_BASE_SECONDS", "1"))
+HISTORY_RETRY_MAX = float(os.getenv("HISTORY_RETRY_MAX_SECONDS", "60"))
+
+EMOTION_EVENTS = "emotion_events"
+
+# Code d'erreur MongoDB d'une clé dupliquée
+DUPLICATE_KEY = 11000
+
+
+async def ensure_events_collection():
+    """Crée `emotion_events` en collection time series si elle n'existe pas encore."""
+    try:
+        if EMOTION_EVENTS in await db.list_collection_names():
+            return
+        await db.create_collection(
+            EMOTION_EVENTS,
+            timeseries={"timeField": "ts", "metaField": "meta", "granularity": "minutes"},
+        )
+        logger.info("Collection time series '%s' creee", EMOTION_EVENTS)
+    except Exception as e:
+        # Serveur sans time series (ou droits insuffisants): collection classique
+        logger.warning("Impossible de creer '%s' en time series (%s), collection classique utilisee", EMOTION_EVENTS, e)
+
+
+def build_event(user_id: str, result: dict, content: dict, timings: List[tuple]) -> dict:
+    """Construit l'événement stocké pour une prédiction."""
+    timings_ms = {}
+    for stage, seconds in timings:
+        timings_ms[stage] = round(timings_ms.get(stage, 0.0) + seconds * 1000, 1)
+    return {
+        "ts": datetime.utcnow(),
+        "meta": {"user_id": user_id},
+        "emotion": content.get("emotion"),
+        "model_emotion": result.get("emotion"),
+        "confidence": result.get("confidence"),
+        "douaa_id": content.get("douaa_id"),
+        "ayah_id": content.get("ayah_id"),
+        "explanation_source": result.get("explanation_source"),
+        "timings_ms": timings_ms,
+    }
+
+
+class HistoryWriter:
+    def __init__(
+        self,
+        collection,
+        flush_size: int = HISTORY_FLUSH_SIZE,
+        flush_interval: float = HISTORY_FLUSH_INTERVAL,
+        max_buffer: int = HISTORY_BUFFER_MAX,
+        retry_base: float = HISTORY_RETRY_BASE,
+        retry_max: float = HISTORY_RETRY_MAX,
+        after_write: Optional[Callable[[List[dict]], Awaitable[None]]] = None,
+    ):
+        self.collection = collection
+        self.after_write = after_write
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        # Échecs consécutifs, et instant avant lequel aucune écriture n'est retentée
+        self._failures = 0
+        self._retry_at = 0.0
+        self._buffer: deque = deque()
+        # `_id` des événements dont l'écriture a échoué sans savoir s'ils sont en base
+        self._unconfirmed: set = set()
+        self._flush_requested: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        # Metrics
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self._flush_total = 0.0
+
+    def start(self):
+        if not HISTORY_ENABLED:
+            logger.info("Historique des emotions desactive (HISTORY_ENABLED=false)")
+            return
+        self._closing = False
+        self._flush_requested = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def record(self, event: dict) -> bool:
+        """Ajoute un événement au tampon. Retourne False s'il a été abandonné (tampon plein)."""
+        if self._task is None:
+            # Writer non démarré (historique désactivé, script hors serveur)
+            return False
+
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            self._flush_requested.set()
+            return False
+
+        self._buffer.append(event)
+        self.recorded += 1
+        if len(self._buffer) >= self.flush_size:
+            self._flush_requested.set()
+        return True
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception("Erreur inattendue dans l'ecriture de l'historique: %s", e)
+
+    async def _already_written(self, batch: List[dict]) -> set:
+        """`_id` des événements du lot à l'issue inconnue qui sont déjà en base."""
+        ids = [doc["_id"] for doc in batch if doc.get("_id") in self._unconfirmed]
+        if not ids:
+            return set()
+        cursor = self.collection.find({"_id": {"$in": ids}}, {"_id": 1})
+        return {doc["_id"] async for doc in cursor}
+
+    def _retry_later(self, events: List[dict], error: Exception):
+        """Remet `events` en tête du tampon (dans sa limite) et arme le délai de réessai."""
+        self.failed_flushes += 1
+        self._failures += 1
+        delay = min(self.retry_max, self.retry_base * 2 ** (self._failures - 1))
+        self._retry_at = time.monotonic() + delay
+        logger.error(
+            "Echec de l'ecriture de %d evenements d'historique, nouvel essai dans %.1f s: %s",
+            len(events), delay, error,
+        )
+        room = max(0, self.max_buffer - len(self._buffer))
+        self._buffer.extendleft(reversed(events[:room]))
+        for event in events[room:]:
+            self._unconfirmed.discard(event.get("_id"))
+        self.dropped += max(0, len(events) - room)
+
+    async def flush(self, force: bool = False):
+        """
+        Écrit le contenu du tampon par lots de flush_size. Après un échec, ne fait
+        rien avant la fin du délai de réessai, sauf avec `force` (arrêt du serveur).
+        """
+        if not force and time.monotonic() < self._retry_at:
+            return
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.flush_size, len(self._buffer)))]
+            started = time.perf_counter()
+            failed: List[dict] = []
+            try:
+                already = await self._already_written(batch)
+                pending = [doc for doc in batch if doc.get("_id") not in already] if already else batch
+                if pending:
+                    await self.collection.insert_many(pending, ordered=False)
+            except BulkWriteError as e:
+                # Lot partiellement écrit: seuls les événements en erreur (hors doublons) sont réessayés
+                indexes = {
+                    err["index"] for err in e.details.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY
+                }
+                failed = [doc for i, doc in enumerate(pending) if i in indexes]
+                error = e
+            except Exception as e:
+                # Issue inconnue (l'écriture a pu aboutir): les _id seront relus au prochain essai
+                self._unconfirmed.update(doc["_id"] for doc in batch if "_id" in doc)
+                self._retry_later(batch, e)
+                return
+
+            failed_ids = {id(doc) for doc in failed}
+            written = [doc for doc in batch if id(doc) not in failed_ids]
+            for doc in batch:
+                self._unconfirmed.discard(doc.get("_id"))
+            if written:
+                self.flushes += 1
+                self.written += len(written)
+                self._flush_total += time.perf_counter() - started
+                if self.after_write is not None:
+                    await self.after_write(written)
+            if failed:
+                self._retry_later(failed, error)
+                return
+            self._failures = 0
+            self._retry_at = 0.0
+
+    async def stop(self):
+        """Arrête la tâche de fond et écrit les événements restants."""
+        if self._task is None:
+            return
+        # Laisser finir l'écriture en cours plutôt que d'annuler la tâche (lot perdu)
+        self._closing = True
+        self._flush_requested.set()
+        await self._task
+        self._task = None
+        await self.flush(force=True)
+        if self._buffer:
+            logger.error("%d evenements d'historique non ecrits a l'arret", len(self._buffer))
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "max_buffer": self.max_buffer,
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "retry_in_s": round(max(0.0, self._retry_at - time.monotonic()), 1),
+            "avg_batch_size": round(self.written / self.flushes, 1) if self.flushes else 0.0,
+            "avg_flush_ms": round(self._flush_total / self.flushes * 1000, 1) if self.flushes else 0.0,
+        }
+
+
+history_writer = HistoryWriter(emotion_events_collection, after_write=apply_rollups)
+register_collector(stats_collector(
+    "emotion_history", history_writer.stats,
+    counters=["recorded", "written", "dropped", "flushes", "failed_flushes"],
+))
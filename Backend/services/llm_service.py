@@ -1,7 +1,147 @@
 import os
+import re
+import json
+import time
+import logging
 import httpx
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict, Optional
 from schemas.chat_schema import Message
+from services.response_cache import ResponseCache
+from services.admission_control import llm_admission, AdmissionRejected
+from utils.metrics import STAGE_SECONDS, cache_collector, register_collector
+
+logger = logging.getLogger(__name__)
+
+
+# Balises de modèle supprimées partout dans la réponse
+_TOKEN_PATTERN = re.compile(r'</?s>|\[/?INST\]')
+
+# Motifs qui marquent la fin de la partie utile d'une réponse en streaming:
+# dès qu'un de ces motifs apparaît, le flux est coupé (le modèle commence à
+# inventer la suite de la conversation ou à répéter le prompt)
+_STREAM_STOP_PATTERNS = [
+    re.compile(r'###\s*[Pp]rompt'),
+    re.compile(r'\n-{3,}'),
+    re.compile(r'\n\*\*[Uu]tilisateur\*\*:'),
+]
+
+# Caractères qui peuvent débuter une balise ou un motif d'arrêt
+_STREAM_MARKER_CHARS = "<[#\n"
+# Longueur max d'un motif encore incomplet qu'on retient avant de l'émettre
+_STREAM_HOLDBACK = 24
+
+# Messages de repli (identiques en mode classique et en streaming)
+UNAVAILABLE_MESSAGE = "Je suis temporairement indisponible. Prends soin de toi. 🌙"
+ERROR_MESSAGE = "Une erreur est survenue. Réessaye plus tard, s'il te plaît. 💙"
+# Repli statique quand le contrôle d'admission refuse l'appel (surcharge)
+OVERLOADED_MESSAGE = "Beaucoup de personnes me parlent en ce moment. Respire doucement, je suis à toi dans un instant. 🌙"
+# Réponses de repli: jamais enregistrées dans une conversation
+FALLBACK_MESSAGES = (UNAVAILABLE_MESSAGE, ERROR_MESSAGE, OVERLOADED_MESSAGE)
+
+
+
+class StreamInterrupted(Exception):
+    """Le flux LLM a échoué après le premier token: la réponse émise est incomplète."""
+
+
+# En-tête du message système qui porte le résumé des tours plus anciens
+SUMMARY_HEADER = "Résumé de la conversation précédente:"
+
+
+def clean_response(assistant_response: str) -> str:
+    """
+    Nettoie les artifacts du modèle dans une réponse complète.
+    """
+    # Supprimer les balises de modèle
+    assistant_response = assistant_response.replace("<s>", "").replace("</s>", "").strip()
+
+    # Supprimer les patterns "### Prompt" ou "### prompt" et tout après
+    assistant_response = re.sub(r'###\s*[Pp]rompt.*', '', assistant_response).strip()
+
+    # Supprimer les patterns de tokens internes
+    assistant_response = re.sub(r'\[INST\]|\[/INST\]', '', assistant_response).strip()
+
+    # Supprimer les lignes de séparation (---) et tout après
+    assistant_response = re.sub(r'\n-{3,}.*', '', assistant_response, flags=re.DOTALL).strip()
+
+    # Supprimer les patterns **Utilisateur**: et tout après
+    assistant_response = re.sub(r'\n\*\*[Uu]tilisateur\*\*:.*', '', assistant_response, flags=re.DOTALL).strip()
+
+    # Supprimer les lignes vides multiples
+    assistant_response = re.sub(r'\n\s*\n+', '\n', assistant_response).strip()
+
+    return assistant_response
+
+
+class StreamCleaner:
+    """
+    Version incrémentale de `clean_response` pour le streaming.
+
+    Les morceaux reçus sont accumulés dans un petit tampon: tout ce qui ne peut
+    plus faire partie d'une balise ou d'un motif d'arrêt est émis tout de suite,
+    le reste (au plus `_STREAM_HOLDBACK` caractères) attend le morceau suivant.
+    Dès qu'un motif d'arrêt est trouvé, `stopped` passe à True et plus rien
+    n'est émis.
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self._started = False
+        self._last_char = ""
+        self.stopped = False
+
+    def feed(self, chunk: str) -> str:
+        """Ajoute un morceau du flux et retourne le texte nettoyé émissible."""
+        if self.stopped or not chunk:
+            return ""
+
+        self._pending += chunk
+
+        stop_at = self._find_stop(self._pending)
+        if stop_at is not None:
+            self.stopped = True
+            safe, self._pending = self._pending[:stop_at], ""
+            return self._emit(safe, final=True)
+
+        # Retenir la fin du tampon si elle peut débuter une balise ou un motif
+        cut = len(self._pending)
+        window_start = max(0, len(self._pending) - _STREAM_HOLDBACK)
+        for i in range(window_start, len(self._pending)):
+            if self._pending[i] in _STREAM_MARKER_CHARS:
+                cut = i
+                break
+        # Les espaces de fin attendent aussi: ils disparaissent si le flux s'arrête ici
+        cut = min(cut, len(self._pending[:cut].rstrip()))
+
+        safe, self._pending = self._pending[:cut], self._pending[cut:]
+        return self._emit(safe)
+
+    def flush(self) -> str:
+        """Émet ce qui reste dans le tampon à la fin du flux."""
+        if self.stopped:
+            return ""
+        safe, self._pending = self._pending, ""
+        return self._emit(safe, final=True)
+
+    @staticmethod
+    def _find_stop(text: str):
+        positions = [m.start() for m in (p.search(text) for p in _STREAM_STOP_PATTERNS) if m]
+        return min(positions) if positions else None
+
+    def _emit(self, text: str, final: bool = False) -> str:
+        text = _TOKEN_PATTERN.sub("", text)
+        # Supprimer les lignes vides multiples, y compris à la jonction de deux morceaux
+        text = re.sub(r'\n\s*\n+', '\n', text)
+        if self._last_char == "\n":
+            text = text.lstrip("\n")
+        if not self._started:
+            text = text.lstrip()
+        if final:
+            text = text.rstrip()
+        if text:
+            self._started = True
+            self._last_char = text[-1]
+        return text
 
 
 class LLMService:
@@ -16,7 +156,7 @@ class LLMService:
         if not self.api_key:
             raise ValueError("OPENROUTER_API_KEY not found in environment variables")
 
-        self.api_url = "https://openrouter.ai/api/v1/chat/completions"
+        self.api_url = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
         # Récupérer le modèle depuis l'env, avec un default fiable
         self.model = os.getenv("OPENROUTER_MODEL", "mistralai/mistral-7b-instruct:free")
 
@@ -30,88 +170,220 @@ class LLMService:
             "Tu communiques comme dans un SMS ou WhatsApp - naturel et direct."
         )
 
-    async def chat(self, user_message: str, history: List[Message]) -> str:
+        # Cache des réponses aux messages d'ouverture fréquents
+        self.response_cache = ResponseCache()
+        register_collector(cache_collector("chat_response", self.response_cache.stats))
+
+    def _cache_key(self, user_message: str, history: List[Message], summary: Optional[str]) -> Optional[str]:
+        history_len = len(history) + (1 if summary else 0)
+        return self.response_cache.make_key(user_message, history_len, self.system_prompt, self.model)
+
+    async def cached_response(
+        self, user_message: str, history: List[Message], summary: Optional[str] = None
+    ) -> Optional[str]:
+        """Réponse en cache pour ce message (sans appel au LLM), ou None."""
+        cache_key = self._cache_key(user_message, history, summary)
+        return await self.response_cache.get(cache_key) if cache_key else None
+
+    def _build_messages(
+        self, user_message: str, history: List[Message], summary: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        # Construire la liste des messages avec le system prompt
+        messages = [{"role": "system", "content": self.system_prompt}]
+
+        # Ajouter le résumé des tours plus anciens (conversation côté serveur)
+        if summary:
+            messages.append({"role": "system", "content": f"{SUMMARY_HEADER}\n{summary}"})
+
+        # Ajouter l'historique des messages précédents
+        for msg in history:
+            messages.append({"role": msg.role, "content": msg.content})
+
+        # Ajouter le nouveau message de l'utilisateur
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    def _build_request(self, messages: List[Dict[str, str]], stream: bool = False):
+        # Préparer la requête pour OpenRouter
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": 0.7,  # Un peu de créativité mais cohérent
+            "max_tokens": 150,  # Réponses courtes
+            "top_p": 0.9,
+        }
+        if stream:
+            payload["stream"] = True
+
+        return headers, payload
+
+    async def chat(
+        self,
+        user_message: str,
+        history: List[Message],
+        summary: Optional[str] = None,
+        client_key: Optional[str] = None,
+    ) -> str:
         """
         Envoie un message au LLM et retourne la réponse.
 
         Args:
             user_message: Le message de l'utilisateur
             history: L'historique des messages précédents
+            summary: Résumé optionnel des tours plus anciens
+            client_key: Identifiant de l'appelant pour le contrôle d'admission
 
         Returns:
             La réponse de l'assistant
+
+        Raises:
+            AdmissionRejected: si l'appel LLM est refusé (limite ou surcharge)
         """
+        cache_key = self._cache_key(user_message, history, summary)
+        if cache_key:
+            cached = await self.response_cache.get(cache_key)
+            if cached is not None:
+                logger.debug("Chat response cache hit")
+                return cached
+
         try:
-            # Construire la liste des messages avec le system prompt
-            messages = [{"role": "system", "content": self.system_prompt}]
-
-            # Ajouter l'historique des messages précédents
-            for msg in history:
-                messages.append({"role": msg.role, "content": msg.content})
-
-            # Ajouter le nouveau message de l'utilisateur
-            messages.append({"role": "user", "content": user_message})
-
-            # Préparer la requête pour OpenRouter
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-            }
-
-            payload = {
-                "model": self.model,
-                "messages": messages,
-                "temperature": 0.7,  # Un peu de créativité mais cohérent
-                "max_tokens": 150,  # Réponses courtes
-                "top_p": 0.9,
-            }
+            messages = self._build_messages(user_message, history, summary)
+            headers, payload = self._build_request(messages)
 
             # Appel asynchrone à OpenRouter
-            print(f"[DEBUG] Calling OpenRouter with model: {self.model}")
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(self.api_url, json=payload, headers=headers)
-                print(f"[DEBUG] OpenRouter response status: {response.status_code}")
-                response.raise_for_status()
+            logger.debug("Calling OpenRouter with model: %s", self.model)
+            async with llm_admission.slot(client_key, "chat"):
+                async with httpx.AsyncClient(timeout=30.0) as client:
+                    response = await client.post(self.api_url, json=payload, headers=headers)
+                    logger.debug("OpenRouter response status: %s", response.status_code)
+                    response.raise_for_status()
 
             # Extraire la réponse
             data = response.json()
-            print(f"[DEBUG] OpenRouter response data: {data}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("OpenRouter response data: %.300s", json.dumps(data, ensure_ascii=False))
             assistant_response = data["choices"][0]["message"]["content"].strip()
-            
+
             # Nettoyer les artifacts du modèle
-            # Supprimer les balises de modèle
-            assistant_response = assistant_response.replace("<s>", "").replace("</s>", "").strip()
-            
-            # Supprimer les patterns "### Prompt" ou "### prompt" et tout après
-            import re
-            assistant_response = re.sub(r'###\s*[Pp]rompt.*', '', assistant_response).strip()
-            
-            # Supprimer les patterns de tokens internes
-            assistant_response = re.sub(r'\[INST\]|\[/INST\]', '', assistant_response).strip()
-            
-            # Supprimer les lignes de séparation (---) et tout après
-            assistant_response = re.sub(r'\n-{3,}.*', '', assistant_response, flags=re.DOTALL).strip()
-            
-            # Supprimer les patterns **Utilisateur**: et tout après
-            assistant_response = re.sub(r'\n\*\*[Uu]tilisateur\*\*:.*', '', assistant_response, flags=re.DOTALL).strip()
-            
-            # Supprimer les lignes vides multiples
-            assistant_response = re.sub(r'\n\s*\n+', '\n', assistant_response).strip()
+            assistant_response = clean_response(assistant_response)
 
+            if cache_key:
+                await self.response_cache.put(cache_key, assistant_response)
             return assistant_response
 
+        except AdmissionRejected:
+            raise
         except httpx.HTTPError as e:
             # Gestion des erreurs HTTP
-            print(f"[ERROR] HTTPError in LLM service: {e}")
-            if hasattr(e, 'response'):
-                print(f"[ERROR] Response status: {e.response.status_code}")
-                print(f"[ERROR] Response body: {e.response.text}")
-            return (
-                "Je suis temporairement indisponible. Prends soin de toi. 🌙"
-            )
+            response = getattr(e, "response", None)
+            if response is not None:
+                logger.error("HTTPError in LLM service: %s (status=%s, body=%.300s)", e, response.status_code, response.text)
+            else:
+                logger.error("HTTPError in LLM service: %s", e)
+            return UNAVAILABLE_MESSAGE
         except Exception as e:
             # Gestion des autres erreurs
-            print(f"[ERROR] Error in LLM service: {e}")
-            import traceback
-            traceback.print_exc()
-            return "Une erreur est survenue. Réessaye plus tard, s'il te plaît. 💙"
+            logger.exception("Error in LLM service: %s", e)
+            return ERROR_MESSAGE
+
+    async def chat_stream(
+        self,
+        user_message: str,
+        history: List[Message],
+        summary: Optional[str] = None,
+        client_key: Optional[str] = None,
+        rate_checked: bool = False,
+    ) -> AsyncIterator[str]:
+        """
+        Variante streaming de `chat`: transmet les tokens du LLM au fur et à mesure.
+
+        Les artifacts sont nettoyés au fil de l'eau (voir `StreamCleaner`) et le
+        flux amont est fermé dès qu'un motif d'arrêt apparaît. En cas d'erreur
+        avant le premier token, ou de refus du contrôle d'admission, le message
+        de repli habituel est émis; après le premier token, StreamInterrupted
+        est levée (la réponse partielle ne doit pas être enregistrée). `rate_checked` indique que la limite par
+        utilisateur a déjà été vérifiée par l'appelant (avant d'ouvrir le flux).
+
+        Yields:
+            Des morceaux de texte déjà nettoyés
+
+        Raises:
+            StreamInterrupted: si le flux échoue après le premier token
+        """
+        cache_key = self._cache_key(user_message, history, summary)
+        if cache_key:
+            cached = await self.response_cache.get(cache_key)
+            if cached is not None:
+                logger.debug("Chat response cache hit (stream)")
+                yield cached
+                return
+
+        messages = self._build_messages(user_message, history, summary)
+        headers, payload = self._build_request(messages, stream=True)
+        cleaner = StreamCleaner()
+        started_at = time.perf_counter()
+        first_token_at = None
+        emitted = []
+
+        try:
+            logger.debug("Streaming from OpenRouter with model: %s", self.model)
+            slot = llm_admission.slot(client_key, "chat", check_rate=not rate_checked)
+            async with slot, httpx.AsyncClient(timeout=30.0) as client:
+                async with client.stream("POST", self.api_url, json=payload, headers=headers) as response:
+                    response.raise_for_status()
+
+                    async for line in response.aiter_lines():
+                        # Format SSE: "data: {...}", les lignes ": ..." sont des keep-alive
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+
+                        try:
+                            delta = json.loads(data)["choices"][0].get("delta", {}).get("content") or ""
+                        except (ValueError, KeyError, IndexError):
+                            continue
+
+                        text = cleaner.feed(delta)
+                        if text:
+                            if first_token_at is None:
+                                first_token_at = time.perf_counter()
+                                logger.info("Time to first token: %.0f ms", (first_token_at - started_at) * 1000)
+                                STAGE_SECONDS.observe(first_token_at - started_at, pipeline="chat_stream", stage="first_token")
+                            emitted.append(text)
+                            yield text
+                        if cleaner.stopped:
+                            # Motif d'arrêt détecté: inutile de consommer la suite
+                            break
+
+            tail = cleaner.flush()
+            if tail:
+                emitted.append(tail)
+                yield tail
+
+            if cache_key:
+                await self.response_cache.put(cache_key, "".join(emitted))
+
+            elapsed = time.perf_counter() - started_at
+            STAGE_SECONDS.observe(elapsed, pipeline="chat_stream", stage="complete")
+            logger.info("Stream completed in %.0f ms", elapsed * 1000)
+
+        except AdmissionRejected as e:
+            logger.warning("LLM stream rejected by admission control: %s", e.reason)
+            yield OVERLOADED_MESSAGE
+        except httpx.HTTPError as e:
+            logger.error("HTTPError in LLM stream: %s", e)
+            if first_token_at is not None:
+                raise StreamInterrupted(str(e)) from e
+            yield UNAVAILABLE_MESSAGE
+        except Exception as e:
+            logger.exception("Error in LLM stream: %s", e)
+            if first_token_at is not None:
+                raise StreamInterrupted(str(e)) from e
+            yield ERROR_MESSAGE
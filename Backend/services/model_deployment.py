@@ -0,0 +1,159 @@
+"""
+Déploiement des versions du modèle d'émotion sur tous les workers, sans redémarrage.
+
+La version voulue (active, et candidate en mode shadow) est enregistrée dans
+la collection `model_deployments`. Le worker qui reçoit l'appel
+d'administration charge, préchauffe et active la version tout de suite; les
+autres relisent le document toutes les MODEL_DEPLOYMENT_POLL_SECONDS et
+convergent de la même façon (ml/model_registry.py). Un worker qui démarre
+applique le déploiement courant avant d'accepter des requêtes.
+
+Le chargement tourne dans un thread à part: les prédictions continuent sur la
+version active pendant ce temps. Une version qui n'a pas pu être chargée n'est
+retentée qu'après MODEL_DEPLOYMENT_RETRY_SECONDS.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import anyio
+from dotenv import load_dotenv
+
+from db.mongo import model_deployments_collection
+from ml.emotion_model import model_registry
+from utils.metrics import register_collector, stats_collector
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MODEL_DEPLOYMENT_POLL = float(os.getenv("MODEL_DEPLOYMENT_POLL_SECONDS", "10"))
+MODEL_DEPLOYMENT_RETRY = float(os.getenv("MODEL_DEPLOYMENT_RETRY_SECONDS", "300"))
+
+DEPLOYMENT_ID = "emotion"
+
+
+def _spec(version: str, model_name: str, revision: Optional[str] = None) -> dict:
+    return {"version": version, "model_name": model_name, "revision": revision}
+
+
+class ModelDeployment:
+    def __init__(self, collection=model_deployments_collection, poll_interval: float = MODEL_DEPLOYMENT_POLL):
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        # (version, modèle, révision) -> instant du prochain essai après un échec
+        self._failed: Dict[tuple, float] = {}
+
+        # Metrics
+        self.syncs = 0
+        self.sync_errors = 0
+        self.load_failures = 0
+
+    async def _load(self, spec: dict):
+        """Charge et préchauffe une version dans un thread (sans bloquer les prédictions)."""
+        await anyio.to_thread.run_sync(model_registry.load, spec["version"], spec["model_name"], spec.get("revision"))
+
+    async def _try_load(self, spec: dict) -> bool:
+        key = (spec["version"], spec["model_name"], spec.get("revision"))
+        if time.monotonic() < self._failed.get(key, 0.0):
+            return False
+        try:
+            await self._load(spec)
+        except Exception as e:
+            self.load_failures += 1
+            self._failed[key] = time.monotonic() + MODEL_DEPLOYMENT_RETRY
+            logger.error("Version %s du modele non chargee, nouvel essai dans %.0f s: %s", key[0], MODEL_DEPLOYMENT_RETRY, e)
+            return False
+        self._failed.pop(key, None)
+        return True
+
+    async def _apply(self, doc: dict):
+        active = doc.get("active")
+        if active and active["version"] != model_registry.active_version:
+            if await self._try_load(active):
+                model_registry.activate(active["version"])
+
+        shadow = doc.get("shadow")
+        if shadow and shadow.get("percent", 0) > 0 and shadow["version"] != model_registry.active_version:
+            if shadow["version"] == model_registry.shadow_version or await self._try_load(shadow):
+                model_registry.set_shadow(shadow["version"], shadow["percent"])
+        elif model_registry.shadow_version is not None:
+            model_registry.set_shadow(None, 0)
+
+    async def sync(self):
+        """Aligne ce worker sur le déploiement enregistré."""
+        async with self._lock:
+            doc = await self.collection.find_one({"_id": DEPLOYMENT_ID})
+            if doc:
+                await self._apply(doc)
+            self.syncs += 1
+
+    async def deploy(self, version: str, model_name: str, revision: Optional[str] = None):
+        """Active une version sur ce worker (chargée et préchauffée d'abord), puis sur les autres."""
+        spec = _spec(version, model_name, revision)
+        async with self._lock:
+            await self._load(spec)
+            model_registry.activate(version)
+            await self.collection.update_one(
+                {"_id": DEPLOYMENT_ID},
+                {"$set": {"active": spec, "updated_at": datetime.now(timezone.utc)}},
+                upsert=True,
+            )
+        logger.info("Version %s du modele deployee (%s@%s)", version, model_name, revision or "latest")
+
+    async def set_shadow(
+        self, version: Optional[str], model_name: Optional[str], revision: Optional[str], percent: float
+    ):
+        """Envoie `percent` % des lots à une version candidate (0 désactive le mode shadow)."""
+        async with self._lock:
+            shadow = None
+            if version and percent > 0:
+                shadow = dict(_spec(version, model_name, revision), percent=percent)
+                if version != model_registry.shadow_version:
+                    await self._load(shadow)
+            model_registry.set_shadow(version if shadow else None, percent if shadow else 0)
+            await self.collection.update_one(
+                {"_id": DEPLOYMENT_ID},
+                {"$set": {"shadow": shadow, "updated_at": datetime.now(timezone.utc)}},
+                upsert=True,
+            )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                self.sync_errors += 1
+                logger.warning("Synchronisation du deploiement du modele impossible: %s", e)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict:
+        return dict(
+            model_registry.stats(), syncs=self.syncs, sync_errors=self.sync_errors, load_failures=self.load_failures
+        )
+
+
+model_deployment = ModelDeployment()
+register_collector(stats_collector(
+    "model_registry", model_deployment.stats,
+    counters=["swaps", "shadow_batches", "shadow_images", "shadow_dropped", "shadow_errors", "syncs", "sync_errors",
+              "load_failures"],
+))
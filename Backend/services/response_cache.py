@@ -0,0 +1,113 @@
+"""
+Cache des réponses DhikrAI pour les messages d'ouverture fréquents
+("salam", "Je me sens triste", "je suis stressé"...).
+
+La clé combine le message normalisé (minuscules, sans accents ni ponctuation),
+le hash du prompt système et le modèle. Chaque clé garde plusieurs variantes de
+réponse servies à tour de rôle pour que les réponses ne paraissent pas figées:
+tant qu'une clé n'a pas toutes ses variantes, l'appel part au LLM et la réponse
+est ajoutée au cache.
+
+Les entrées vivent dans le cache partagé entre workers (utils/cache.py): L1
+LRU (taille max) dans le processus, L2 commun, TTL par entrée compté depuis la
+première variante. Seul l'index de rotation reste propre à chaque worker.
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from utils.cache import TieredCache
+from utils.text_utils import normalize_text
+
+load_dotenv()
+
+CHAT_CACHE_ENABLED = os.getenv("CHAT_CACHE_ENABLED", "true").lower() == "true"
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "500"))
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL_SECONDS", "21600"))
+CHAT_CACHE_VARIANTS = int(os.getenv("CHAT_CACHE_VARIANTS", "3"))
+# Le cache n'est utilisé que pour les messages courts avec peu ou pas d'historique
+CHAT_CACHE_MAX_HISTORY = int(os.getenv("CHAT_CACHE_MAX_HISTORY", "0"))
+CHAT_CACHE_MAX_MESSAGE_CHARS = int(os.getenv("CHAT_CACHE_MAX_MESSAGE_CHARS", "80"))
+
+
+def normalize_message(message: str) -> str:
+    """Normalise un message: minuscules, sans accents, sans ponctuation, espaces uniques."""
+    return normalize_text(message)
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        max_size: int = CHAT_CACHE_SIZE,
+        ttl: float = CHAT_CACHE_TTL,
+        variants: int = CHAT_CACHE_VARIANTS,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.variants = variants
+        self._cache = TieredCache("chat_response", ttl, l1_size=max_size)
+        # key -> prochaine variante servie par ce worker
+        self._rotation: "OrderedDict[str, int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, message: str, history_len: int, system_prompt: str, model: str) -> Optional[str]:
+        """Retourne la clé de cache, ou None si la requête n'est pas cacheable."""
+        if not CHAT_CACHE_ENABLED or history_len > CHAT_CACHE_MAX_HISTORY:
+            return None
+        if len(message) > CHAT_CACHE_MAX_MESSAGE_CHARS:
+            return None
+        normalized = normalize_message(message)
+        if not normalized:
+            return None
+        prompt_hash = hashlib.sha1(system_prompt.encode("utf-8")).hexdigest()[:12]
+        return f"{model}|{prompt_hash}|{normalized}"
+
+    async def _entry(self, key: str) -> Optional[dict]:
+        entry = await self._cache.get(key)
+        if entry is not None and entry["expires"] <= time.time():
+            return None
+        return entry
+
+    async def get(self, key: str) -> Optional[str]:
+        """Retourne la prochaine variante en rotation, ou None s'il faut appeler le LLM."""
+        entry = await self._entry(key)
+        if entry is None or len(entry["variants"]) < self.variants:
+            self.misses += 1
+            return None
+
+        index = self._rotation.pop(key, 0)
+        self._rotation[key] = index + 1
+        while len(self._rotation) > self.max_size:
+            self._rotation.popitem(last=False)
+        self.hits += 1
+        return entry["variants"][index % len(entry["variants"])]
+
+    async def put(self, key: str, response: str):
+        """Ajoute une variante de réponse pour la clé."""
+        if not response:
+            return
+        entry = await self._entry(key)
+        if entry is None:
+            # Horloge murale: l'échéance est partagée entre les workers
+            entry = {"variants": [], "expires": time.time() + self.ttl}
+        if response in entry["variants"] or len(entry["variants"]) >= self.variants:
+            return
+        entry = dict(entry, variants=entry["variants"] + [response])
+        await self._cache.set(key, entry, ttl=max(1.0, entry["expires"] - time.time()))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        tier = self._cache.stats()
+        return {
+            "entries": tier["entries"],
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": tier["evictions"],
+            "expirations": tier["expirations"],
+        }
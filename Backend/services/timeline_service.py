@@ -0,0 +1,132 @@
+"""
+Frise des émotions par utilisateur, servie depuis des agrégats journaliers.
+
+Chaque lot d'événements écrit par le history writer met à jour, avec des
+upserts `$inc`, un document par (utilisateur, jour) dans `emotion_daily`:
+
+    {"user_id": "...", "day": "2024-06-03", "total": 5,
+     "emotions": {"sad": {"count": 3, "confidence_sum": 2.41}, "happy": {...}}}
+
+La lecture de la frise ne touche jamais les événements bruts: une requête
+indexée sur (user_id, day) lit au plus `limit` documents, quel que soit le
+nombre de prédictions de l'utilisateur. La pagination se fait par curseur
+(le dernier jour renvoyé), du plus récent au plus ancien.
+
+Les jours sont découpés dans le fuseau TIMELINE_TIMEZONE (UTC par défaut).
+"""
+import logging
+import os
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from typing import List, Optional
+from zoneinfo import ZoneInfo
+
+from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from db.mongo import emotion_daily_collection
+from utils.metrics import counter
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+TIMELINE_TIMEZONE = ZoneInfo(os.getenv("TIMELINE_TIMEZONE", "UTC"))
+TIMELINE_MAX_LIMIT = 90
+
+ROLLUP_UPDATES = counter("emotion_rollup_updates_total", "Daily rollup upserts, by result", ["result"])
+
+
+def day_of(ts: datetime) -> str:
+    """Jour local (TIMELINE_TIMEZONE) d'un horodatage UTC naïf, au format YYYY-MM-DD."""
+    return ts.replace(tzinfo=timezone.utc).astimezone(TIMELINE_TIMEZONE).date().isoformat()
+
+
+async def ensure_rollup_indexes():
+    """Index composé (user_id, day) utilisé par les upserts et la lecture de la frise."""
+    await emotion_daily_collection.create_index(
+        [("user_id", ASCENDING), ("day", DESCENDING)], unique=True, name="user_day"
+    )
+
+
+def build_rollup_updates(events: List[dict]) -> List[UpdateOne]:
+    """Regroupe un lot d'événements en un upsert `$inc` par (utilisateur, jour)."""
+    increments = defaultdict(lambda: defaultdict(int))
+    for event in events:
+        user_id = event.get("meta", {}).get("user_id")
+        emotion = event.get("emotion")
+        if not user_id or not emotion:
+            continue
+        inc = increments[(user_id, day_of(event["ts"]))]
+        inc["total"] += 1
+        inc[f"emotions.{emotion}.count"] += 1
+        if event.get("confidence") is not None:
+            inc[f"emotions.{emotion}.confidence_sum"] += event["confidence"]
+
+    now = datetime.utcnow()
+    return [
+        UpdateOne(
+            {"user_id": user_id, "day": day},
+            {"$inc": dict(inc), "$set": {"updated_at": now}},
+            upsert=True,
+        )
+        for (user_id, day), inc in increments.items()
+    ]
+
+
+async def apply_rollups(events: List[dict]):
+    """Met à jour les agrégats journaliers pour un lot d'événements déjà écrit."""
+    updates = build_rollup_updates(events)
+    if not updates:
+        return
+    try:
+        await emotion_daily_collection.bulk_write(updates, ordered=False)
+        ROLLUP_UPDATES.inc(len(updates), result="ok")
+    except Exception as e:
+        # Les événements bruts sont déjà écrits: on ne rejoue pas le lot (double comptage)
+        ROLLUP_UPDATES.inc(len(updates), result="error")
+        logger.error("Echec de la mise a jour de %d agregats journaliers: %s", len(updates), e)
+
+
+def _format_day(doc: dict) -> dict:
+    emotions = {}
+    for emotion, values in doc.get("emotions", {}).items():
+        count = int(values.get("count", 0))
+        confidence_sum = values.get("confidence_sum")
+        emotions[emotion] = {
+            "count": count,
+            "mean_confidence": round(confidence_sum / count, 4) if count and confidence_sum is not None else None,
+        }
+    dominant = max(emotions, key=lambda e: emotions[e]["count"]) if emotions else None
+    return {"day": doc["day"], "total": int(doc.get("total", 0)), "dominant": dominant, "emotions": emotions}
+
+
+async def get_timeline(
+    user_id: str,
+    limit: int = 30,
+    cursor: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+) -> dict:
+    """
+    Jours de l'utilisateur, du plus récent au plus ancien.
+    `cursor` est le `next_cursor` de la page précédente.
+    """
+    limit = max(1, min(limit, TIMELINE_MAX_LIMIT))
+    day_filter = {}
+    if end:
+        day_filter["$lte"] = end.isoformat()
+    if cursor:
+        day_filter["$lt"] = cursor
+    if start:
+        day_filter["$gte"] = start.isoformat()
+
+    query = {"user_id": user_id}
+    if day_filter:
+        query["day"] = day_filter
+
+    # Un document de plus pour savoir s'il reste une page
+    docs = await emotion_daily_collection.find(query, {"_id": 0}).sort("day", DESCENDING).limit(limit + 1).to_list(limit + 1)
+    has_more = len(docs) > limit
+    days = [_format_day(doc) for doc in docs[:limit]]
+    return {"days": days, "next_cursor": days[-1]["day"] if has_more else None}
@@ -0,0 +1,15 @@
+"""
+Test configuration: the app modules read their settings at import time, so the
+in-process MongoDB stand-in and dummy secrets are set before any of them is imported.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Never talk to a real database or LLM from the tests, whatever .env says
+os.environ["MONGO_URI"] = "memory://"
+os.environ["CACHE_URL"] = ""
+os.environ.setdefault("DB_NAME", "adkar_test")
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("OPENROUTER_API_KEY", "test-key")
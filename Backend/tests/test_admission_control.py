@@ -0,0 +1,107 @@
+import asyncio
+import concurrent.futures
+
+import pytest
+
+from services.admission_control import AdmissionController, AdmissionRejected, TokenBucket
+
+
+def test_token_bucket_allows_the_burst_then_reports_the_wait():
+    bucket = TokenBucket(rate_per_second=0.5, capacity=2)
+    assert bucket.try_consume() is None
+    assert bucket.try_consume() is None
+    retry_after = bucket.try_consume()
+    assert retry_after == pytest.approx(2.0, abs=0.05)
+
+
+def test_rate_limit_is_per_client():
+    controller = AdmissionController(user_rate_per_minute=1, user_burst=1)
+    controller.check_rate("user:a")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.check_rate("user:a")
+    assert rejected.value.reason == "rate_limited"
+    assert rejected.value.retry_after > 0
+    controller.check_rate("user:b")
+    # Anonymous calls without a key are not rate limited
+    controller.check_rate(None)
+    controller.check_rate(None)
+
+
+@pytest.mark.asyncio
+async def test_acquire_without_rate_check_does_not_consume_a_token():
+    controller = AdmissionController(max_concurrency=4, user_rate_per_minute=1, user_burst=1)
+    controller.check_rate("user:a")
+    await controller.acquire("user:a", check_rate=False)
+    assert controller.active == 1
+
+
+@pytest.mark.asyncio
+async def test_released_slot_goes_to_the_highest_priority_waiter():
+    controller = AdmissionController(max_concurrency=1, user_rate_per_minute=0)
+    await controller.acquire(workload="chat")
+    served = []
+
+    async def wait(workload):
+        await controller.acquire(workload=workload)
+        served.append(workload)
+
+    chat = asyncio.create_task(wait("chat"))
+    await asyncio.sleep(0)
+    explanation = asyncio.create_task(wait("explanation"))
+    await asyncio.sleep(0)
+    assert controller.queue_depth() == 2
+
+    controller.release()
+    await asyncio.sleep(0.01)
+    assert served == ["explanation"]
+    controller.release()
+    await asyncio.gather(chat, explanation)
+    assert served == ["explanation", "chat"]
+    assert controller.active == 1
+
+
+@pytest.mark.asyncio
+async def test_full_queue_and_queue_timeout_are_rejected():
+    controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=0.05, user_rate_per_minute=0)
+    await controller.acquire()
+    waiter = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+
+    with pytest.raises(AdmissionRejected) as full:
+        await controller.acquire()
+    assert full.value.reason == "queue_full"
+    with pytest.raises(AdmissionRejected) as timeout:
+        await waiter
+    assert timeout.value.reason == "queue_timeout"
+    assert controller.active == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_take_the_slot():
+    controller = AdmissionController(max_concurrency=1, user_rate_per_minute=0)
+    await controller.acquire()
+    cancelled = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+
+    controller.release()
+    assert controller.active == 0
+    assert controller.queue_depth() == 0
+    await controller.acquire()
+    assert controller.active == 1
+
+
+@pytest.mark.asyncio
+async def test_release_when_done_holds_the_slot_until_the_thread_finishes():
+    controller = AdmissionController(max_concurrency=1, user_rate_per_minute=0)
+    await controller.acquire(workload="explanation")
+    future = concurrent.futures.Future()
+    controller.release_when_done(future)
+
+    await asyncio.sleep(0.01)
+    assert controller.active == 1
+    future.set_result(None)
+    await asyncio.sleep(0.01)
+    assert controller.active == 0
@@ -0,0 +1,54 @@
+import httpx
+import pytest
+import pytest_asyncio
+
+# The emotion routes import the model module
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from fastapi import FastAPI  # noqa: E402
+
+from routes.emotion_routes import _etag_matches, router  # noqa: E402
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ("", False),
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"other", "abc"', True),
+    ('"abc-gzip"', False),
+    ("*", True),
+])
+def test_etag_matches(header, expected):
+    assert _etag_matches(header, '"abc"') is expected
+
+
+@pytest_asyncio.fixture
+async def client():
+    app = FastAPI()
+    app.include_router(router)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+@pytest.mark.asyncio
+async def test_catalog_revalidation(client):
+    first = await client.get("/emotion/content", headers={"Accept-Encoding": "gzip"})
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+
+    cached = await client.get("/emotion/content", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["etag"] == etag
+    assert "content-encoding" not in cached.headers
+
+
+@pytest.mark.asyncio
+async def test_etag_of_another_variant_does_not_match(client):
+    gzip_etag = (await client.get("/emotion/content", headers={"Accept-Encoding": "gzip"})).headers["etag"]
+    identity = await client.get("/emotion/content", headers={"Accept-Encoding": "identity", "If-None-Match": gzip_etag})
+    assert identity.status_code == 200
+    assert identity.headers["etag"] != gzip_etag
+    assert identity.json()["version"]
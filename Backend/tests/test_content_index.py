@@ -0,0 +1,66 @@
+import numpy as np
+
+from ml.content_index import HashingEmbedder, VectorIndex
+
+TEXTS = {
+    "d1": "tristesse invocation douaa Allahumma inni a'udhu bika minal hammi wal hazan",
+    "d2": "colère invocation douaa a'udhu billahi minash shaytanir rajim",
+    "q1": "peur verset coran la takhaf innani ma'akuma asma'u wa ara",
+}
+
+
+class CountingEmbedder(HashingEmbedder):
+    def __init__(self):
+        super().__init__(dim=256)
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        return super().encode(texts)
+
+
+def test_update_embeds_only_new_or_edited_texts(tmp_path):
+    embedder = CountingEmbedder()
+    index = VectorIndex(str(tmp_path), embedder)
+    assert index.update(TEXTS, "v1") == {"embedded": 3, "reused": 0}
+    before = {content_id: np.array(index._snapshot.matrix[row]) for row, content_id in enumerate(index._snapshot.ids)}
+
+    edited = dict(TEXTS, d2="colère invocation douaa Allahumma ighfir li dhanbi", q2="patience verset coran inna ma'al usri yusra")
+    del edited["q1"]
+    embedder.encoded.clear()
+    assert index.update(edited, "v2") == {"embedded": 2, "reused": 1}
+    assert sorted(embedder.encoded) == sorted([edited["d2"], edited["q2"]])
+
+    # The reused row is the same vector, now at its new position
+    row = index._snapshot.ids.index("d1")
+    np.testing.assert_array_equal(index._snapshot.matrix[row], before["d1"])
+    assert index.version == "v2"
+
+
+def test_same_version_is_not_rebuilt(tmp_path):
+    embedder = CountingEmbedder()
+    index = VectorIndex(str(tmp_path), embedder)
+    index.update(TEXTS, "v1")
+    embedder.encoded.clear()
+    assert index.update(TEXTS, "v1") == {"embedded": 0, "reused": 3}
+    assert embedder.encoded == []
+
+
+def test_restarted_worker_maps_the_index_from_disk(tmp_path):
+    VectorIndex(str(tmp_path), CountingEmbedder()).update(TEXTS, "v1")
+
+    embedder = CountingEmbedder()
+    restarted = VectorIndex(str(tmp_path), embedder)
+    assert restarted.update(TEXTS, "v1") == {"embedded": 0, "reused": 3}
+    assert restarted.stats()["loads"] == 1
+    # The next version reuses the rows of the one found on disk
+    assert restarted.update(dict(TEXTS, q2="patience verset coran"), "v2") == {"embedded": 1, "reused": 3}
+
+
+def test_search_ranks_the_closest_entry_first(tmp_path):
+    index = VectorIndex(str(tmp_path), HashingEmbedder(dim=256))
+    index.update(TEXTS, "v1")
+    hits = index.search("un verset contre la peur", k=2)
+    assert hits[0][0] == "q1"
+    assert hits[0][1] >= hits[1][1]
+    assert index.search("peur", k=2, ids=["d1", "d2"])[0][0] in ("d1", "d2")
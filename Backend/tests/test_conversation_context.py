@@ -0,0 +1,95 @@
+import pytest
+
+from db.mongo import conversations_collection
+from schemas.chat_schema import Message
+from services import conversation_service
+from services.conversation_service import ConversationStore, estimate_tokens
+
+SYSTEM = "Tu es DhikrAI."
+
+
+@pytest.fixture(autouse=True)
+def small_budgets(monkeypatch):
+    monkeypatch.setattr(conversation_service, "CHAT_PROMPT_MAX_TOKENS", 200)
+    monkeypatch.setattr(conversation_service, "CHAT_RECENT_TOKENS", 60)
+    monkeypatch.setattr(conversation_service, "CHAT_SUMMARY_MAX_TOKENS", 40)
+
+
+def _conversation(n_turns, words=20):
+    turns = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"tour {i} " + "mot " * words}
+        for i in range(n_turns)
+    ]
+    return ConversationStore.transient([Message(**t) for t in turns])
+
+
+def test_short_conversation_is_sent_as_is():
+    conversation = _conversation(2, words=3)
+    summary, recent = ConversationStore().build_context(conversation, "et maintenant ?", SYSTEM)
+    assert summary is None
+    assert [m.content for m in recent] == [t["content"] for t in conversation["turns"]]
+    assert conversation["summarized"] == 0
+
+
+def test_older_turns_leave_the_window_for_the_transcript():
+    conversation = _conversation(8)
+    summary, recent = ConversationStore().build_context(conversation, "et maintenant ?", SYSTEM)
+
+    assert sum(estimate_tokens(m.content) for m in recent) <= conversation_service.CHAT_RECENT_TOKENS
+    # Recent turns are the last ones, the others are in the transcript
+    assert recent[-1].content == conversation["turns"][-1]["content"]
+    assert conversation["summarized"] == len(conversation["turns"]) - len(recent)
+    assert summary and summary.splitlines()[-1].startswith(f"- DhikrAI: tour {conversation['summarized'] - 1}")
+
+
+def test_transcript_keeps_the_most_recent_lines_within_its_budget():
+    conversation = _conversation(30)
+    summary, _ = ConversationStore().build_context(conversation, "et maintenant ?", SYSTEM)
+    lines = summary.splitlines()
+    assert sum(estimate_tokens(line) + 1 for line in lines) <= conversation_service.CHAT_SUMMARY_MAX_TOKENS
+    assert f"tour {conversation['summarized'] - 1} " in lines[-1]
+    assert "tour 0 " not in summary
+
+
+def test_turns_are_added_to_the_transcript_once():
+    store = ConversationStore()
+    conversation = _conversation(8)
+    store.build_context(conversation, "et maintenant ?", SYSTEM)
+    summarized, summary = conversation["summarized"], conversation["summary"]
+    store.build_context(conversation, "et maintenant ?", SYSTEM)
+    assert (conversation["summarized"], conversation["summary"]) == (summarized, summary)
+
+
+def test_long_turns_are_cut_in_the_transcript(monkeypatch):
+    monkeypatch.setattr(conversation_service, "CHAT_SUMMARY_MAX_TOKENS", 150)
+    conversation = _conversation(8, words=200)
+    summary, _ = ConversationStore().build_context(conversation, "et maintenant ?", SYSTEM)
+    assert summary
+    for line in summary.splitlines():
+        assert len(line) <= len("- Utilisateur: ") + conversation_service.SUMMARY_LINE_CHARS + 1
+
+
+@pytest.mark.asyncio
+async def test_anonymous_conversation_is_never_stored():
+    store = ConversationStore()
+    before = await conversations_collection.count_documents({})
+    conversation = await store.get_or_create(None, [Message(role="user", content="salut")], owner=None)
+    await store.append(conversation, "ça va ?", "Je suis là.")
+    assert conversation["id"] is None
+    assert await conversations_collection.count_documents({}) == before
+
+
+@pytest.mark.asyncio
+async def test_cache_is_updated_only_by_a_successful_append():
+    store = ConversationStore()
+    created = await store.create(owner="user:a")
+    conversation = await store.get(created["id"], "user:a")
+    conversation["turns"].extend(_conversation(8)["turns"])
+    store.build_context(conversation, "et maintenant ?", SYSTEM)
+
+    cached = await store.get(created["id"], "user:a")
+    assert cached["turns"] == [] and cached["summarized"] == 0
+
+    await store.append(conversation, "et maintenant ?", "Respire.")
+    cached = await store.get(created["id"], "user:a")
+    assert cached["version"] == 1 and cached["turns"][-1]["content"] == "Respire."
@@ -0,0 +1,28 @@
+import pytest
+
+from ml.face_detector import dominant_emotion
+
+
+def _face(emotion, confidence, size):
+    return {"emotion": emotion, "confidence": confidence, "box": {"x": 0, "y": 0, "width": size, "height": size}}
+
+
+def test_single_face():
+    assert dominant_emotion([_face("happy", 0.9, 50)]) == {"emotion": "happy", "confidence": 0.9}
+
+
+def test_close_face_outweighs_background_faces():
+    faces = [_face("sad", 0.8, 200), _face("happy", 0.95, 40), _face("happy", 0.9, 40)]
+    assert dominant_emotion(faces)["emotion"] == "sad"
+
+
+def test_confidence_is_the_mean_over_faces_of_the_winning_emotion():
+    faces = [_face("happy", 0.9, 100), _face("happy", 0.7, 100), _face("neutral", 0.99, 60)]
+    result = dominant_emotion(faces)
+    assert result["emotion"] == "happy"
+    assert result["confidence"] == pytest.approx(0.8)
+
+
+def test_low_confidence_faces_count_less():
+    faces = [_face("angry", 0.2, 100), _face("neutral", 0.9, 80)]
+    assert dominant_emotion(faces)["emotion"] == "neutral"
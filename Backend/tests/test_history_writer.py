@@ -0,0 +1,119 @@
+import pytest
+import pytest_asyncio
+from bson import ObjectId
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from db.memory_store import MemoryCollection
+from services import history_service
+from services.history_service import HistoryWriter
+
+
+class FlakyCollection(MemoryCollection):
+    """Memory collection whose next insert_many calls fail as scripted in `failures`."""
+
+    def __init__(self):
+        super().__init__("emotion_events")
+        self.failures = []
+        self.attempts = 0
+
+    async def insert_many(self, documents, ordered=True):
+        self.attempts += 1
+        failure = self.failures.pop(0) if self.failures else None
+        for doc in documents:
+            doc.setdefault("_id", ObjectId())
+        if failure == "down":
+            raise AutoReconnect("connection refused")
+        if failure == "partial":
+            # First document rejected, the others written
+            await super().insert_many(documents[1:])
+            raise BulkWriteError({"writeErrors": [{"index": 0, "code": 2, "errmsg": "bad"}], "nInserted": len(documents) - 1})
+        if failure == "lost_ack":
+            # Written, but the acknowledgement never arrives
+            await super().insert_many(documents)
+            raise AutoReconnect("connection reset")
+        return await super().insert_many(documents)
+
+
+@pytest_asyncio.fixture
+async def writer(monkeypatch):
+    monkeypatch.setattr(history_service, "HISTORY_ENABLED", True)
+    rolled_up = []
+
+    async def after_write(events):
+        rolled_up.extend(event["n"] for event in events)
+
+    writer = HistoryWriter(
+        FlakyCollection(), flush_size=10, flush_interval=60, max_buffer=5,
+        retry_base=60, retry_max=600, after_write=after_write,
+    )
+    writer.rolled_up = rolled_up
+    writer.start()
+    yield writer
+    await writer.stop()
+
+
+def _record(writer, count):
+    return [writer.record({"n": i}) for i in range(count)]
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_requeued_and_retried_after_backoff(writer):
+    _record(writer, 3)
+    writer.collection.failures = ["down"]
+    await writer.flush()
+    assert writer.stats()["buffered"] == 3
+    assert writer.stats()["retry_in_s"] > 0
+
+    # Still backing off: no new attempt, even when asked
+    await writer.flush()
+    assert writer.collection.attempts == 1
+
+    await writer.flush(force=True)
+    assert writer.collection.attempts == 2
+    assert writer.written == 3 and writer.stats()["buffered"] == 0
+    assert writer.stats()["retry_in_s"] == 0
+
+
+@pytest.mark.asyncio
+async def test_backoff_doubles_up_to_the_maximum(writer):
+    writer.retry_base, writer.retry_max = 1, 3
+    _record(writer, 1)
+    delays = []
+    for _ in range(4):
+        writer.collection.failures = ["down"]
+        await writer.flush(force=True)
+        delays.append(writer.stats()["retry_in_s"])
+    assert delays == [1.0, 2.0, 3.0, 3.0]
+
+
+@pytest.mark.asyncio
+async def test_partial_failure_requeues_only_the_rejected_events(writer):
+    _record(writer, 3)
+    writer.collection.failures = ["partial"]
+    await writer.flush()
+    assert writer.written == 2
+    assert writer.rolled_up == [1, 2]
+    assert [event["n"] for event in writer._buffer] == [0]
+
+    await writer.flush(force=True)
+    assert len(writer.collection._docs) == 3
+    assert sorted(writer.rolled_up) == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_lost_acknowledgement_does_not_duplicate_events(writer):
+    _record(writer, 3)
+    writer.collection.failures = ["lost_ack"]
+    await writer.flush()
+    assert writer.rolled_up == []
+
+    await writer.flush(force=True)
+    assert len(writer.collection._docs) == 3
+    assert sorted(writer.rolled_up) == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_full_buffer_drops_events_without_waiting(writer):
+    accepted = _record(writer, 7)
+    assert accepted == [True] * 5 + [False] * 2
+    assert writer.dropped == 2
@@ -0,0 +1,100 @@
+import httpx
+import pytest
+
+from schemas.chat_schema import Message
+from services import llm_service
+from services.llm_service import LLMService, StreamCleaner, StreamInterrupted, UNAVAILABLE_MESSAGE, clean_response
+
+
+def _stream(chunks):
+    cleaner = StreamCleaner()
+    text = "".join(cleaner.feed(chunk) for chunk in chunks)
+    return text + cleaner.flush()
+
+
+@pytest.mark.parametrize("raw", [
+    "<s> Je suis là pour toi.</s>",
+    "Respire doucement.\n\n\nTout va bien.",
+    "Courage [INST]à toi[/INST].",
+    "Je suis là.\n---\nUtilisateur: merci",
+    "Je suis là. ### Prompt: réponds encore",
+    "Je suis là.\n**Utilisateur**: et toi ?",
+])
+def test_stream_cleaner_matches_clean_response(raw):
+    # Same result whatever the chunking, including one character at a time
+    assert _stream([raw]) == clean_response(raw)
+    assert _stream(list(raw)) == clean_response(raw)
+
+
+def test_stream_cleaner_holds_back_a_split_marker():
+    cleaner = StreamCleaner()
+    assert cleaner.feed("Je suis là <") == "Je suis là"
+    # The tag is still within the holdback window: nothing of it is emitted
+    rest = cleaner.feed("/s> pour toi")
+    assert "<" not in rest
+    assert "Je suis là" + rest + cleaner.flush() == clean_response("Je suis là </s> pour toi")
+
+
+def test_stream_cleaner_stops_at_stop_pattern():
+    cleaner = StreamCleaner()
+    emitted = cleaner.feed("Prends soin de toi.\n--")
+    emitted += cleaner.feed("-\n**Utilisateur**: encore")
+    assert cleaner.stopped
+    assert emitted == "Prends soin de toi."
+    assert cleaner.feed("plus rien") == ""
+    assert cleaner.flush() == ""
+
+
+class _FailingStream(httpx.AsyncByteStream):
+    """SSE body that breaks after the given lines."""
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    async def __aiter__(self):
+        for line in self.lines:
+            yield line.encode()
+        raise httpx.ReadError("connection reset")
+
+
+def _sse(content):
+    return 'data: {"choices": [{"delta": {"content": "%s"}}]}\n\n' % content
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Replaces the OpenRouter client by a MockTransport serving `upstream.lines` then failing."""
+    real_client = httpx.AsyncClient
+
+    class Upstream:
+        lines = []
+
+    def handler(request):
+        return httpx.Response(200, stream=_FailingStream(Upstream.lines))
+
+    monkeypatch.setattr(
+        llm_service.httpx, "AsyncClient",
+        lambda **kwargs: real_client(transport=httpx.MockTransport(handler)),
+    )
+    return Upstream
+
+
+# A history keeps the request out of the opener response cache
+HISTORY = [Message(role="user", content="salut"), Message(role="assistant", content="salut !")]
+
+
+@pytest.mark.asyncio
+async def test_stream_interrupted_after_first_token(upstream):
+    upstream.lines = [_sse("Je suis "), _sse("là pour toi")]
+    tokens = []
+    with pytest.raises(StreamInterrupted):
+        async for token in LLMService().chat_stream("ça va ?", HISTORY, client_key="ip:test"):
+            tokens.append(token)
+    assert "".join(tokens).startswith("Je suis")
+
+
+@pytest.mark.asyncio
+async def test_stream_failure_before_first_token_yields_fallback(upstream):
+    upstream.lines = []
+    tokens = [token async for token in LLMService().chat_stream("ça va ?", HISTORY, client_key="ip:test")]
+    assert tokens == [UNAVAILABLE_MESSAGE]
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from utils.cache import MemoryBackend, TieredCache
+from utils.metrics import current_stages, stage_timer, track_stages
+
+
+class BrokenBackend(MemoryBackend):
+    async def get(self, key):
+        raise ConnectionError("redis down")
+
+    async def set(self, key, value, ttl):
+        raise ConnectionError("redis down")
+
+    async def add(self, key, value, ttl):
+        raise ConnectionError("redis down")
+
+
+def _counting(value, delay=0.02):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        with stage_timer("test", "compute"):
+            await asyncio.sleep(delay)
+        return value
+
+    return compute, calls
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_computation():
+    cache = TieredCache("test_coalesce", ttl=60, backend=MemoryBackend())
+    compute, calls = _counting({"emotion": "happy"})
+
+    async def request():
+        track_stages()
+        value = await cache.get_or_compute("k", compute)
+        return value, current_stages()
+
+    results = await asyncio.gather(*(request() for _ in range(5)))
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 4
+    # Every caller gets the value and the stage timed by the shared computation
+    for value, stages in results:
+        assert value == {"emotion": "happy"}
+        assert [stage for stage, _ in stages] == ["compute"]
+
+
+@pytest.mark.asyncio
+async def test_callers_get_their_own_copy():
+    cache = TieredCache("test_copy", ttl=60, backend=None)
+    compute, _ = _counting({"faces": [1]})
+    first = await cache.get_or_compute("k", compute)
+    first["faces"].append(2)
+    assert await cache.get("k") == {"faces": [1]}
+
+
+@pytest.mark.asyncio
+async def test_values_are_shared_through_l2():
+    backend = MemoryBackend()
+    worker_a = TieredCache("test_l2", ttl=60, backend=backend)
+    worker_b = TieredCache("test_l2", ttl=60, backend=backend)
+    compute, calls = _counting("douaa")
+    await worker_a.get_or_compute("k", compute)
+    assert await worker_b.get_or_compute("k", compute) == "douaa"
+    assert len(calls) == 1
+    assert worker_b.stats()["l2_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_unavailable_l2_falls_back_to_l1():
+    cache = TieredCache("test_l2_down", ttl=60, backend=BrokenBackend())
+    compute, calls = _counting("douaa")
+    assert await cache.get_or_compute("k", compute) == "douaa"
+    assert await cache.get_or_compute("k", compute) == "douaa"
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert stats["l1_hits"] == 1
+    # L2 is skipped after the first error instead of failing every call
+    assert stats["l2_errors"] == 1
+
+
+@pytest.mark.asyncio
+async def test_uncacheable_values_and_errors_are_not_stored():
+    cache = TieredCache("test_uncacheable", ttl=60, backend=MemoryBackend())
+    compute, calls = _counting({"source": "static"})
+    for _ in range(2):
+        await cache.get_or_compute("k", compute, cacheable=lambda value: value["source"] == "llm")
+    assert len(calls) == 2
+
+    async def failing():
+        raise RuntimeError("upstream")
+
+    with pytest.raises(RuntimeError):
+        await cache.get_or_compute("e", failing)
+    assert await cache.get("e") is None
@@ -0,0 +1,405 @@
+"""
+Two-tier cache shared between uvicorn workers.
+
+    from utils.cache import TieredCache
+    predictions = TieredCache("prediction", ttl=3600, version=MODEL_NAME)
+    result = await predictions.get_or_compute(image_hash, compute)
+
+L1 is a small in-process LRU (at most CACHE_L1_TTL_SECONDS per entry), L2 is
+shared by every worker of the node and selected by CACHE_URL:
+
+    (empty)               no L2: each worker warms its own L1
+    memory://             in-process stand-in with the same semantics (tests, single worker)
+    redis://host:6379/0   any Redis-protocol server (Redis, Valkey, KeyDB, Dragonfly)
+
+Keys are "<CACHE_PREFIX>:<namespace>:<version>:<key>". Bumping a cache's
+version (model name, prompt, catalog version) makes the old entries
+unreachable; they expire with their TTL.
+
+Stampede protection: concurrent misses for a key in one worker share a single
+computation, and across workers the computing worker holds a short L2 lock
+(SET NX PX) while the others poll L2 for its value (at most
+CACHE_LOCK_WAIT_SECONDS, then they compute themselves).
+
+Values must be JSON-compatible; None is never cached. Callers get their own
+copy of a value (the L1 entry and the result shared by a flight stay intact),
+and the stages a flight times are added to the Server-Timing of every request
+waiting on it. L2 errors are logged and
+counted, never raised: L2 is skipped for CACHE_L2_RETRY_SECONDS and the cache
+behaves as L1 only in the meantime. redis is an optional dependency, only
+needed for redis:// URLs.
+"""
+import asyncio
+import copy
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from utils.encoding import dumps_json
+from utils.metrics import add_stages, register_collector, stats_collector, track_stages
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # optional dependency
+    redis_asyncio = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CACHE_URL = os.getenv("CACHE_URL", "")
+CACHE_PREFIX = os.getenv("CACHE_PREFIX", "adkar")
+CACHE_L1_SIZE = int(os.getenv("CACHE_L1_SIZE", "1000"))
+# Bounds how long a worker keeps serving an entry deleted or replaced in L2 by another worker
+CACHE_L1_TTL = float(os.getenv("CACHE_L1_TTL_SECONDS", "30"))
+CACHE_L2_TIMEOUT = float(os.getenv("CACHE_L2_TIMEOUT_SECONDS", "0.1"))
+CACHE_L2_RETRY = float(os.getenv("CACHE_L2_RETRY_SECONDS", "5"))
+CACHE_LOCK_TTL = float(os.getenv("CACHE_LOCK_TTL_SECONDS", "30"))
+CACHE_LOCK_WAIT = float(os.getenv("CACHE_LOCK_WAIT_SECONDS", "5"))
+CACHE_LOCK_POLL = float(os.getenv("CACHE_LOCK_POLL_SECONDS", "0.05"))
+CACHE_MEMORY_MAX_ENTRIES = int(os.getenv("CACHE_MEMORY_MAX_ENTRIES", "10000"))
+
+_MISSING = object()
+
+# Every TieredCache, for cache_stats()
+_caches: List["TieredCache"] = []
+
+
+class LocalStore:
+    """Bounded LRU with a per-entry expiry (monotonic clock)."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires, value)
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, value, ttl: float):
+        if self.max_size <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def add(self, key: str, value, ttl: float) -> bool:
+        """Stores only if the key is absent (or expired)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return False
+        self.put(key, value, ttl)
+        return True
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class MemoryBackend:
+    """In-process stand-in for the Redis L2 (memory://): same operations, not shared."""
+
+    def __init__(self, max_size: int = CACHE_MEMORY_MAX_ENTRIES):
+        self._store = LocalStore(max_size)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._store.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self._store.put(key, value, ttl)
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return self._store.add(key, value, ttl)
+
+    async def delete(self, key: str):
+        self._store.delete(key)
+
+    async def close(self):
+        pass
+
+
+class RedisBackend:
+    """L2 on a Redis-protocol server (redis://, rediss://, unix://)."""
+
+    def __init__(self, url: str, timeout: float = CACHE_L2_TIMEOUT):
+        self._client = redis_asyncio.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self._client.set(key, value, px=max(1, int(ttl * 1000)))
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return bool(await self._client.set(key, value, px=max(1, int(ttl * 1000)), nx=True))
+
+    async def delete(self, key: str):
+        await self._client.delete(key)
+
+    async def close(self):
+        close = getattr(self._client, "aclose", None) or self._client.close
+        await close()
+
+
+def backend_from_url(url: str):
+    """L2 backend for CACHE_URL, or None (L1 only)."""
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return MemoryBackend()
+    if redis_asyncio is None:
+        logger.warning("CACHE_URL=%s needs the redis package: shared cache disabled (L1 only)", url.split("@")[-1])
+        return None
+    return RedisBackend(url)
+
+
+_backend = backend_from_url(CACHE_URL)
+
+
+class TieredCache:
+    def __init__(
+        self,
+        namespace: str,
+        ttl: float,
+        version: str = "1",
+        l1_size: int = CACHE_L1_SIZE,
+        l1_ttl: float = CACHE_L1_TTL,
+        backend=_MISSING,
+    ):
+        self.namespace = namespace
+        # ttl <= 0 disables the cache (get_or_compute only computes)
+        self.ttl = ttl
+        self.version = str(version)
+        self.l1_ttl = l1_ttl
+        self._l1 = LocalStore(l1_size)
+        self.backend = _backend if backend is _MISSING else backend
+        self._l2_down_until = 0.0
+        # key -> computation shared by the concurrent misses of this worker
+        self._flights: Dict[str, asyncio.Future] = {}
+
+        # Metrics
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.lock_waits = 0
+        self.lock_wait_hits = 0
+        self.computed = 0
+        self.l2_errors = 0
+
+        register_collector(stats_collector(
+            "cache_tier", self.stats,
+            counters=["hits", "l1_hits", "l2_hits", "misses", "coalesced", "lock_waits", "lock_wait_hits",
+                      "computed", "evictions", "expirations", "l2_errors"],
+            labels={"cache": namespace},
+        ))
+        _caches.append(self)
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def set_version(self, version: str):
+        """Switches to another key version (older entries are no longer read)."""
+        self.version = str(version)
+
+    def _key(self, key: str) -> str:
+        return f"{CACHE_PREFIX}:{self.namespace}:{self.version}:{key}"
+
+    # L2 operations: errors are swallowed and L2 is skipped for a while
+
+    def _l2_available(self) -> bool:
+        return self.backend is not None and time.monotonic() >= self._l2_down_until
+
+    async def _l2(self, operation: str, *args):
+        if not self._l2_available():
+            return None
+        try:
+            return await getattr(self.backend, operation)(*args)
+        except Exception as e:
+            self.l2_errors += 1
+            self._l2_down_until = time.monotonic() + CACHE_L2_RETRY
+            logger.warning("Shared cache %s failed (%s), L1 only for %.0f s: %s", operation, self.namespace, CACHE_L2_RETRY, e)
+            return None
+
+    async def _l2_get(self, full_key: str):
+        raw = await self._l2("get", full_key)
+        if raw is None:
+            return None
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+
+    async def _lookup(self, full_key: str):
+        value = self._l1.get(full_key)
+        if value is not None:
+            self.l1_hits += 1
+            return value
+        value = await self._l2_get(full_key)
+        if value is not None:
+            self.l2_hits += 1
+            self._l1.put(full_key, value, min(self.ttl, self.l1_ttl))
+            return value
+        self.misses += 1
+        return None
+
+    async def get(self, key: str) -> Any:
+        """Cached value, or None."""
+        if not self.enabled:
+            return None
+        return copy.deepcopy(await self._lookup(self._key(key)))
+
+    async def _store(self, full_key: str, value, ttl: float):
+        self._l1.put(full_key, value, min(ttl, self.l1_ttl))
+        await self._l2("set", full_key, dumps_json(value), ttl)
+
+    async def set(self, key: str, value, ttl: Optional[float] = None):
+        if self.enabled and value is not None:
+            await self._store(self._key(key), value, ttl or self.ttl)
+
+    async def delete(self, key: str):
+        """Removes the entry from L2 and from this worker's L1 (other L1s keep it until CACHE_L1_TTL)."""
+        full_key = self._key(key)
+        self._l1.delete(full_key)
+        await self._l2("delete", full_key)
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        ttl: Optional[float] = None,
+        cacheable: Optional[Callable[[Any], bool]] = None,
+        lookup: bool = True,
+    ) -> Any:
+        """
+        Cached value, or the result of `await compute()` (stored unless None or
+        rejected by `cacheable`). Concurrent misses for the key share one call;
+        its exceptions reach every caller. Cancelling a caller does not cancel
+        the computation the others are waiting for. `lookup=False` skips the
+        lookup when the caller has just done it with `get`.
+        """
+        if not self.enabled:
+            return await compute()
+        full_key = self._key(key)
+        if lookup:
+            value = await self._lookup(full_key)
+            if value is not None:
+                return copy.deepcopy(value)
+
+        flight = self._flights.get(full_key)
+        if flight is None:
+            flight = asyncio.ensure_future(self._flight(full_key, compute, ttl or self.ttl, cacheable))
+            self._flights[full_key] = flight
+            flight.add_done_callback(lambda f: self._landed(full_key, f))
+        else:
+            self.coalesced += 1
+        value, stages = await asyncio.shield(flight)
+        # Recorded on the waiting side: the flight runs outside every caller's request context
+        add_stages(stages)
+        return copy.deepcopy(value)
+
+    def _landed(self, full_key: str, flight: asyncio.Future):
+        if self._flights.get(full_key) is flight:
+            del self._flights[full_key]
+        if not flight.cancelled():
+            # Marks the exception as retrieved when every caller was cancelled
+            flight.exception()
+
+    async def _flight(self, full_key: str, compute, ttl: float, cacheable):
+        """Shared computation: (value, stages it timed)."""
+        stages = track_stages()
+        return await self._fill(full_key, compute, ttl, cacheable), stages
+
+    async def _fill(self, full_key: str, compute, ttl: float, cacheable):
+        lock_key = f"{full_key}:lock"
+        token = uuid.uuid4().hex
+        locked = False
+        if self._l2_available():
+            locked = bool(await self._l2("add", lock_key, token.encode(), CACHE_LOCK_TTL))
+            if not locked and self._l2_available():
+                # Another worker is computing it: wait for its value
+                self.lock_waits += 1
+                value = await self._wait_for_value(full_key, lock_key)
+                if value is not None:
+                    self.lock_wait_hits += 1
+                    self._l1.put(full_key, value, min(ttl, self.l1_ttl))
+                    return value
+        try:
+            self.computed += 1
+            value = await compute()
+            if value is not None and (cacheable is None or cacheable(value)):
+                await self._store(full_key, value, ttl)
+            return value
+        finally:
+            if locked:
+                await self._l2("delete", lock_key)
+
+    async def _wait_for_value(self, full_key: str, lock_key: str):
+        deadline = time.monotonic() + CACHE_LOCK_WAIT
+        while time.monotonic() < deadline and self._l2_available():
+            await asyncio.sleep(CACHE_LOCK_POLL)
+            value = await self._l2_get(full_key)
+            if value is not None:
+                return value
+            if await self._l2("get", lock_key) is None:
+                # Lock released without a value (not cacheable, or failed): our turn
+                return None
+        return None
+
+    def stats(self) -> dict:
+        hits = self.l1_hits + self.l2_hits
+        lookups = hits + self.misses
+        return {
+            "version": self.version,
+            "l2": type(self.backend).__name__ if self.backend is not None else None,
+            "entries": len(self._l1),
+            "hits": hits,
+            "l1_hits": self.l1_hits,
+            "l2_hits": self.l2_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "coalesced": self.coalesced,
+            "lock_waits": self.lock_waits,
+            "lock_wait_hits": self.lock_wait_hits,
+            "computed": self.computed,
+            "in_flight": len(self._flights),
+            "evictions": self._l1.evictions,
+            "expirations": self._l1.expirations,
+            "l2_errors": self.l2_errors,
+        }
+
+
+def cache_stats() -> dict:
+    return {cache.namespace: cache.stats() for cache in _caches}
+
+
+async def close_cache():
+    """Closes the shared L2 connection (application shutdown)."""
+    if _backend is not None:
+        await _backend.close()
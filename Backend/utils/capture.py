@@ -0,0 +1,340 @@
+"""
+Opt-in capture of production traffic, for replay with `python -m loadtest.replay`.
+
+With CAPTURE_ENABLED=true, requests to the paths listed in CAPTURE_PATHS
+(/emotion/predict, /api/chat/ and /auth/* by default) are recorded, one JSON
+line per request, in gzip files under CAPTURE_DIR:
+
+    {"ts": 1717400000.123, "method": "POST", "path": "/emotion/predict",
+     "query": "include_content=false", "user": "u-3f9a...", "auth": true,
+     "status": 200, "duration_ms": 182.4, "budget_ms": null,
+     "body": {"image": {"bytes": 48211, "width": 640, "height": 480, "format": "JPEG"}}}
+
+Nothing identifying is stored:
+- users are pseudonyms (HMAC of the user id with CAPTURE_SALT, taken from the
+  JWT subject, or from the register / login response)
+- emails, names and passwords are dropped; replay uses generated accounts
+- images are reduced to their size and dimensions (raw bytes only with CAPTURE_IMAGES=true)
+- chat texts keep their shape (length, spaces, punctuation) but every letter
+  and digit becomes "x", unless CAPTURE_CHAT_TEXT=true
+- conversation ids are pseudonyms, so replay can chain the turns of a conversation
+
+The request path only copies the body (up to CAPTURE_MAX_BODY_BYTES) and
+queues it; parsing, anonymisation and compression happen on a background
+thread. When the queue is full, records are dropped and counted.
+"""
+import base64
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+from PIL import Image
+
+from utils.encoding import loads
+from utils.jwt_handler import decode_token
+from utils.metrics import register_collector, stats_collector
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_ENABLED = os.getenv("CAPTURE_ENABLED", "false").lower() == "true"
+CAPTURE_DIR = os.getenv("CAPTURE_DIR", "captures")
+CAPTURE_PATHS = tuple(p.strip() for p in os.getenv("CAPTURE_PATHS", "/emotion/predict,/api/chat/,/auth/").split(",") if p.strip())
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "1.0"))
+CAPTURE_MAX_BODY_BYTES = int(os.getenv("CAPTURE_MAX_BODY_BYTES", str(10 * 1024 * 1024)))
+CAPTURE_FILE_RECORDS = int(os.getenv("CAPTURE_FILE_RECORDS", "10000"))
+CAPTURE_QUEUE_SIZE = int(os.getenv("CAPTURE_QUEUE_SIZE", "1000"))
+CAPTURE_IMAGES = os.getenv("CAPTURE_IMAGES", "false").lower() == "true"
+CAPTURE_CHAT_TEXT = os.getenv("CAPTURE_CHAT_TEXT", "false").lower() == "true"
+# Without a fixed salt, pseudonyms are not linkable across restarts
+CAPTURE_SALT = os.getenv("CAPTURE_SALT", "").encode() or os.urandom(16)
+
+# Responses whose body carries an id needed to chain the replay (user id, conversation_id)
+_RESPONSE_BODY_PATHS = ("/api/chat/", "/auth/")
+_MAX_RESPONSE_BODY_BYTES = 64 * 1024
+
+
+def pseudonym(value: str, prefix: str = "u") -> str:
+    return f"{prefix}-" + hmac.new(CAPTURE_SALT, value.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def _mask_text(text: str) -> str:
+    if CAPTURE_CHAT_TEXT or not isinstance(text, str):
+        return text
+    return re.sub(r"\w", "x", text)
+
+
+def _user_of(headers: dict) -> Optional[str]:
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    if not authorization.lower().startswith("bearer "):
+        return None
+    token = authorization[7:].strip()
+    payload = decode_token(token)
+    subject = payload.get("sub") if payload else None
+    return pseudonym(subject or token)
+
+
+def _multipart_file(body: bytes, content_type: str) -> Optional[bytes]:
+    """Content of the first file part of a multipart/form-data body."""
+    match = re.search(r'boundary="?([^";]+)"?', content_type)
+    if not match:
+        return None
+    for part in body.split(b"--" + match.group(1).encode("latin-1")):
+        head, sep, content = part.partition(b"\r\n\r\n")
+        if sep and b"filename=" in head:
+            return content[:-2] if content.endswith(b"\r\n") else content
+    return None
+
+
+def _image_body(body: bytes, content_type: str, truncated: bool) -> dict:
+    data = _multipart_file(body, content_type)
+    if data is None:
+        return {}
+    image = {"bytes": len(data), "truncated": truncated}
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            image.update(width=img.width, height=img.height, format=img.format)
+    except Exception:
+        # Unreadable or truncated: the size alone is still useful
+        pass
+    if CAPTURE_IMAGES and not truncated:
+        image["data"] = base64.b64encode(data).decode("ascii")
+    return {"image": image}
+
+
+def _chat_body(body: bytes, response_body: bytes, response_headers: dict) -> dict:
+    try:
+        request = json.loads(body)
+    except ValueError:
+        return {}
+    record = {
+        "message": _mask_text(request.get("message", "")),
+        "history": [
+            {"role": m.get("role"), "content": _mask_text(m.get("content", ""))}
+            for m in request.get("history") or [] if isinstance(m, dict)
+        ],
+    }
+    if request.get("conversation_id"):
+        record["conversation"] = pseudonym(str(request["conversation_id"]), "c")
+
+    # Conversation created or continued by this turn (JSON body, or header for the stream)
+    conversation_id = response_headers.get("x-conversation-id")
+    if not conversation_id and response_body:
+        try:
+            conversation_id = loads(response_body, response_headers.get("content-type", "")).get("conversation_id")
+        except (ValueError, AttributeError):
+            pass
+    if conversation_id:
+        record["response_conversation"] = pseudonym(str(conversation_id), "c")
+    return record
+
+
+def _auth_user(body: bytes, response_body: bytes) -> Optional[str]:
+    try:
+        response = json.loads(response_body)
+    except ValueError:
+        response = None
+    if isinstance(response, dict):
+        if response.get("id"):
+            return pseudonym(str(response["id"]))
+        payload = decode_token(response["access_token"]) if response.get("access_token") else None
+        if payload and payload.get("sub"):
+            return pseudonym(str(payload["sub"]))
+    # Failed register / login: no user id, the email pseudonym groups the attempts
+    try:
+        email = json.loads(body).get("email")
+    except (ValueError, AttributeError):
+        return None
+    return pseudonym(str(email).strip().lower(), "e") if email else None
+
+
+def build_record(raw: dict) -> dict:
+    """Turns what the middleware copied into an anonymised capture record."""
+    headers = raw["headers"]
+    path = raw["path"]
+    content_type = headers.get(b"content-type", b"").decode("latin-1")
+    user = _user_of(headers)
+    body = {}
+
+    if path.startswith("/auth/"):
+        # Only the account pseudonym is kept, to tie register / login to the later requests
+        user = _auth_user(raw["body"], raw["response_body"])
+    elif path.startswith("/emotion/"):
+        body = _image_body(raw["body"], content_type, raw["truncated"])
+    elif path.startswith("/api/chat/"):
+        body = _chat_body(raw["body"], raw["response_body"], raw["response_headers"])
+
+    budget = headers.get(b"x-request-budget-ms")
+    return {
+        "ts": round(raw["ts"], 3),
+        "method": raw["method"],
+        "path": path,
+        "query": raw["query"],
+        "user": user,
+        "auth": b"authorization" in headers,
+        "status": raw["status"],
+        "duration_ms": round(raw["duration"] * 1000, 1),
+        "budget_ms": budget.decode("latin-1") if budget else None,
+        "body": body,
+    }
+
+
+class CaptureWriter:
+    """Background thread turning queued requests into gzip JSON lines files."""
+
+    def __init__(self, directory: str = CAPTURE_DIR, file_records: int = CAPTURE_FILE_RECORDS, queue_size: int = CAPTURE_QUEUE_SIZE):
+        self.directory = directory
+        self.file_records = file_records
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._file_count = 0
+
+        # Metrics
+        self.captured = 0
+        self.dropped = 0
+        self.failed = 0
+        self.files = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+        self._thread.start()
+        logger.info("Capture du trafic activee: %s (chemins %s)", self.directory, ", ".join(CAPTURE_PATHS))
+
+    def put(self, raw: dict):
+        try:
+            self._queue.put_nowait(raw)
+        except queue.Full:
+            self.dropped += 1
+
+    def _open(self):
+        name = time.strftime("capture-%Y%m%d-%H%M%S", time.gmtime()) + f"-{os.getpid()}-{self.files}.jsonl.gz"
+        self._file = gzip.open(os.path.join(self.directory, name), "wt", encoding="utf-8")
+        self._file_count = 0
+        self.files += 1
+
+    def _run(self):
+        while True:
+            raw = self._queue.get()
+            if raw is None:
+                break
+            try:
+                record = build_record(raw)
+                if self._file is None or self._file_count >= self.file_records:
+                    self._close()
+                    self._open()
+                self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+                self._file_count += 1
+                self.captured += 1
+            except Exception as e:
+                self.failed += 1
+                logger.warning("Enregistrement de capture ignore: %s", e)
+        self._close()
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stop(self):
+        """Writes the queued requests and closes the current file."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.running,
+            "queued": self._queue.qsize(),
+            "captured": self.captured,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "files": self.files,
+        }
+
+
+capture_writer = CaptureWriter()
+register_collector(stats_collector(
+    "traffic_capture", capture_writer.stats, counters=["captured", "dropped", "failed", "files"]
+))
+
+
+class TrafficCaptureMiddleware:
+    """ASGI middleware copying the captured requests (see module docstring) to the capture writer."""
+
+    def __init__(self, app, writer: CaptureWriter = capture_writer):
+        self.app = app
+        self.writer = writer
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or not self.writer.running
+            or not scope["path"].startswith(CAPTURE_PATHS)
+            or (CAPTURE_SAMPLE_RATE < 1.0 and random.random() >= CAPTURE_SAMPLE_RATE)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        arrived = time.time()
+        started = time.perf_counter()
+        body = bytearray()
+        response_body = bytearray()
+        state = {"status": None, "headers": {}, "truncated": False}
+        keep_response = scope["path"].startswith(_RESPONSE_BODY_PATHS)
+
+        async def receive_and_copy():
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                if len(body) + len(chunk) > CAPTURE_MAX_BODY_BYTES:
+                    state["truncated"] = True
+                body.extend(chunk[:max(0, CAPTURE_MAX_BODY_BYTES - len(body))])
+            return message
+
+        async def send_and_copy(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                for key, value in message.get("headers", []):
+                    if key.lower() in (b"x-conversation-id", b"content-type"):
+                        state["headers"][key.lower().decode()] = value.decode("latin-1")
+            elif message["type"] == "http.response.body" and keep_response and len(response_body) < _MAX_RESPONSE_BODY_BYTES:
+                response_body.extend(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_and_copy, send_and_copy)
+        finally:
+            self.writer.put({
+                "ts": arrived,
+                "duration": time.perf_counter() - started,
+                "method": scope["method"],
+                "path": scope["path"],
+                "query": scope.get("query_string", b"").decode("latin-1"),
+                "headers": dict(scope["headers"]),
+                "body": bytes(body),
+                "truncated": state["truncated"],
+                "status": state["status"],
+                "response_headers": state["headers"],
+                # Streamed chat responses are not kept (the header carries the id)
+                "response_body": bytes(response_body) if "x-conversation-id" not in state["headers"] else b"",
+            })
@@ -0,0 +1,77 @@
+"""
+Per-request time budgets.
+
+A Deadline is created when the request arrives, from the X-Request-Budget-Ms
+header (clamped to [REQUEST_BUDGET_MIN_MS, REQUEST_BUDGET_MAX_MS]) or the
+endpoint's default, and passed down the pipeline. Optional stages check
+`remaining()` against their expected duration (DurationEstimate) and are
+skipped when they cannot finish in time.
+"""
+import math
+import os
+import threading
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import Header
+
+load_dotenv()
+
+PREDICT_BUDGET_MS = float(os.getenv("PREDICT_BUDGET_MS", "10000"))
+REQUEST_BUDGET_MIN_MS = float(os.getenv("REQUEST_BUDGET_MIN_MS", "500"))
+REQUEST_BUDGET_MAX_MS = float(os.getenv("REQUEST_BUDGET_MAX_MS", "30000"))
+
+BUDGET_HEADER = "X-Request-Budget-Ms"
+
+
+class Deadline:
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.started = time.monotonic()
+        self.expires = self.started + budget
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+
+class DurationEstimate:
+    """Moving average (EWMA) of a stage duration, used to decide whether it fits a budget."""
+
+    def __init__(self, initial: float, alpha: float = 0.2):
+        self.value = initial
+        self.alpha = alpha
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.value += self.alpha * (seconds - self.value)
+
+
+def parse_budget_ms(value: Optional[str], default_ms: float) -> float:
+    """Budget in seconds from the header value (falls back to the default when invalid or not finite)."""
+    try:
+        budget_ms = float(value) if value is not None else default_ms
+    except ValueError:
+        budget_ms = default_ms
+    if not math.isfinite(budget_ms):
+        budget_ms = default_ms
+    return min(max(budget_ms, REQUEST_BUDGET_MIN_MS), REQUEST_BUDGET_MAX_MS) / 1000
+
+
+def deadline_dependency(default_ms: float):
+    """FastAPI dependency creating the request Deadline (see BUDGET_HEADER)."""
+
+    async def dependency(x_request_budget_ms: Optional[str] = Header(None)) -> Deadline:
+        return Deadline(parse_budget_ms(x_request_budget_ms, default_ms))
+
+    return dependency
+
+
+predict_deadline = deadline_dependency(PREDICT_BUDGET_MS)
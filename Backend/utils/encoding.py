@@ -0,0 +1,196 @@
+"""
+Response encoding: fast JSON, optional msgpack, gzip / brotli compression.
+
+    from utils.encoding import encoded_response
+    return encoded_response(request, payload)
+
+`encoded_response` serialises a plain dict with orjson (UTF-8, no escaping,
+no jsonable_encoder pass) or, when the client sends `Accept: application/msgpack`,
+with msgpack. CompressionMiddleware then compresses responses larger than
+COMPRESSION_MIN_BYTES with brotli or gzip, following Accept-Encoding.
+
+orjson, msgpack and brotli are optional: without them JSON falls back to the
+standard library, msgpack is never selected and only gzip is offered.
+"""
+import gzip
+import json
+import os
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import Request
+from fastapi.responses import Response
+
+from utils.metrics import counter
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+load_dotenv()
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+# Dynamic responses: a low brotli quality is already smaller than gzip and much cheaper than 11
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+JSON_MEDIA = "application/json"
+MSGPACK_MEDIA = "application/msgpack"
+_MSGPACK_MEDIAS = (MSGPACK_MEDIA, "application/x-msgpack")
+
+# Content types worth compressing (event streams are left alone: they must not be buffered)
+_COMPRESSIBLE = (b"application/json", b"application/msgpack", b"text/plain", b"text/html", b"application/javascript")
+
+RESPONSE_BYTES = counter(
+    "compressed_response_bytes_total", "Bytes of compressed responses before and after compression", ["encoding", "size"]
+)
+
+
+def dumps_json(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_msgpack(data) -> bytes:
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def loads(body: bytes, content_type: str = JSON_MEDIA):
+    """Decodes a body produced by `encode` (JSON or msgpack)."""
+    if msgpack is not None and content_type.split(";")[0].strip() in _MSGPACK_MEDIAS:
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body)
+
+
+def _accepted(header: str) -> dict:
+    """{token: q} from an Accept / Accept-Encoding header."""
+    accepted = {}
+    for item in header.lower().split(","):
+        token, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if token:
+            accepted[token] = q
+    return accepted
+
+
+def wants_msgpack(accept: str) -> bool:
+    """True when the client prefers msgpack to JSON (and msgpack is available)."""
+    if msgpack is None or not accept:
+        return False
+    accepted = _accepted(accept)
+    msgpack_q = max(accepted.get(media, 0.0) for media in _MSGPACK_MEDIAS)
+    return msgpack_q > 0 and msgpack_q >= accepted.get(JSON_MEDIA, 0.0)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """"br" or "gzip" according to Accept-Encoding (brotli preferred on equal q), or None."""
+    accepted = _accepted(accept_encoding or "")
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_q = None, 0.0
+    for encoding in candidates:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: str, static: bool = False) -> bytes:
+    """Compresses with `encoding`; `static` bodies (cached once) get the maximum level."""
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if static else COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=9 if static else COMPRESSION_GZIP_LEVEL)
+
+
+def encode(request: Request, data) -> Tuple[bytes, str]:
+    """(body, media type) negotiated from the request's Accept header."""
+    if wants_msgpack(request.headers.get("accept", "")):
+        return dumps_msgpack(data), MSGPACK_MEDIA
+    return dumps_json(data), JSON_MEDIA
+
+
+def encoded_response(request: Request, data, status_code: int = 200, headers: Optional[dict] = None) -> Response:
+    """Response for a JSON-compatible dict, in the format negotiated with the client."""
+    body, media_type = encode(request, data)
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept"
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing complete (non-streamed) responses of at least
+    `minimum_size` bytes with brotli or gzip. Responses that are already
+    encoded (pre-compressed catalog) or streamed in several chunks pass through.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(dict(scope["headers"]).get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                headers = dict((k.lower(), v) for k, v in message.get("headers", []))
+                content_type = headers.get(b"content-type", b"")
+                if b"content-encoding" in headers or not content_type.startswith(_COMPRESSIBLE):
+                    passthrough = True
+                    await send(message)
+                else:
+                    # Wait for the body to decide
+                    start = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                # Streamed or small: sent as is
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            RESPONSE_BYTES.inc(len(body), encoding=encoding, size="original")
+            RESPONSE_BYTES.inc(len(compressed), encoding=encoding, size="compressed")
+            headers = [(k, v) for k, v in start.get("headers", []) if k.lower() not in (b"content-length", b"vary")]
+            vary = [v for k, v in start.get("headers", []) if k.lower() == b"vary"]
+            headers += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(compressed)).encode()),
+                (b"vary", b", ".join(vary + [b"Accept-Encoding"])),
+            ]
+            await send(dict(start, headers=headers))
+            await send({"type": "http.response.body", "body": compressed, "more_body": False})
+
+        await self.app(scope, receive, send_compressed)
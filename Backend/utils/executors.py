@@ -0,0 +1,222 @@
+"""
+Named, bounded thread pools, one per kind of blocking work.
+
+Blocking calls used to share anyio's default thread limiter, so a handful of
+slow LLM explanations (blocking HTTP calls with retry sleeps) could hold every
+worker thread and stall model inference. Each workload now has its own pool:
+
+    inference  model preprocessing + forward pass (torch)
+    io         blocking outbound calls (LLM explanations via `requests`)
+    auth       bcrypt hashing / verification (utils.password_hasher)
+    shadow     candidate model runs of the shadow mode (ml/model_registry.py)
+
+    from utils.executors import executors
+    result = await executors["inference"].run(predict_emotion, image)
+
+A pool runs at most `workers` jobs at a time and accepts at most `max_queue`
+more waiting ones; beyond that `run` raises ExecutorBusy right away instead of
+queueing. Jobs run in a copy of the caller's context (contextvars such as the
+per-request stage timings follow the job). Cancelling the awaiting task does
+not stop a job that already started; it keeps its worker until it returns.
+
+The inference pool defaults to as many workers as fit next to torch's
+intra-op threads (cpu_count // TORCH_NUM_THREADS), so concurrent forward
+passes don't oversubscribe the CPU. Each pool exposes running / queued /
+wait-time metrics under `executor_*{pool="..."}`.
+"""
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, TypeVar, Union
+
+from dotenv import load_dotenv
+
+from utils.metrics import histogram, register_collector, stats_collector
+
+load_dotenv()
+
+T = TypeVar("T")
+
+# 0 = derived from the CPU count and torch's intra-op threads
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", "32"))
+# 0 = keep torch's default (one thread per physical core)
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", "0"))
+BLOCKING_IO_WORKERS = int(os.getenv("BLOCKING_IO_WORKERS", "16"))
+BLOCKING_IO_MAX_QUEUE = int(os.getenv("BLOCKING_IO_MAX_QUEUE", "64"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+# Shadow runs are optional: a short queue, the rest is dropped
+SHADOW_WORKERS = int(os.getenv("SHADOW_WORKERS", "1"))
+SHADOW_MAX_QUEUE = int(os.getenv("SHADOW_MAX_QUEUE", "4"))
+# Chat suggestions (services/content_suggestions.py): query embeddings and index builds,
+# kept off the inference pool; two workers so a rebuild leaves one for the queries
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "2"))
+EMBEDDING_MAX_QUEUE = int(os.getenv("EMBEDDING_MAX_QUEUE", "8"))
+
+EXECUTOR_WAIT_SECONDS = histogram(
+    "executor_wait_seconds", "Time jobs spent queued before a worker thread picked them up", ["pool"]
+)
+
+
+class ExecutorBusy(Exception):
+    """Raised when a pool already has `workers + max_queue` pending jobs."""
+
+    def __init__(self, pool: str):
+        super().__init__(f"Executor '{pool}' is busy")
+        self.pool = pool
+
+
+def torch_threads() -> int:
+    """Intra-op threads used by each torch forward pass."""
+    if TORCH_NUM_THREADS > 0:
+        return TORCH_NUM_THREADS
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        return torch.get_num_threads()
+    return os.cpu_count() or 1
+
+
+def inference_workers() -> int:
+    if INFERENCE_WORKERS > 0:
+        return INFERENCE_WORKERS
+    return max(1, (os.cpu_count() or 1) // torch_threads())
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, workers: Union[int, Callable[[], int]], max_queue: int):
+        self.name = name
+        # A callable is resolved on first use (the inference size depends on torch being loaded)
+        self._workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+
+        # Metrics
+        self.completed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self._busy_total = 0.0
+        self._wait_total = 0.0
+        self._max_wait = 0.0
+
+    @property
+    def workers(self) -> int:
+        if callable(self._workers):
+            self._workers = max(1, self._workers())
+        return self._workers
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+            return self._executor
+
+    def submit(self, fn: Callable[..., T], *args) -> Future:
+        """Queues `fn(*args)` in the caller's context, or raises ExecutorBusy."""
+        workers = self.workers
+        with self._lock:
+            if self._pending >= workers + self.max_queue:
+                self.rejected += 1
+                raise ExecutorBusy(self.name)
+            self._pending += 1
+        submitted = time.perf_counter()
+        context = contextvars.copy_context()
+
+        def job():
+            started = time.perf_counter()
+            wait = started - submitted
+            EXECUTOR_WAIT_SECONDS.observe(wait, pool=self.name)
+            with self._lock:
+                self._running += 1
+                self._wait_total += wait
+                self._max_wait = max(self._max_wait, wait)
+            try:
+                return context.run(fn, *args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._busy_total += time.perf_counter() - started
+
+        try:
+            future = self._pool().submit(job)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future: Future):
+        # Called when the job returns, or when it is cancelled before starting
+        with self._lock:
+            self._pending -= 1
+            if future.cancelled():
+                self.cancelled += 1
+            else:
+                self.completed += 1
+
+    async def run(self, fn: Callable[..., T], *args) -> T:
+        """Runs `fn(*args)` in this pool and awaits its result."""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def stats(self) -> dict:
+        workers = self.workers
+        with self._lock:
+            done = self.completed or 1
+            return {
+                "workers": workers,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "max_queue": self.max_queue,
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+                "rejected": self.rejected,
+                "avg_duration_ms": round(self._busy_total / done * 1000, 1),
+                "avg_wait_ms": round(self._wait_total / done * 1000, 1),
+                "max_wait_ms": round(self._max_wait * 1000, 1),
+            }
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+class ExecutorRegistry:
+    def __init__(self):
+        self._executors: Dict[str, BoundedExecutor] = {}
+
+    def register(self, name: str, workers: Union[int, Callable[[], int]], max_queue: int) -> BoundedExecutor:
+        executor = self._executors[name] = BoundedExecutor(name, workers, max_queue)
+        register_collector(stats_collector(
+            "executor", executor.stats,
+            counters=["completed", "cancelled", "rejected"],
+            labels={"pool": name},
+        ))
+        return executor
+
+    def __getitem__(self, name: str) -> BoundedExecutor:
+        return self._executors[name]
+
+    def stats(self) -> dict:
+        return {name: executor.stats() for name, executor in self._executors.items()}
+
+    def shutdown(self):
+        for executor in self._executors.values():
+            executor.shutdown()
+
+
+executors = ExecutorRegistry()
+executors.register("inference", inference_workers, INFERENCE_MAX_QUEUE)
+executors.register("io", BLOCKING_IO_WORKERS, BLOCKING_IO_MAX_QUEUE)
+executors.register("auth", PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
+executors.register("shadow", SHADOW_WORKERS, SHADOW_MAX_QUEUE)
+executors.register("embedding", EMBEDDING_WORKERS, EMBEDDING_MAX_QUEUE)
@@ -9,6 +9,8 @@ load_dotenv()
 JWT_SECRET = os.getenv("JWT_SECRET")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 JWT_EXP_MIN = int(os.getenv("JWT_EXP_MIN", 1440))
+# Embed name/email as signed claims so get_current_user can skip the user lookup
+JWT_EMBED_PROFILE = os.getenv("JWT_EMBED_PROFILE", "false").lower() == "true"
 
 if not JWT_SECRET:
     raise ValueError("JWT_SECRET is not set in .env file")
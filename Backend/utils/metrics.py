@@ -0,0 +1,297 @@
+"""
+Lightweight in-process metrics with a Prometheus text exposition.
+
+    from utils.metrics import stage_timer, counter
+
+    with stage_timer("predict", "inference"):
+        ...
+    counter("explanation_source_total", "...", ["source"]).inc(source="llm")
+
+Recording is a dict update under a per-metric lock, cheap enough for the hot
+path. Values that already live elsewhere (cache stats, queue depths, thread
+pool occupancy) are read at scrape time through collectors registered with
+`register_collector`, so they cost nothing between scrapes.
+
+Stage timings are also collected per request when `track_stages()` is active
+(see utils.profiling), to build the Server-Timing response header.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# A collector returns (name, type, help, [(labels dict, value), ...]) tuples
+Sample = Tuple[Dict[str, str], float]
+Collected = Tuple[str, str, str, List[Sample]]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: tuple) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self._labels(k))} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self._labels(k))} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., +Inf count, sum]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for key, series in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                bucket_labels = dict(labels, le=_format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Collected]]] = []
+        self._lock = threading.Lock()
+
+    def get_or_create(self, cls, name: str, help: str, labelnames: Sequence[str] = (), **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Collected]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        # Collectors may contribute samples to the same family (e.g. one per cache),
+        # including families that also have directly recorded samples
+        families: Dict[str, Tuple[str, str, List[Sample]]] = {}
+        for collector in self._collectors:
+            for name, metric_type, help, samples in collector():
+                family = families.setdefault(name, (metric_type, help, []))
+                family[2].extend(samples)
+
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+            _, _, extra = families.pop(metric.name, (None, None, []))
+            for labels, value in extra:
+                lines.append(f"{metric.name}{_format_labels(labels)} {_format_value(value)}")
+
+        for name, (metric_type, help, samples) in families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    return registry.get_or_create(Counter, name, help, labelnames)
+
+
+def gauge(name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return registry.get_or_create(Gauge, name, help, labelnames)
+
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (), buckets: Optional[Sequence[float]] = None) -> Histogram:
+    return registry.get_or_create(Histogram, name, help, labelnames, buckets=buckets or DEFAULT_BUCKETS)
+
+
+STAGE_SECONDS = histogram(
+    "pipeline_stage_seconds",
+    "Time spent in each stage of the prediction and chat pipelines",
+    ["pipeline", "stage"],
+)
+
+
+# (stage, seconds) list of the current request; shared with worker threads through the copied context
+_request_stages: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_stages", default=None)
+
+
+def track_stages() -> List[Tuple[str, float]]:
+    """Starts collecting the stages timed in the current context and returns the (live) list."""
+    stages: List[Tuple[str, float]] = []
+    _request_stages.set(stages)
+    return stages
+
+
+def current_stages() -> List[Tuple[str, float]]:
+    """Stages timed so far in the current request (empty outside a tracked request)."""
+    return list(_request_stages.get() or ())
+
+
+def add_stages(stages: Iterable[Tuple[str, float]]):
+    """Adds stages timed in another context (e.g. a computation shared with other requests) to the current request."""
+    current = _request_stages.get()
+    if current is not None:
+        current.extend(stages)
+
+
+@contextmanager
+def stage_timer(pipeline: str, stage: str):
+    """Records the duration of the enclosed block in pipeline_stage_seconds."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, pipeline=pipeline, stage=stage)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((stage, elapsed))
+
+
+def stats_collector(
+    prefix: str,
+    stats: Callable[[], dict],
+    counters: Sequence[str] = (),
+    labels: Optional[Dict[str, str]] = None,
+    dict_labels: Optional[Dict[str, str]] = None,
+):
+    """
+    Builds a collector exposing the numeric fields of a `stats()` dict
+    (as returned by the caches and pools) as `<prefix>_<field>` metrics.
+    Fields listed in `counters` are exposed as counters, the others as gauges.
+    Nested dicts listed in `dict_labels` become one series per key, using the
+    given label name (e.g. {"rejected": "reason"}).
+    """
+    labels = labels or {}
+    dict_labels = dict_labels or {}
+
+    def collect():
+        for field, value in stats().items():
+            metric_type = "counter" if field in counters else "gauge"
+            name = f"{prefix}_{field}" + ("_total" if metric_type == "counter" else "")
+            if isinstance(value, dict) and field in dict_labels:
+                samples = [(dict(labels, **{dict_labels[field]: key}), v) for key, v in value.items()]
+                yield name, metric_type, f"{prefix} {field}", samples
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield name, metric_type, f"{prefix} {field}", [(labels, value)]
+
+    return collect
+
+
+def cache_collector(cache: str, stats: Callable[[], dict]):
+    """
+    Exposes a cache `stats()` dict (hits, misses, entries, evictions...) as
+    cache_lookups_total{cache,result}, cache_entries{cache} and cache_evictions_total{cache}.
+    """
+    def collect():
+        data = stats()
+        labels = {"cache": cache}
+        yield "cache_lookups_total", "counter", "Cache lookups, by cache and result", [
+            (dict(labels, result="hit"), data.get("hits", 0)),
+            (dict(labels, result="miss"), data.get("misses", 0)),
+        ]
+        if "entries" in data:
+            yield "cache_entries", "gauge", "Entries currently held, by cache", [(labels, data["entries"])]
+        if "evictions" in data:
+            yield "cache_evictions_total", "counter", "Entries evicted for size, by cache", [(labels, data["evictions"])]
+
+    return collect
+
+
+def register_collector(collector: Callable[[], Iterable[Collected]]):
+    registry.register_collector(collector)
@@ -0,0 +1,109 @@
+"""
+Password hashing off the event loop.
+
+bcrypt is deliberately slow (hundreds of ms per call at the default cost), so
+hashing and verification run in the dedicated, bounded "auth" pool of
+utils.executors (bcrypt releases the GIL) instead of inside the async
+handlers. When too many operations are already pending, new ones are
+rejected right away with PasswordHasherBusy instead of piling up.
+
+The bcrypt cost is set with BCRYPT_ROUNDS. Hashes created with a different
+cost are transparently rehashed on the next successful login
+(see verify_and_update). To choose a cost for the target machine:
+
+    python -m utils.password_hasher --benchmark 10 11 12 13
+"""
+import os
+import sys
+import time
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from passlib.context import CryptContext
+
+from utils.executors import executors, ExecutorBusy, PASSWORD_HASH_WORKERS
+from utils.metrics import register_collector, stats_collector
+
+load_dotenv()
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+
+def _make_context(rounds: int) -> CryptContext:
+    # min == max == default: any hash with another cost "needs update"
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+
+pwd_context = _make_context(BCRYPT_ROUNDS)
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool queue is full."""
+
+
+class PasswordHasher:
+    def __init__(self, executor_name: str = "auth"):
+        self._executor = executors[executor_name]
+        self.rehashed = 0
+
+    async def _run(self, fn, *args):
+        try:
+            return await self._executor.run(fn, *args)
+        except ExecutorBusy:
+            raise PasswordHasherBusy()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(pwd_context.verify, password, hashed_password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verifies a password. Returns (valid, new_hash) where new_hash is set when
+        the stored hash uses another bcrypt cost and should be replaced.
+        """
+        valid, new_hash = await self._run(pwd_context.verify_and_update, password, hashed_password)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def stats(self) -> dict:
+        # Pool occupancy is also exported as executor_*{pool="auth"}
+        return dict(self._executor.stats(), rounds=BCRYPT_ROUNDS, rehashed=self.rehashed)
+
+
+password_hasher = PasswordHasher()
+register_collector(stats_collector(
+    "password_hasher", password_hasher.stats, counters=["completed", "rejected", "rehashed"]
+))
+
+
+def benchmark(rounds_list, samples: int = 3) -> dict:
+    """Measures the average hash time (ms) for each bcrypt cost."""
+    results = {}
+    for rounds in rounds_list:
+        context = _make_context(rounds)
+        started = time.perf_counter()
+        for _ in range(samples):
+            context.hash("benchmark-password")
+        results[rounds] = (time.perf_counter() - started) / samples * 1000
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "--benchmark":
+        print("Usage: python -m utils.password_hasher --benchmark [ROUNDS ...]")
+        sys.exit(1)
+
+    rounds_list = [int(r) for r in sys.argv[2:]] or [10, 11, 12, 13]
+    print(f"Current BCRYPT_ROUNDS={BCRYPT_ROUNDS}, pool workers={PASSWORD_HASH_WORKERS}")
+    for rounds, ms in benchmark(rounds_list).items():
+        per_worker = 1000 / ms if ms else 0
+        print(f"rounds={rounds:2d}  {ms:8.1f} ms/hash  ~{per_worker * PASSWORD_HASH_WORKERS:6.1f} logins/s")
@@ -0,0 +1,200 @@
+"""
+Per-request timing and on-demand sampling profiler.
+
+Every HTTP response gets a Server-Timing header listing the stages timed with
+`stage_timer` while handling that request, e.g.
+
+    Server-Timing: decode;dur=3.2, preprocess;dur=11.0, inference;dur=84.5, content;dur=1.9, total;dur=131.7
+
+A fraction of requests (PROFILE_SAMPLE_RATE, changeable at runtime through
+/admin/profiling) can also be profiled: a background thread samples the
+Python stacks every PROFILE_INTERVAL_MS while the request runs and writes them
+in the "collapsed stacks" format to PROFILE_DIR, ready for flamegraph.pl or
+speedscope. A single request is profiled by sending the admin token in the
+X-Debug-Profile header. The file name is returned in X-Profile-Id. Only the
+PROFILE_KEEP most recent profiles are kept in PROFILE_DIR.
+
+Note: stacks are sampled for all threads of the process (event loop and
+worker pools), so concurrent requests show up in the profile too.
+"""
+import glob
+import hmac
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Callable, Dict, List
+
+from dotenv import load_dotenv
+
+from utils.metrics import track_stages
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+
+DEBUG_PROFILE_HEADER = b"x-debug-profile"
+
+# Idle threads (pool workers waiting for a job, the log writer...) are left out of the samples
+_IDLE_FILES = ("threading.py", "queue.py")
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads until stopped; output is in collapsed-stack format."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._on_stop = None
+
+    def start(self):
+        self._thread.start()
+
+    def stop_then(self, callback: Callable[["SamplingProfiler"], None]):
+        """Stops sampling without blocking; `callback(self)` runs on the sampler thread once it is done."""
+        self._on_stop = callback
+        self._stop.set()
+
+    def _run(self):
+        self._sample()
+        if self._on_stop is not None:
+            self._on_stop(self)
+
+    def _sample(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident or os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class ProfilingSettings:
+    """Runtime-adjustable profiling switch (see routes/admin.py)."""
+
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.sample_rate = sample_rate
+        self.interval_ms = interval_ms
+        self.profiled = 0
+
+    def should_profile(self, headers: Dict[bytes, bytes]) -> bool:
+        debug = headers.get(DEBUG_PROFILE_HEADER)
+        if debug is not None and ADMIN_TOKEN and hmac.compare_digest(debug.decode("latin-1"), ADMIN_TOKEN):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def as_dict(self) -> dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "interval_ms": self.interval_ms,
+            "output_dir": os.path.abspath(PROFILE_DIR),
+            "profiled_requests": self.profiled,
+        }
+
+
+profiling_settings = ProfilingSettings()
+
+
+def server_timing(stages: List[tuple], total: float) -> str:
+    """Formats the stages (summed by name, in first-seen order) as a Server-Timing value."""
+    durations: Dict[str, float] = {}
+    for stage, seconds in stages:
+        durations[stage] = durations.get(stage, 0.0) + seconds
+    durations["total"] = total
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items())
+
+
+def _profile_name(method: str, path: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_") or "root"
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{method.lower()}-{slug}-{uuid.uuid4().hex[:8]}.folded"
+
+
+def _prune_profiles():
+    """Removes the oldest profiles beyond PROFILE_KEEP."""
+    profiles = sorted(glob.glob(os.path.join(PROFILE_DIR, "*.folded")), key=os.path.getmtime, reverse=True)
+    for path in profiles[PROFILE_KEEP:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _write_profile(profiler: SamplingProfiler, name: str):
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, name), "w") as f:
+            f.write(profiler.collapsed())
+    except OSError as e:
+        logger.warning("Could not write profile %s: %s", name, e)
+        return
+    _prune_profiles()
+
+
+class RequestTimingMiddleware:
+    """ASGI middleware adding Server-Timing (and profiling sampled requests)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        stages = track_stages()
+        profiler = profile_name = None
+        if profiling_settings.should_profile(dict(scope["headers"])):
+            profiling_settings.profiled += 1
+            profile_name = _profile_name(scope["method"], scope["path"])
+            profiler = SamplingProfiler(profiling_settings.interval_ms / 1000)
+            profiler.start()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                value = server_timing(stages, time.perf_counter() - started)
+                headers.append((b"server-timing", value.encode("latin-1")))
+                if profile_name:
+                    headers.append((b"x-profile-id", profile_name.encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if profiler is not None:
+                elapsed = time.perf_counter() - started
+
+                def finish(profiler: SamplingProfiler):
+                    _write_profile(profiler, profile_name)
+                    logger.info(
+                        "Profiled %s %s (%.0f ms, %d samples) -> %s",
+                        scope["method"], scope["path"], elapsed * 1000, sum(profiler.samples.values()), profile_name,
+                    )
+
+                # Joining the sampler and writing the file happen off the event loop
+                profiler.stop_then(finish)
@@ -2,6 +2,16 @@
 Utility functions for parsing and formatting Islamic content
 """
 import re
+import unicodedata
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, without accents / harakat or punctuation, single spaces."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
 
 def parse_ayah(ayah_full: str) -> dict:
     """
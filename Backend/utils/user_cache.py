@@ -0,0 +1,104 @@
+"""
+Cache of verified access tokens -> authenticated user.
+
+get_current_user runs on every protected request; with this cache a known
+token is resolved without JWT decoding or a MongoDB round trip. Entries are
+bounded (LRU), expire after USER_CACHE_TTL_SECONDS and never outlive the
+token's own `exp` claim.
+
+Code that updates or deletes a user must call `user_cache.invalidate_user(user_id)`
+so that the next request reloads the user (today: the password rehash in
+auth/auth_router.py `login`). The cache is per process: other workers keep
+serving their copy until it expires, so USER_CACHE_TTL_SECONDS bounds how long
+a change can take to be seen everywhere.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+from dotenv import load_dotenv
+
+from models.user_model import UserOut
+from utils.metrics import cache_collector, register_collector
+
+load_dotenv()
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+
+
+class UserCache:
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # token -> (expires, user_id, user)
+        self._tokens_by_user: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, token: str) -> Optional[UserOut]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= time.time():
+                self._remove(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, token: str, user_id: str, user: UserOut, token_exp: Optional[float] = None):
+        expires = time.time() + self.ttl
+        if token_exp is not None:
+            expires = min(expires, float(token_exp))
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = (expires, user_id, user)
+            self._tokens_by_user.setdefault(user_id, set()).add(token)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: str):
+        """Drops every cached token of a user (call after updating or deleting it)."""
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+            self.invalidations += 1
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry[1])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry[1]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+            }
+
+
+user_cache = UserCache()
+register_collector(cache_collector("user", user_cache.stats))